@@ -1,13 +1,16 @@
 from django.contrib import admin
+from django.conf import settings
 from django import forms
-from django.db.models import Count, Sum
-from django.db.models.functions import TruncMonth, TruncDay, TruncHour
+from django.db.models import Sum
 from django.template.response import TemplateResponse
 from django.urls import path
 from datetime import date, datetime, time, timedelta
 from django.utils import timezone
 
-from .models import Product, Order, OrderItem, Category, Customer, Review, ReviewReply, SiteVisit, STATUS_CHOICES, Flavor, ProductImage, ProductVariant, NewsletterSubscriber
+from .models import Product, Order, OrderItem, Category, Customer, Review, ReviewReply, SiteVisit, STATUS_CHOICES, Flavor, ProductImage, ProductVariant, NewsletterSubscriber, PaymentCallback, PaymentEvent
+from .models import StatsCustomerDay, StatsProductRollup, StatsRollup, StatsStatusRollup
+from .payment_inbox import inbox_stats, requeue
+from . import profiling
 
 
 UKR_MONTHS = {
@@ -71,12 +74,6 @@ def _format_ukr_month(month_date):
     return f'{month_name} {month_date.year}'
 
 
-def _normalize_month_bucket(bucket_value):
-    if hasattr(bucket_value, 'date'):
-        bucket_value = bucket_value.date()
-    return bucket_value.replace(day=1)
-
-
 def _build_period_axis(period, selected_month=None):
     now = timezone.localtime()
 
@@ -141,113 +138,68 @@ def admin_statistics_view(request):
     period_start_dt = axis['start_dt']
     period_end_dt = axis['end_dt']
 
-    orders_period_qs = Order.objects.filter(created_at__gte=period_start_dt, created_at__lt=period_end_dt)
-    visits_period_qs = SiteVisit.objects.filter(created_at__gte=period_start_dt, created_at__lt=period_end_dt)
-    registered_visits_qs = visits_period_qs.filter(customer__isnull=False)
+    # Дашборд читає лише зведення (shop/statistics.py): погодинні для дня, денні для решти
+    granularity = 'hour' if period == 'day' else 'day'
+    rollup_filter = {'granularity': granularity, 'bucket__gte': period_start_dt, 'bucket__lt': period_end_dt}
+    rollups = list(StatsRollup.objects.filter(**rollup_filter))
 
     if period == 'day':
-        orders_grouped = (
-            orders_period_qs
-            .annotate(bucket=TruncHour('created_at'))
-            .values('bucket')
-            .annotate(orders_count=Count('id'), revenue_sum=Sum('total'))
-            .order_by('bucket')
-        )
-        visits_grouped = (
-            visits_period_qs
-            .annotate(bucket=TruncHour('created_at'))
-            .values('bucket')
-            .annotate(visits_count=Count('session_key', distinct=True))
-            .order_by('bucket')
-        )
-
-        orders_map = {
-            item['bucket'].replace(minute=0, second=0, microsecond=0): item
-            for item in orders_grouped
-            if item.get('bucket')
-        }
-        visits_map = {
-            item['bucket'].replace(minute=0, second=0, microsecond=0): item['visits_count']
-            for item in visits_grouped
-            if item.get('bucket')
-        }
+        def point_of(bucket):
+            return timezone.localtime(bucket)
     elif period in {'week', 'month'}:
-        orders_grouped = (
-            orders_period_qs
-            .annotate(bucket=TruncDay('created_at'))
-            .values('bucket')
-            .annotate(orders_count=Count('id'), revenue_sum=Sum('total'))
-            .order_by('bucket')
-        )
-        visits_grouped = (
-            SiteVisit.objects
-            .filter(visit_date__gte=points[0], visit_date__lt=period_end_dt.date())
-            .values('visit_date')
-            .annotate(visits_count=Count('id'))
-            .order_by('visit_date')
-        )
-
-        orders_map = {
-            item['bucket'].date(): item
-            for item in orders_grouped
-            if item.get('bucket')
-        }
-        visits_map = {
-            item['visit_date']: item['visits_count']
-            for item in visits_grouped
-            if item.get('visit_date')
-        }
+        def point_of(bucket):
+            return timezone.localtime(bucket).date()
     else:
-        orders_grouped = (
-            orders_period_qs
-            .annotate(bucket=TruncMonth('created_at'))
-            .values('bucket')
-            .annotate(orders_count=Count('id'), revenue_sum=Sum('total'))
-            .order_by('bucket')
-        )
-        visits_grouped = (
-            SiteVisit.objects
-            .filter(visit_date__gte=points[0], visit_date__lt=period_end_dt.date())
-            .annotate(bucket=TruncMonth('visit_date'))
-            .values('bucket')
-            .annotate(visits_count=Count('id'))
-            .order_by('bucket')
-        )
-
-        orders_map = {
-            _normalize_month_bucket(item['bucket']): item
-            for item in orders_grouped
-            if item.get('bucket')
-        }
-        visits_map = {
-            _normalize_month_bucket(item['bucket']): item['visits_count']
-            for item in visits_grouped
-            if item.get('bucket')
-        }
+        def point_of(bucket):
+            return timezone.localtime(bucket).date().replace(day=1)
+
+    orders_map = {}
+    revenue_map = {}
+    visits_map = {}
+    registered_visits = 0
+    for rollup in rollups:
+        point = point_of(rollup.bucket)
+        orders_map[point] = orders_map.get(point, 0) + rollup.orders_count
+        revenue_map[point] = revenue_map.get(point, 0) + rollup.revenue
+        visits_map[point] = visits_map.get(point, 0) + rollup.visits
+        registered_visits += rollup.registered_visits
 
     chart_labels = axis['labels']
-    orders_series = [int(orders_map.get(point, {}).get('orders_count', 0) or 0) for point in points]
-    revenue_series = [float(orders_map.get(point, {}).get('revenue_sum', 0) or 0) for point in points]
-    visits_series = [int(visits_map.get(point, 0) or 0) for point in points]
+    orders_series = [orders_map.get(point, 0) for point in points]
+    revenue_series = [float(revenue_map.get(point, 0)) for point in points]
+    visits_series = [visits_map.get(point, 0) for point in points]
 
     status_map = dict(STATUS_CHOICES)
     status_breakdown = list(
-        orders_period_qs
+        StatsStatusRollup.objects
+        .filter(**rollup_filter)
         .values('status')
-        .annotate(count=Count('id'))
+        .annotate(count=Sum('orders_count'))
         .order_by('-count')
     )
     status_labels = [status_map.get(item['status'], item['status']) for item in status_breakdown]
     status_values = [item['count'] for item in status_breakdown]
 
     top_products = list(
-        OrderItem.objects
-        .filter(order__created_at__gte=period_start_dt, order__created_at__lt=period_end_dt)
+        StatsProductRollup.objects
+        .filter(**rollup_filter)
         .values('product__name')
-        .annotate(total_qty=Sum('quantity'))
+        .annotate(total_qty=Sum('units'))
         .order_by('-total_qty')[:5]
     )
 
+    # Унікальні покупці рахуються по днях, тож для періоду "день" беруться повні дні вікна
+    registered_users_count = (
+        StatsCustomerDay.objects
+        .filter(
+            day__gte=timezone.localtime(period_start_dt).date(),
+            day__lte=timezone.localtime(period_end_dt - timedelta(microseconds=1)).date(),
+        )
+        .values('customer_id')
+        .distinct()
+        .count()
+    )
+
     context = {
         **admin.site.each_context(request),
         'title': 'Статистика магазину',
@@ -270,18 +222,35 @@ def admin_statistics_view(request):
         'status_values': status_values,
         'top_products': top_products,
         'total_visits': sum(visits_series),
-        'registered_visits': registered_visits_qs.count(),
-        'registered_users_count': registered_visits_qs.values('customer_id').distinct().count(),
-        'total_orders': orders_period_qs.count(),
-        'total_revenue': orders_period_qs.aggregate(total=Sum('total')).get('total') or 0,
+        'registered_visits': registered_visits,
+        'registered_users_count': registered_users_count,
+        'total_orders': sum(orders_series),
+        'total_revenue': sum(revenue_map.values()),
     }
     return TemplateResponse(request, 'admin/shop_statistics.html', context)
 
 
+def admin_performance_view(request):
+    if request.method == 'POST' and request.POST.get('action') == 'clear':
+        profiling.sample_buffer.clear()
+    samples = profiling.sample_buffer.samples()
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Профілювання запитів',
+        'profiling_enabled': settings.QUERY_PROFILING,
+        'buffer_size': settings.QUERY_PROFILING_BUFFER_SIZE,
+        'sample_count': len(samples),
+        'report': profiling.view_report(samples),
+        'slowest': sorted(samples, key=lambda sample: sample.total, reverse=True)[:20],
+    }
+    return TemplateResponse(request, 'admin/shop_performance.html', context)
+
+
 def _extend_admin_urls(existing_get_urls):
     def get_urls():
         custom_urls = [
             path('statistics/', admin.site.admin_view(admin_statistics_view), name='shop_admin_statistics'),
+            path('performance/', admin.site.admin_view(admin_performance_view), name='shop_admin_performance'),
         ]
         return custom_urls + existing_get_urls()
     return get_urls
@@ -311,6 +280,14 @@ def _extend_admin_app_list(existing_get_app_list):
                 'view_only': True,
                 'perms': {'add': False, 'change': False, 'delete': False, 'view': True},
             })
+            models.append({
+                'name': 'Профілювання запитів',
+                'object_name': 'ShopPerformance',
+                'admin_url': '/admin/performance/',
+                'add_url': None,
+                'view_only': True,
+                'perms': {'add': False, 'change': False, 'delete': False, 'view': True},
+            })
             models.sort(key=lambda item: item.get('name', ''))
             break
 
@@ -451,8 +428,13 @@ class ProductAdmin(admin.ModelAdmin):
     readonly_fields = ('display_available_stock',)
     inlines = [ProductImageInline, ProductVariantInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category', 'listing_summary')
+
     def display_available_stock(self, obj):
-        stock = obj.get_available_stock()
+        # Залишок береться зі зведення товару, без окремих запитів на кожен рядок
+        summary = getattr(obj, 'listing_summary', None)
+        stock = summary.total_stock if summary else obj.get_available_stock()
         return f'{stock} шт.'
     display_available_stock.short_description = 'Кількість в наявності'
 
@@ -485,6 +467,70 @@ class OrderAdmin(admin.ModelAdmin):
         return tuple(readonly)
 
 
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('liqpay_order_id', 'status', 'order', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('liqpay_order_id',)
+    readonly_fields = ('liqpay_order_id', 'status', 'payload', 'order', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PaymentCallback)
+class PaymentCallbackAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/shop/paymentcallback/change_list.html'
+    list_display = (
+        'id', 'received_at', 'display_status', 'attempts', 'next_attempt_at', 'processed_at', 'display_latency',
+        'last_error',
+    )
+    list_filter = (
+        ('processed_at', admin.EmptyFieldListFilter), ('failed_at', admin.EmptyFieldListFilter), 'received_at',
+    )
+    readonly_fields = (
+        'data', 'signature', 'received_at', 'next_attempt_at', 'attempts', 'last_error', 'processed_at', 'failed_at',
+    )
+    actions = ['requeue_failed']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def display_status(self, obj):
+        return obj.status
+    display_status.short_description = 'Стан'
+
+    def display_latency(self, obj):
+        return _format_duration(obj.latency)
+    display_latency.short_description = 'Затримка обробки'
+
+    def requeue_failed(self, request, queryset):
+        count = requeue(queryset)
+        self.message_user(request, f'Повернуто в чергу: {count}')
+    requeue_failed.short_description = 'Повернути невдалі в чергу'
+
+    def changelist_view(self, request, extra_context=None):
+        stats = inbox_stats()
+        for key in ('oldest_age', 'latency_p50', 'latency_p95', 'latency_max'):
+            stats[key] = _format_duration(stats[key])
+        stats['window_minutes'] = int(stats['window'].total_seconds() // 60)
+        extra_context = {**(extra_context or {}), 'inbox_stats': stats}
+        return super().changelist_view(request, extra_context)
+
+
+def _format_duration(value):
+    if value is None:
+        return '—'
+    seconds = value.total_seconds()
+    return f'{seconds * 1000:.0f} мс' if seconds < 10 else f'{seconds:.0f} с'
+
+
 class ReviewReplyInline(admin.TabularInline):
     model = ReviewReply
     extra = 1
@@ -534,7 +580,7 @@ class ReviewAdmin(admin.ModelAdmin):
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ('product', 'weight_label', 'flavor', 'price', 'old_price', 'stock_quantity', 'is_in_stock')
+    list_display = ('product', 'weight_label', 'flavor', 'price', 'old_price', 'stock_quantity', 'reserved_quantity', 'is_in_stock')
     list_filter = ('product', 'flavor')
     search_fields = ('product__name', 'flavor__name')
     fields = ('product', 'weight_label', 'flavor', 'price', 'old_price', 'stock_quantity')
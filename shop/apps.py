@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class ShopConfig(AppConfig):
     name = 'shop'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .payment_inbox import start_worker_on_first_request
+
+        if settings.PAYMENT_INBOX_WORKER == 'thread':
+            # Черга розбирається з першого запиту, а не з першого нового callback після перезапуску
+            request_started.connect(start_worker_on_first_request)
@@ -0,0 +1,80 @@
+"""
+Рейтинг бестселерів.
+
+Рейтинг (id товарів від найпопулярнішого) зберігається в кеші для кожного
+вікна: за весь час — з ProductListingSummary.units_sold, за останні 7/30
+днів — із денних зведень StatsProductRollup. Після створення замовлення
+рейтинг перераховується після коміту, а час життя запису в кеші та команда
+refresh_bestsellers зсувають вікна з плином часу.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ProductListingSummary, StatsProductRollup
+from .statistics import day_start
+
+# Вікно -> кількість днів (None — за весь час)
+BESTSELLER_WINDOWS = {
+    'all': None,
+    '30d': 30,
+    '7d': 7,
+}
+RANKING_SIZE = 12
+
+
+def _cache_key(window):
+    return f'shop:bestsellers:{window}'
+
+
+def compute_ranking(window, limit=RANKING_SIZE):
+    days = BESTSELLER_WINDOWS[window]
+    if days is None:
+        return list(
+            ProductListingSummary.objects
+            .filter(units_sold__gt=0)
+            .order_by('-units_sold', '-product__created_at')
+            .values_list('product_id', flat=True)[:limit]
+        )
+    since = day_start(timezone.localdate() - timedelta(days=days - 1))
+    return list(
+        StatsProductRollup.objects
+        .filter(granularity='day', bucket__gte=since)
+        .values('product_id')
+        .annotate(total=Sum('units'))
+        .filter(total__gt=0)
+        .order_by('-total', '-product_id')
+        .values_list('product_id', flat=True)[:limit]
+    )
+
+
+def refresh_bestsellers():
+    rankings = {window: compute_ranking(window) for window in BESTSELLER_WINDOWS}
+    cache.set_many(
+        {_cache_key(window): ranking for window, ranking in rankings.items()},
+        settings.BESTSELLERS_CACHE_TIMEOUT,
+    )
+    return rankings
+
+
+def get_bestseller_ids(window='all'):
+    """Id товарів від найпопулярнішого; перераховується лише якщо в кеші немає запису"""
+    if window not in BESTSELLER_WINDOWS:
+        raise ValueError(f'Невідоме вікно рейтингу: {window}')
+    ranking = cache.get(_cache_key(window))
+    if ranking is None:
+        ranking = compute_ranking(window)
+        cache.set(_cache_key(window), ranking, settings.BESTSELLERS_CACHE_TIMEOUT)
+    return ranking
+
+
+def schedule_bestsellers_refresh():
+    """
+    Перераховує рейтинг після коміту. Викликається після створення позицій
+    замовлення, тож виконується вже після оновлення зведень товарів і статистики.
+    """
+    transaction.on_commit(refresh_bestsellers)
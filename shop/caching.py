@@ -0,0 +1,49 @@
+"""
+Версії закешованих даних.
+
+Замість видалення кожного ключа окремо кеш-ключі містять версію, а зміна даних
+просто записує нову версію — старі записи перестають читатися і з часом
+витісняються. Версія — випадковий токен, тож навіть після витіснення самої
+версії з кешу стара версія не "повернеться".
+"""
+import uuid
+
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = 'shop:version:'
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def get_version(name):
+    key = VERSION_KEY_PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+def get_versions(names):
+    """Версії кількох наборів даних одним зверненням до кешу: {name: version}"""
+    keys = {VERSION_KEY_PREFIX + name: name for name in names}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, name in keys.items():
+        if key not in found:
+            # Версії бракує рідко (перший запит або витіснення) — тут add, як і в get_version
+            versions[name] = get_version(name)
+    return versions
+
+
+def bump_version(name):
+    version = _new_version()
+    cache.set(VERSION_KEY_PREFIX + name, version, None)
+    return version
+
+
+def bump_versions(names):
+    cache.set_many({VERSION_KEY_PREFIX + name: _new_version() for name in names}, None)
@@ -0,0 +1,360 @@
+"""
+Серверне сховище кошика.
+
+Кошик — рядок Cart (покупця або гостя) з позиціями CartItem. Сесія гостя
+зберігає лише id кошика, тож зміна кількості оновлює одну позицію і лічильник
+item_count, а не перезаписує весь словник кошика в сесії. Лічильник щоразу
+перераховується з позицій (recount_cart), у тому числі коли позиції видаляє
+каскад товару чи варіанту. Після входу гостьовий
+кошик зливається з кошиком покупця.
+
+Позиції адресуються типізованим ключем CartKey(product_id, variant_id);
+рядкове подання "pid_vid" лишилося для PendingCheckout.cart_snapshot.
+
+Ціни позицій і сума кошика кешуються разом із версією 'cart_prices' (її
+змінюють сигнали варіантів) та item_count, на якому їх пораховано. Зміна
+кількості оновлює кеш на місці — ціну нової позиції дочитує один запит, —
+а розбіжність версії чи лічильника веде до повного перерахунку.
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import bump_version, get_version
+from .models import Cart, CartItem, Product, ProductVariant
+
+SESSION_CART_KEY = 'cart_id'
+# Старий формат: словник {"pid_vid": кількість} прямо в сесії
+LEGACY_SESSION_KEY = 'cart'
+CART_PRICES_VERSION = 'cart_prices'
+CART_TOTALS_TIMEOUT = 60 * 60 * 24
+
+
+class CartKey(namedtuple('CartKey', ['product_id', 'variant_id'])):
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, product_id, variant_id=None):
+        return cls(int(product_id), int(variant_id) if variant_id else None)
+
+    @classmethod
+    def parse(cls, value):
+        """Ключ зі snapshot-рядка "pid_vid" або "pid"."""
+        product_id, _, variant_id = str(value).partition('_')
+        return cls.build(product_id, variant_id or None)
+
+    @property
+    def lookup(self):
+        return {'product_id': self.product_id, 'variant_id': self.variant_id}
+
+    def __str__(self):
+        if self.variant_id:
+            return f'{self.product_id}_{self.variant_id}'
+        return str(self.product_id)
+
+
+class CartStore:
+    """Кошик поточного запиту. Отримується через get_cart(request)."""
+
+    def __init__(self, request):
+        self.session = request.session
+        self.customer_id = request.session.get('customer_id')
+        self._state = None
+
+    def _load(self):
+        """(id кошика, item_count) або (None, 0); один запит на запит"""
+        if self._state is None:
+            if self.customer_id:
+                row = Cart.objects.filter(customer_id=self.customer_id).values_list('pk', 'item_count').first()
+            else:
+                cart_id = self.session.get(SESSION_CART_KEY)
+                row = Cart.objects.filter(
+                    pk=cart_id, customer__isnull=True,
+                ).values_list('pk', 'item_count').first() if cart_id else None
+            self._state = row or (None, 0)
+            if LEGACY_SESSION_KEY in self.session:
+                self._import_legacy()
+        return self._state
+
+    def _import_legacy(self):
+        legacy = self.session.pop(LEGACY_SESSION_KEY) or {}
+        for raw_key, quantity in legacy.items():
+            try:
+                key, quantity = CartKey.parse(raw_key), int(quantity or 0)
+            except (TypeError, ValueError):
+                continue
+            if quantity > 0:
+                self.change(key, quantity)
+
+    def _ensure_cart(self):
+        cart_id, _ = self._load()
+        if cart_id is None:
+            if self.customer_id:
+                cart, _ = Cart.objects.get_or_create(customer_id=self.customer_id)
+            else:
+                cart = Cart.objects.create()
+                self.session[SESSION_CART_KEY] = cart.pk
+            cart_id = cart.pk
+            self._state = (cart_id, cart.item_count)
+        return cart_id
+
+    @property
+    def count(self):
+        return self._load()[1]
+
+    def __bool__(self):
+        return self.count > 0
+
+    def items(self):
+        """{CartKey: кількість} у порядку додавання"""
+        cart_id, _ = self._load()
+        if cart_id is None:
+            return {}
+        return {
+            CartKey(product_id, variant_id): quantity
+            for product_id, variant_id, quantity in (
+                CartItem.objects.filter(cart_id=cart_id)
+                .order_by('pk')
+                .values_list('product_id', 'variant_id', 'quantity')
+            )
+        }
+
+    def quantity(self, key):
+        cart_id, _ = self._load()
+        if cart_id is None:
+            return 0
+        return CartItem.objects.filter(cart_id=cart_id, **key.lookup).values_list('quantity', flat=True).first() or 0
+
+    def change(self, key, delta):
+        """Змінює кількість позиції на delta (позиція з кількістю 0 видаляється). Повертає нову кількість."""
+        return self._write(key, lambda current: current + delta)
+
+    def set(self, key, quantity):
+        return self._write(key, lambda current: quantity)
+
+    def remove(self, key):
+        return self._write(key, lambda current: 0)
+
+    def _write(self, key, new_quantity):
+        if self._load()[0] is None and new_quantity(0) <= 0:
+            return 0
+        with transaction.atomic():
+            cart_id = self._ensure_cart()
+            line = (
+                CartItem.objects.select_for_update()
+                .filter(cart_id=cart_id, **key.lookup)
+                .values_list('pk', 'quantity')
+                .first()
+            )
+            current = line[1] if line else 0
+            quantity = max(int(new_quantity(current)), 0)
+            if quantity == current:
+                return quantity
+            if line is None:
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(cart_id=cart_id, quantity=quantity, **key.lookup)
+                except IntegrityError:
+                    # Паралельний запит щойно додав цю ж позицію
+                    return self._write(key, new_quantity)
+            elif quantity == 0:
+                # Лічильник перерахує сигнал post_delete позиції (recount_cart)
+                CartItem.objects.filter(pk=line[0]).delete()
+            else:
+                CartItem.objects.filter(pk=line[0]).update(quantity=quantity)
+            if quantity:
+                recount_cart(cart_id)
+        self._state = (cart_id, self._state[1] + quantity - current)
+        self._update_totals(key, quantity, quantity - current)
+        return quantity
+
+    def clear(self):
+        cart_id, _ = self._load()
+        if cart_id is not None:
+            CartItem.objects.filter(cart_id=cart_id).delete()
+            self._state = (cart_id, 0)
+            cache.delete(_totals_key(cart_id))
+
+    def lines(self):
+        """Позиції з товарами для сторінок кошика й оформлення; заодно оновлює кеш сум"""
+        lines, total = resolve_lines(self.items())
+        self._save_totals({line['key']: (line['price'], line['quantity']) for line in lines})
+        return lines, total
+
+    def totals(self):
+        """
+        ({CartKey: (ціна, кількість)}, сума) з кешу; якщо кеш застарів —
+        перераховується з позицій.
+        """
+        if self._load()[0] is None:
+            return {}, 0
+        entry = self._cached_totals()
+        if entry is None:
+            lines, total = self.lines()
+            return {line['key']: (line['price'], line['quantity']) for line in lines}, total
+        return entry['lines'], sum(price * quantity for price, quantity in entry['lines'].values())
+
+    def _cached_totals(self):
+        cart_id, count = self._load()
+        entry = cache.get(_totals_key(cart_id))
+        if entry is None or entry['version'] != get_version(CART_PRICES_VERSION) or entry['count'] != count:
+            return None
+        return entry
+
+    def _save_totals(self, lines):
+        cart_id, count = self._load()
+        if cart_id is not None:
+            cache.set(
+                _totals_key(cart_id),
+                {'version': get_version(CART_PRICES_VERSION), 'count': count, 'lines': lines},
+                CART_TOTALS_TIMEOUT,
+            )
+
+    def _update_totals(self, key, quantity, delta):
+        """Оновлює кеш сум після зміни однієї позиції (count уже включає delta)"""
+        cart_id, count = self._state
+        entry = cache.get(_totals_key(cart_id))
+        if (
+            entry is None or entry['version'] != get_version(CART_PRICES_VERSION)
+            or entry['count'] != count - delta
+        ):
+            return
+        lines = entry['lines']
+        if quantity == 0:
+            lines.pop(key, None)
+        elif key in lines:
+            lines[key] = (lines[key][0], quantity)
+        else:
+            price = _unit_price(key)
+            if price is None:
+                cache.delete(_totals_key(cart_id))
+                return
+            lines[key] = (price, quantity)
+        self._save_totals(lines)
+
+    def snapshot(self):
+        """Копія кошика у форматі PendingCheckout.cart_snapshot"""
+        return {str(key): quantity for key, quantity in self.items().items()}
+
+
+def _totals_key(cart_id):
+    return f'shop:cart_totals:{cart_id}'
+
+
+def _unit_price(key):
+    if key.variant_id:
+        return (
+            ProductVariant.objects.filter(id=key.variant_id, product_id=key.product_id)
+            .values_list('price', flat=True).first()
+        )
+    product = Product.objects.filter(id=key.product_id).first()
+    return product.get_min_price() if product else None
+
+
+def recount_cart(cart_id):
+    """
+    Перераховує item_count із позицій одним UPDATE. Абсолютне значення, а не приріст:
+    позиції зникають і каскадом (видалення товару чи варіанту), повз CartStore.
+    """
+    total = CartItem.objects.filter(cart_id=OuterRef('pk')).values('cart_id').annotate(
+        total=Sum('quantity'),
+    ).values('total')
+    Cart.objects.filter(pk=cart_id).update(
+        item_count=Coalesce(Subquery(total), Value(0)), updated_at=timezone.now(),
+    )
+
+
+def invalidate_cart_prices():
+    bump_version(CART_PRICES_VERSION)
+
+
+def purge_guest_carts(older_than):
+    """
+    Видаляє гостьові кошики, не змінювані з older_than. Сесії, що на них посилаються,
+    на той час уже прострочені (GUEST_CART_RETENTION не менший за SESSION_COOKIE_AGE);
+    якщо ж ні — CartStore просто почне новий кошик.
+    """
+    _, deleted = Cart.objects.filter(customer__isnull=True, updated_at__lt=older_than).delete()
+    return deleted.get(Cart._meta.label, 0)
+
+
+def get_cart(request):
+    """Кошик запиту; створюється один раз на запит"""
+    store = request.__dict__.get('_cart_store')
+    if store is None or store.customer_id != request.session.get('customer_id'):
+        store = request._cart_store = CartStore(request)
+    return store
+
+
+def resolve_lines(items):
+    """
+    Позиції кошика з товарами, варіантами та цінами: (список позицій, сума).
+    Позиції товарів чи варіантів, яких уже немає, пропускаються.
+    """
+    product_ids = {key.product_id for key in items}
+    variant_ids = {key.variant_id for key in items if key.variant_id}
+    products = {p.id: p for p in Product.objects.filter(id__in=product_ids)} if product_ids else {}
+    variants = {
+        v.id: v for v in ProductVariant.objects.filter(id__in=variant_ids).select_related('flavor')
+    } if variant_ids else {}
+
+    lines = []
+    total = 0
+    for key, quantity in items.items():
+        product = products.get(key.product_id)
+        variant = variants.get(key.variant_id) if key.variant_id else None
+        if product is None or (key.variant_id and variant is None):
+            continue
+        price = variant.price if variant else product.get_min_price()
+        subtotal = price * quantity
+        total += subtotal
+        lines.append({
+            'key': key,
+            'product': product,
+            'variant': variant,
+            'flavor': variant.flavor if variant else None,
+            'weight_label': variant.weight_label if variant else '',
+            'quantity': quantity,
+            'subtotal': subtotal,
+            'price': price,
+            'cart_key': str(key),
+        })
+    return lines, total
+
+
+def merge_guest_cart(request, customer):
+    """
+    Переносить гостьовий кошик сесії до кошика покупця (кількості однакових
+    позицій додаються). Викликається до запису customer_id у сесію.
+    """
+    guest_cart_id = request.session.pop(SESSION_CART_KEY, None)
+    legacy = request.session.get(LEGACY_SESSION_KEY)
+    if not guest_cart_id and not legacy:
+        return
+    guest_items = {}
+    if guest_cart_id:
+        guest_items = {
+            CartKey(product_id, variant_id): quantity
+            for product_id, variant_id, quantity in (
+                CartItem.objects.filter(cart_id=guest_cart_id, cart__customer__isnull=True)
+                .values_list('product_id', 'variant_id', 'quantity')
+            )
+        }
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(customer=customer)
+        store = CartStore(request)
+        store.customer_id = customer.pk
+        store._state = (cart.pk, cart.item_count)
+        if legacy:
+            store._import_legacy()
+        for key, quantity in guest_items.items():
+            store.change(key, quantity)
+        if guest_cart_id:
+            Cart.objects.filter(pk=guest_cart_id, customer__isnull=True).delete()
+    cache.delete(_totals_key(cart.pk))
+    request.__dict__.pop('_cart_store', None)
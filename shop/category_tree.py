@@ -0,0 +1,112 @@
+"""
+Дерево категорій у пам'яті процесу.
+
+Усі категорії завантажуються одним запитом у незмінні вузли CategoryNode, а для
+кожної заздалегідь рахується множина id нащадків (closure), тож меню, фільтр
+каталогу й адмінка не ходять у базу за деревом. Після збереження чи видалення категорії сигнали
+змінюють версію 'category_tree', і дерево перебудовується при наступному
+зверненні (у кожному процесі окремо).
+"""
+import threading
+from collections import namedtuple
+
+from .caching import bump_version, get_version
+from .models import Category
+
+CATEGORY_TREE_VERSION = 'category_tree'
+
+
+class CategoryNode(namedtuple('CategoryNode', ['id', 'name', 'description', 'parent_id', 'children'])):
+    """
+    Вузол дерева. Дерево спільне для всіх запитів і потоків процесу, тому вузли
+    незмінні й не є екземплярами Category: їх не можна випадково зберегти чи змінити.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryTree:
+    def __init__(self, rows):
+        """rows — (id, name, description, parent_id) усіх категорій"""
+        rows = {row[0]: row for row in rows}
+        child_ids = {category_id: [] for category_id in rows}
+        for category_id, _, _, parent_id in rows.values():
+            if parent_id in rows:
+                child_ids[parent_id].append(category_id)
+
+        self.by_id = {}
+        for category_id in rows:
+            self._build_node(category_id, rows, child_ids)
+        self.roots = [self.by_id[category_id] for category_id, row in rows.items() if row[3] not in rows]
+
+        self._descendants = {}
+        for category_id in self.by_id:
+            self._collect_descendants(category_id)
+
+    def _build_node(self, category_id, rows, child_ids):
+        if category_id not in self.by_id:
+            # Заглушка на випадок циклу в parent (його можна зберегти через адмінку)
+            self.by_id[category_id] = None
+            children = [self._build_node(child_id, rows, child_ids) for child_id in child_ids[category_id]]
+            self.by_id[category_id] = CategoryNode(*rows[category_id], tuple(filter(None, children)))
+        return self.by_id[category_id]
+
+    def _collect_descendants(self, category_id):
+        if category_id in self._descendants:
+            return self._descendants[category_id]
+        # Заглушка на випадок циклу в parent (його можна зберегти через адмінку)
+        self._descendants[category_id] = frozenset()
+        ids = set()
+        for child in self.by_id[category_id].children:
+            ids.add(child.id)
+            ids.update(self._collect_descendants(child.id))
+        self._descendants[category_id] = frozenset(ids)
+        return self._descendants[category_id]
+
+    def get(self, category_id):
+        try:
+            return self.by_id.get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def children(self, category_id):
+        category = self.by_id.get(category_id)
+        return category.children if category else ()
+
+    def descendant_ids(self, category_id):
+        """Id усіх підкатегорій на будь-якій глибині (без самої категорії)"""
+        return self._descendants.get(category_id, frozenset())
+
+    def subtree_ids(self, category_id):
+        """Id категорії разом з усіма її підкатегоріями"""
+        return self.descendant_ids(category_id) | {category_id}
+
+    def descendants(self, category_id):
+        return [self.by_id[descendant_id] for descendant_id in sorted(self.descendant_ids(category_id))]
+
+    def is_parent(self, category_id):
+        return bool(self.children(category_id))
+
+
+_tree = None
+_tree_version = None
+_tree_lock = threading.Lock()
+
+
+def get_category_tree():
+    global _tree, _tree_version
+    version = get_version(CATEGORY_TREE_VERSION)
+    if _tree is None or _tree_version != version:
+        with _tree_lock:
+            if _tree is None or _tree_version != version:
+                _tree = CategoryTree(
+                    Category.objects.order_by('id').values_list('id', 'name', 'description', 'parent_id')
+                )
+                _tree_version = version
+    return _tree
+
+
+def invalidate_category_tree():
+    bump_version(CATEGORY_TREE_VERSION)
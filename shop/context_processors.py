@@ -1,28 +1,58 @@
-from .models import Category
+from .cart_store import get_cart
+from .category_tree import get_category_tree
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject, lazy
 from urllib.parse import urlencode
 
+from .page_cache import PLACEHOLDER_CONTEXT, is_rendering_for_cache
 
-def cart_count(request):
-    cart = request.session.get('cart', {})
-    total_count = 0
-    for quantity in cart.values():
-        try:
-            total_count += int(quantity)
-        except (TypeError, ValueError):
-            continue
-    return {'cart_count': total_count}
 
+def _memoized(request, name, compute):
+    """
+    Значення обчислюється лише коли шаблон до нього звернеться, і один раз на запит:
+    кілька render_to_string в одному запиті (AJAX-каталог) ділять результат.
+    """
+    def value():
+        cache = request.__dict__.setdefault('_shop_context_cache', {})
+        if name not in cache:
+            cache[name] = compute(request)
+        return cache[name]
+    return value
 
-def global_categories(request):
-    """Додає батьківські категорії до контексту для відображення в header"""
-    categories = Category.objects.filter(parent__isnull=True).prefetch_related('subcategories')
-    return {'parent_categories': categories}
 
+def count_cart_items(request):
+    # Лічильник зберігається в рядку кошика — без читання позицій
+    return get_cart(request).count
 
-def get_catalog_url(request):
+
+def build_catalog_url(request):
     filters = request.session.get('catalog_filters', {})
     url = reverse('shop:catalog')
     if filters:
         url += '?' + urlencode(filters)
-    return {'get_catalog_url': url}
+    return url
+
+
+def cart_count(request):
+    return {'cart_count': SimpleLazyObject(_memoized(request, 'cart_count', count_cart_items))}
+
+
+def global_categories(request):
+    """Додає батьківські категорії до контексту для відображення в header"""
+    roots = _memoized(request, 'parent_categories', lambda request: get_category_tree().roots)
+    return {'parent_categories': SimpleLazyObject(roots)}
+
+
+def get_catalog_url(request):
+    # Рядок, а не SimpleLazyObject: шаблон екранує його як звичайний str
+    return {'get_catalog_url': lazy(_memoized(request, 'get_catalog_url', build_catalog_url), str)()}
+
+
+def page_cache_holes(request):
+    """
+    Під час рендеру для кешу сторінок (shop/page_cache.py) персональні значення
+    замінюються мітками. Має стояти останнім, щоб перекрити попередні процесори.
+    """
+    if is_rendering_for_cache(request):
+        return dict(PLACEHOLDER_CONTEXT)
+    return {}
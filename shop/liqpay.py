@@ -19,13 +19,20 @@ def _make_signature(private_key: str, data: str) -> str:
     return base64.b64encode(hashlib.sha1(raw).digest()).decode('utf-8')
 
 
+def sign_params(private_key: str, params: dict) -> tuple:
+    """Кодує params у `data` і підписує: (data, signature)"""
+    data = _encode_params(params)
+    return data, _make_signature(private_key, data)
+
+
 def build_checkout_form(public_key: str, private_key: str, order_id: int,
                         amount, description: str,
                         server_url: str, result_url: str,
-                        sandbox: bool = True) -> dict:
+                        sandbox: bool = True, checkout_url: str = '') -> dict:
     """
     Повертає словник із полями `data`, `signature` та `action_url`
     для побудови auto-submit form до LiqPay.
+    checkout_url замінює адресу LiqPay (наприклад, локальним симулятором).
     """
     params = {
         'version': '3',
@@ -42,13 +49,12 @@ def build_checkout_form(public_key: str, private_key: str, order_id: int,
     if sandbox:
         params['sandbox'] = '1'
 
-    data = _encode_params(params)
-    signature = _make_signature(private_key, data)
+    data, signature = sign_params(private_key, params)
 
     return {
         'data': data,
         'signature': signature,
-        'action_url': LIQPAY_CHECKOUT_URL,
+        'action_url': checkout_url or LIQPAY_CHECKOUT_URL,
     }
 
 
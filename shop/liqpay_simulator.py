@@ -0,0 +1,205 @@
+"""
+Локальний замінник LiqPay для навантажувальних тестів онлайн-оплати.
+
+Приймає POST з полями data/signature, як їх будує liqpay.build_checkout_form,
+перевіряє підпис і "проводить" платіж:
+- відповідає сторінкою з auto-submit формою на result_url (як редирект
+  покупця після оплати в LiqPay) з підписаними data/signature;
+- окремо, у фоновому пулі, надсилає той самий підписаний результат POST-ом
+  на server_url — із затримкою, можливими відмовами доставки і дублями.
+
+Параметри SimulatorConfig:
+- latency — (мін, макс) секунд "обробки платежу" перед відповіддю покупцю;
+- callback_delay — (мін, макс) секунд між оплатою і callback;
+- failure_rate — частка платежів зі статусом failure;
+- drop_rate — частка callback, які не доставляються зовсім;
+- duplicate_rate — частка callback, доставлених двічі.
+
+Сервер — http.server з потоком на запит, без зовнішніх залежностей.
+Запуск окремо: manage.py liqpay_simulator; у тестах навантаження —
+в процесі (benchmark_payments).
+"""
+import html
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import liqpay as liqpay_helper
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_PATH = '/api/3/checkout'
+
+
+SimulatorConfig = namedtuple(
+    'SimulatorConfig',
+    [
+        'private_key', 'latency', 'callback_delay', 'failure_rate', 'drop_rate', 'duplicate_rate',
+        'callback_workers', 'callback_timeout',
+    ],
+    defaults=[(0.0, 0.0), (0.0, 0.0), 0.0, 0.0, 0.0, 8, 10.0],
+)
+
+
+class LiqPaySimulator:
+    def __init__(self, config, host='127.0.0.1', port=0):
+        self.config = config
+        self._lock = threading.Lock()
+        self._payment_ids = iter(range(1, 10 ** 12))
+        self._callbacks = ThreadPoolExecutor(max_workers=config.callback_workers, thread_name_prefix='liqpay-callback')
+        self._in_flight = 0
+        self._idle = threading.Condition(self._lock)
+        self.stats = {
+            'payments': 0, 'failed_payments': 0, 'rejected': 0,
+            'callbacks_sent': 0, 'callbacks_failed': 0, 'callbacks_dropped': 0, 'callbacks_duplicated': 0,
+        }
+        self.server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def checkout_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}{CHECKOUT_PATH}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='liqpay-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._callbacks.shutdown(wait=True)
+
+    def wait_for_callbacks(self, timeout=None):
+        """Чекає, поки буде надіслано всі заплановані callback; False, якщо вийшов timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self.stats[key] += delta
+
+    def pay(self, data, signature):
+        """
+        Проводить платіж за формою build_checkout_form. Повертає
+        (result_url, data, signature) для переходу покупця або None, якщо підпис невірний.
+        """
+        config = self.config
+        if not liqpay_helper.verify_callback(config.private_key, data, signature):
+            self._count('rejected')
+            return None
+        params = liqpay_helper.decode_callback(data)
+        time.sleep(random.uniform(*config.latency))
+
+        failed = random.random() < config.failure_rate
+        with self._lock:
+            self.stats['payments'] += 1
+            self.stats['failed_payments'] += failed
+            payment_id = next(self._payment_ids)
+        if failed:
+            status = 'failure'
+        else:
+            status = 'sandbox' if params.get('sandbox') == '1' else 'success'
+        result_data, result_signature = liqpay_helper.sign_params(config.private_key, {
+            'version': 3,
+            'action': 'pay',
+            'payment_id': payment_id,
+            'status': status,
+            'order_id': params.get('order_id'),
+            'amount': float(params.get('amount') or 0),
+            'currency': params.get('currency'),
+            'public_key': params.get('public_key'),
+        })
+
+        server_url = params.get('server_url')
+        if server_url:
+            if random.random() < config.drop_rate:
+                self._count('callbacks_dropped')
+            else:
+                deliveries = 2 if random.random() < config.duplicate_rate else 1
+                if deliveries > 1:
+                    self._count('callbacks_duplicated')
+                for _ in range(deliveries):
+                    self._schedule_callback(server_url, result_data, result_signature)
+        return params.get('result_url'), result_data, result_signature
+
+    def _schedule_callback(self, server_url, data, signature):
+        with self._lock:
+            self._in_flight += 1
+        self._callbacks.submit(self._send_callback, server_url, data, signature)
+
+    def _send_callback(self, server_url, data, signature):
+        try:
+            time.sleep(random.uniform(*self.config.callback_delay))
+            body = urllib.parse.urlencode({'data': data, 'signature': signature}).encode()
+            try:
+                with urllib.request.urlopen(server_url, body, timeout=self.config.callback_timeout) as response:
+                    response.read()
+                self._count('callbacks_sent')
+            except (urllib.error.URLError, OSError) as exc:
+                self._count('callbacks_failed')
+                logger.warning('Callback на %s не доставлено: %s', server_url, exc)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+
+def result_page(result_url, data, signature):
+    """HTML з auto-submit формою на result_url — так LiqPay повертає покупця в магазин"""
+    return (
+        '<!DOCTYPE html><html><body onload="document.forms[0].submit()">'
+        f'<form method="POST" action="{html.escape(result_url)}">'
+        f'<input type="hidden" name="data" value="{html.escape(data)}">'
+        f'<input type="hidden" name="signature" value="{html.escape(signature)}">'
+        '<noscript><button type="submit">Повернутися до магазину</button></noscript>'
+        '</form></body></html>'
+    )
+
+
+def _handler_for(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if urllib.parse.urlsplit(self.path).path != CHECKOUT_PATH:
+                self._respond(404, 'Not found')
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+            result = simulator.pay(form.get('data', [''])[0], form.get('signature', [''])[0])
+            if result is None:
+                self._respond(400, 'invalid signature')
+            elif not result[0]:
+                self._respond(200, 'OK')
+            else:
+                self._respond(200, result_page(*result), content_type='text/html; charset=utf-8')
+
+        def _respond(self, status, body, content_type='text/plain; charset=utf-8'):
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
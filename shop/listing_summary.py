@@ -0,0 +1,139 @@
+"""
+Підтримка таблиці ProductListingSummary.
+
+Зведення перераховується для конкретних товарів кількома груповими запитами
+і записується одним upsert-ом, тож і точкове оновлення з сигналів, і повна
+перебудова командою rebuild_listing_summaries працюють однаково.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Avg, Count, F, Sum
+
+from .models import OrderItem, Product, ProductImage, ProductListingSummary, ProductVariant, Review
+from .product_cards import invalidate_product_cards
+
+SUMMARY_FIELDS = [
+    'min_price', 'min_old_price', 'total_stock', 'avg_rating',
+    'review_count', 'units_sold', 'main_image', 'updated_at',
+]
+
+
+def _first_by_product(rows):
+    """Перший рядок для кожного product_id (rows відсортовані за product_id)"""
+    first = {}
+    for row in rows:
+        first.setdefault(row['product_id'], row)
+    return first
+
+
+def _build_summaries(product_ids):
+    products = dict(
+        Product.objects.filter(id__in=product_ids)
+        .values_list('id', F('stock_quantity') - F('reserved_quantity'))
+    )
+    if not products:
+        return []
+    ids = list(products)
+
+    cheapest = _first_by_product(
+        ProductVariant.objects
+        .filter(product_id__in=ids)
+        .order_by('product_id', 'price', 'id')
+        .values('product_id', 'price', 'old_price')
+    )
+    variant_stock = {
+        row['product_id']: row['total'] or 0
+        for row in ProductVariant.objects.filter(product_id__in=ids)
+        .order_by().values('product_id').annotate(total=Sum(F('stock_quantity') - F('reserved_quantity')))
+    }
+    ratings = {
+        row['product_id']: row
+        for row in Review.objects.filter(product_id__in=ids)
+        .order_by().values('product_id').annotate(avg=Avg('rating'), count=Count('id'))
+    }
+    units_sold = {
+        row['product_id']: row['total'] or 0
+        for row in OrderItem.objects.filter(product_id__in=ids)
+        .order_by().values('product_id').annotate(total=Sum('quantity'))
+    }
+    images = _first_by_product(
+        ProductImage.objects
+        .filter(product_id__in=ids)
+        .order_by('product_id', 'order', 'id')
+        .values('product_id', 'image')
+    )
+
+    summaries = []
+    for product_id, stock_quantity in products.items():
+        variant = cheapest.get(product_id)
+        rating = ratings.get(product_id)
+        summaries.append(ProductListingSummary(
+            product_id=product_id,
+            min_price=variant['price'] if variant else 0,
+            min_old_price=variant['old_price'] if variant else None,
+            # Доступний залишок (без утриманих на час оплати); якщо варіантів немає — залишок товару
+            total_stock=variant_stock[product_id] if product_id in variant_stock else stock_quantity,
+            avg_rating=float(rating['avg']) if rating else 0.0,
+            review_count=rating['count'] if rating else 0,
+            units_sold=units_sold.get(product_id, 0),
+            main_image=images[product_id]['image'] if product_id in images else '',
+        ))
+    return summaries
+
+
+def refresh_listing_summaries(product_ids=None, batch_size=500):
+    """
+    Перераховує зведення для переданих товарів (або для всіх, якщо product_ids=None).
+    Повертає кількість оновлених зведень.
+    """
+    if product_ids is None:
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True).iterator()
+
+    updated = 0
+    batch = []
+    for product_id in product_ids:
+        batch.append(product_id)
+        if len(batch) >= batch_size:
+            updated += _write_summaries(batch)
+            batch = []
+    if batch:
+        updated += _write_summaries(batch)
+    return updated
+
+
+def _write_summaries(product_ids):
+    summaries = _build_summaries(product_ids)
+    if summaries:
+        ProductListingSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=SUMMARY_FIELDS,
+        )
+        # Картки каталогу будуються зі зведення — після запису їх треба перерендерити
+        invalidate_product_cards([summary.product_id for summary in summaries])
+    return len(summaries)
+
+
+_pending = threading.local()
+
+
+def schedule_listing_summary_refresh(product_ids):
+    """
+    Оновлює зведення після коміту поточної транзакції: до того часу всі зміни
+    (варіанти, списання залишку, видалення товару) вже будуть у базі. Товари
+    збираються до коміту, тож товар з кількома варіантами перераховується один раз.
+    """
+    product_ids = {product_id for product_id in product_ids if product_id}
+    if not product_ids:
+        return
+    _pending.__dict__.setdefault('product_ids', set()).update(product_ids)
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    # Перший колбек після коміту оновлює всі зібрані товари, решта нічого не робить
+    product_ids = _pending.__dict__.pop('product_ids', None)
+    if product_ids:
+        refresh_listing_summaries(sorted(product_ids))
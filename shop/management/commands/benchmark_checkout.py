@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from shop.cart_store import SESSION_CART_KEY
+from shop.middleware import VISITOR_COOKIE, VISITOR_COOKIE_SALT
+from shop.models import Cart, Category, Flavor, Order, OrderItem, Product, ProductVariant, SiteVisit
+from shop.statistics import refresh_range
+from shop.visit_tracking import flush_visits
+
+STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+OUT_OF_STOCK_MESSAGE = 'Недостатньо товару в наявності'
+CHECKOUT_FORM = {
+    'first_name': 'Навантаження',
+    'last_name': 'Тест',
+    'email': 'load@example.com',
+    'phone': '+380501234567',
+    'address': 'вул. Тестова, 1',
+    'city': 'Київ',
+    'postal_code': '01001',
+    'postal_branch': '1',
+    'delivery_method': 'np_branch',
+    'payment_method': 'cod',
+}
+
+
+def discard_clients(client_cookies, started_at):
+    """
+    Видаляє сесії, гостьові кошики й відвідування клієнтів бенчмарку
+    (client_cookies — {назва cookie: значення} для кожного клієнта) і
+    перераховує статистику з started_at, щоб навантаження не потрапило в звіти.
+    """
+    flush_visits()
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    visitor_signer = signing.get_cookie_signer(salt=VISITOR_COOKIE + VISITOR_COOKIE_SALT)
+    cart_ids, visit_keys = set(), set()
+    for cookies in client_cookies:
+        session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            session = session_store(session_key)
+            cart_ids.add(session.get(SESSION_CART_KEY))
+            session.delete()
+            if len(session_key) > 64:
+                # Як у SiteVisitTrackingMiddleware: довгий ключ signed_cookies зберігається як md5
+                session_key = hashlib.md5(session_key.encode('ascii')).hexdigest()
+            visit_keys.add(session_key)
+        if cookies.get(VISITOR_COOKIE):
+            try:
+                visit_keys.add(visitor_signer.unsign(cookies[VISITOR_COOKIE]))
+            except signing.BadSignature:
+                pass
+    Cart.objects.filter(pk__in=cart_ids - {None}, customer__isnull=True).delete()
+    SiteVisit.objects.filter(session_key__in=visit_keys, created_at__gte=started_at).delete()
+    refresh_range(started_at, timezone.now())
+
+
+class Command(BaseCommand):
+    help = (
+        'Стрес-тест оформлення: кілька потоків одночасно купують один варіант через view checkout '
+        '(оплата при отриманні). Показує пропускну здатність і перевіряє, що товар не продано понад залишок. '
+        'Працює з комітами в поточній базі; створені дані, сесії й відвідування видаляються в кінці.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=10, help='Спроб оформлення на потік')
+        parser.add_argument('--stock', type=int, default=50, help='Початковий залишок варіанту')
+        parser.add_argument('--quantity', type=int, default=1, help='Кількість в одному замовленні')
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        clients = []
+        category = Category.objects.create(name='Checkout benchmark')
+        flavor, _ = Flavor.objects.get_or_create(name='Checkout benchmark')
+        product = Product.objects.create(name='Checkout benchmark', category=category)
+        variant = ProductVariant.objects.create(
+            product=product, flavor=flavor, price=100, stock_quantity=options['stock'],
+        )
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], STORAGES=STATIC_STORAGES):
+                self._run(variant, clients, options)
+        finally:
+            Order.objects.filter(items__product=product).delete()
+            Cart.objects.filter(items__product=product).delete()
+            discard_clients([
+                {name: morsel.value for name, morsel in client.cookies.items()} for client in clients
+            ], started_at)
+            product.delete()
+            category.delete()
+
+    def _run(self, variant, clients, options):
+        results = {'placed': 0, 'rejected': 0, 'errors': 0}
+        latencies = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker():
+            client = Client()
+            with lock:
+                clients.append(client)
+            start_barrier.wait()
+            try:
+                for _ in range(options['attempts']):
+                    started = time.perf_counter()
+                    try:
+                        client.post(
+                            reverse('shop:add_to_cart', args=[variant.product_id]),
+                            {'variant_id': variant.id, 'quantity': options['quantity']},
+                        )
+                        started = time.perf_counter()
+                        response = client.post(reverse('shop:checkout'), CHECKOUT_FORM)
+                        # Редирект у кошик: товар закінчився ще при додаванні, кошик порожній
+                        if response.status_code == 302 or OUT_OF_STOCK_MESSAGE in response.content.decode():
+                            outcome = 'rejected'
+                        else:
+                            outcome = 'placed'
+                    except Exception:
+                        outcome = 'errors'
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        results[outcome] += 1
+                        latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        variant.refresh_from_db()
+        sold = OrderItem.objects.filter(variant=variant).aggregate(total=Sum('quantity'))['total'] or 0
+        orders = Order.objects.filter(items__variant=variant).count()
+        latencies.sort()
+        total = len(latencies)
+
+        self.stdout.write(f'База: {connection.vendor}, потоків: {options["threads"]}, спроб: {total}')
+        self.stdout.write(
+            f'Оформлено: {results["placed"]}, відмов (немає залишку): {results["rejected"]}, '
+            f'помилок: {results["errors"]}'
+        )
+        self.stdout.write(f'Пропускна здатність: {total / elapsed:.1f} оформлень/с')
+        if latencies:
+            self.stdout.write(
+                f'Затримка checkout, мс: p50 {latencies[total // 2] * 1000:.1f}, '
+                f'p95 {latencies[min(total - 1, int(total * 0.95))] * 1000:.1f}, '
+                f'max {latencies[-1] * 1000:.1f}'
+            )
+        self.stdout.write(
+            f'Залишок: {options["stock"]} -> {variant.stock_quantity}, продано: {sold}'
+        )
+        if orders != results['placed']:
+            self.stderr.write(self.style.WARNING(f'Замовлень у базі: {orders}, успішних відповідей: {results["placed"]}'))
+        if variant.stock_quantity < 0 or sold + variant.stock_quantity != options['stock']:
+            self.stderr.write(self.style.ERROR('ПЕРЕПРОДАЖ: продано більше, ніж було на складі'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Перепродажу немає'))
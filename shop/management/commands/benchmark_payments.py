@@ -0,0 +1,247 @@
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from html import unescape
+from http.cookiejar import CookieJar
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from shop.models import (
+    Cart, Category, Flavor, Order, OrderItem, PaymentCallback, PaymentEvent, PendingCheckout, Product, ProductVariant,
+)
+from shop.liqpay_simulator import LiqPaySimulator
+from shop.payment_inbox import drain
+
+from .benchmark_checkout import CHECKOUT_FORM, STATIC_STORAGES
+from .liqpay_simulator import add_simulator_arguments, simulator_config
+
+BENCHMARK_PUBLIC_KEY = 'benchmark_public'
+BENCHMARK_PRIVATE_KEY = 'benchmark_private'
+STAGES = ('checkout', 'liqpay_pay', 'gateway', 'liqpay_result', 'total')
+FORM_FIELD = re.compile(r'<input[^>]*name="(?P<name>data|signature)"[^>]*value="(?P<value>[^"]*)"')
+# Форма на LiqPay на сторінці liqpay_pay (в макеті є й інші форми) і єдина форма сторінки симулятора
+PAY_FORM = re.compile(r'<form[^>]*id="liqpay-form"[^>]*action="(?P<action>[^"]*)"')
+RESULT_FORM = re.compile(r'<form[^>]*action="(?P<action>[^"]*)"')
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class _Browser:
+    """Покупець: cookies між запитами, редиректи — вручну, щоб міряти кожен крок окремо"""
+
+    def __init__(self):
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+
+    def request(self, url, data=None):
+        """(статус, адреса редиректу або '', тіло)"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(url, body, timeout=60) as response:
+                return response.status, '', response.read().decode()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.headers.get('Location', ''), exc.read().decode(errors='replace')
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+
+def _form(pattern, html):
+    """(action, {data, signature}) з auto-submit форми сторінки оплати чи симулятора"""
+    match = pattern.search(html)
+    fields = {m.group('name'): unescape(m.group('value')) for m in FORM_FIELD.finditer(html)}
+    return unescape(match.group('action')) if match else '', fields
+
+
+class Command(BaseCommand):
+    help = (
+        'Наскрізний тест онлайн-оплати: кілька потоків-покупців проходять кошик → checkout → '
+        'liqpay_pay → симулятор LiqPay → liqpay_result, а симулятор паралельно надсилає liqpay_callback. '
+        'Показує пропускну здатність, перцентилі затримки кожного кроку й перевіряє, що кожна оплата '
+        'дала рівно одне замовлення. Магазин і симулятор працюють у цьому процесі з тестовими ключами; '
+        'створені дані видаляються в кінці.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--checkouts', type=int, default=10, help='Оформлень на потік')
+        parser.add_argument('--stock', type=int, default=10000, help='Початковий залишок варіанту')
+        parser.add_argument('--callback-timeout', type=float, default=60, help='Скільки чекати на доставку callback, с')
+        add_simulator_arguments(parser)
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        category = Category.objects.create(name='Payment benchmark')
+        flavor, _ = Flavor.objects.get_or_create(name='Payment benchmark')
+        product = Product.objects.create(name='Payment benchmark', category=category)
+        variant = ProductVariant.objects.create(
+            product=product, flavor=flavor, price=100, stock_quantity=options['stock'],
+        )
+        simulator = LiqPaySimulator(simulator_config(options, private_key=BENCHMARK_PRIVATE_KEY)).start()
+        server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=False)
+        server.daemon_threads = True
+        server.set_app(WSGIHandler())
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        base_url = 'http://127.0.0.1:%s' % server.server_address[1]
+        tokens = []
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['127.0.0.1'],
+                STORAGES=STATIC_STORAGES,
+                SESSION_COOKIE_SECURE=False,
+                CSRF_COOKIE_SECURE=False,
+                LIQPAY_PUBLIC_KEY=BENCHMARK_PUBLIC_KEY,
+                LIQPAY_PRIVATE_KEY=BENCHMARK_PRIVATE_KEY,
+                LIQPAY_CHECKOUT_URL=simulator.checkout_url,
+                # Як у веб-воркері: callback розбирає фоновий потік (для manage.py за замовчуванням 'command')
+                PAYMENT_INBOX_WORKER=os.getenv('PAYMENT_INBOX_WORKER', 'thread'),
+            ):
+                server_thread.start()
+                self._run(base_url, variant, simulator, tokens, options)
+        finally:
+            server.shutdown()
+            server.server_close()
+            simulator.stop()
+            Order.objects.filter(items__product=product).delete()
+            PaymentEvent.objects.filter(liqpay_order_id__in=tokens).delete()
+            PendingCheckout.objects.filter(token__in=tokens).delete()
+            PaymentCallback.objects.filter(received_at__gte=started_at).delete()
+            Cart.objects.filter(items__product=product).delete()
+            product.delete()
+            category.delete()
+
+    def _run(self, base_url, variant, simulator, tokens, options):
+        latencies = {stage: [] for stage in STAGES}
+        results = {'paid': 0, 'declined': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+        product_url = base_url + reverse('shop:product_detail', args=[variant.product_id])
+        add_url = base_url + reverse('shop:add_to_cart', args=[variant.product_id])
+        checkout_url = base_url + reverse('shop:checkout')
+        checkout_form = {**CHECKOUT_FORM, 'payment_method': 'online'}
+
+        def purchase(browser):
+            timings = {}
+            browser.request(add_url, {
+                'csrfmiddlewaretoken': browser.csrf_token(), 'variant_id': variant.id, 'quantity': 1,
+            })
+            started = time.perf_counter()
+            status, location, _ = browser.request(checkout_url, {
+                **checkout_form, 'csrfmiddlewaretoken': browser.csrf_token(),
+            })
+            if status != 302 or '/payment/' not in location:
+                raise RuntimeError(f'checkout: {status} {location}')
+            mark = time.perf_counter()
+            timings['checkout'] = mark - started
+
+            status, _, page = browser.request(urllib.parse.urljoin(base_url, location))
+            gateway_url, payment_form = _form(PAY_FORM, page)
+            with lock:
+                tokens.append(location.rstrip('/').rsplit('/', 1)[-1])
+            timings['liqpay_pay'] = time.perf_counter() - mark
+            mark = time.perf_counter()
+
+            status, _, page = browser.request(gateway_url, payment_form)
+            result_url, result_form = _form(RESULT_FORM, page)
+            if status != 200 or not result_url:
+                raise RuntimeError(f'gateway: {status}')
+            timings['gateway'] = time.perf_counter() - mark
+            mark = time.perf_counter()
+
+            status, location, _ = browser.request(result_url, result_form)
+            timings['liqpay_result'] = time.perf_counter() - mark
+            timings['total'] = time.perf_counter() - started
+            # Успіх — сторінка замовлення (200), невдала оплата — редирект у кошик
+            return ('paid' if status == 200 else 'declined'), timings
+
+        def worker():
+            browser = _Browser()
+            browser.request(product_url)
+            start_barrier.wait()
+            for _ in range(options['checkouts']):
+                try:
+                    outcome, timings = purchase(browser)
+                except Exception as exc:
+                    outcome, timings = 'errors', {}
+                    self.stderr.write(f'Помилка: {exc}')
+                with lock:
+                    results[outcome] += 1
+                    for stage, value in timings.items():
+                        latencies[stage].append(value)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        delivered = simulator.wait_for_callbacks(options['callback_timeout'])
+        # Callback, які ще лежать у черзі (або PAYMENT_INBOX_WORKER=command), дообробляємо тут
+        drain()
+        connections.close_all()
+        self._report(variant, simulator, tokens, results, latencies, elapsed, delivered, options)
+
+    def _report(self, variant, simulator, tokens, results, latencies, elapsed, delivered, options):
+        total = sum(results.values())
+        self.stdout.write(
+            f'База: {connection.vendor}, потоків: {options["threads"]}, оформлень: {total}, '
+            f'оплачено: {results["paid"]}, відмов оплати: {results["declined"]}, помилок: {results["errors"]}'
+        )
+        self.stdout.write(f'Пропускна здатність: {results["paid"] / elapsed:.1f} оплачених замовлень/с')
+        self.stdout.write(f'{"крок, мс":<16}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+        for stage in STAGES:
+            values = sorted(latencies[stage])
+            if not values:
+                continue
+            count = len(values)
+            percentiles = [values[min(count - 1, int(count * q))] * 1000 for q in (0.5, 0.95, 0.99)]
+            self.stdout.write(
+                f'{stage:<16}' + ''.join(f'{value:>9.1f}' for value in percentiles) + f'{values[-1] * 1000:>9.1f}'
+            )
+        self.stdout.write('Симулятор: ' + ', '.join(f'{key}: {value}' for key, value in simulator.stats.items()))
+        if not delivered:
+            self.stderr.write(self.style.WARNING('Не всі callback доставлено за --callback-timeout'))
+
+        orders = Order.objects.filter(liqpay_token__in=tokens)
+        duplicates = orders.values('liqpay_token').annotate(n=Count('id')).filter(n__gt=1).count()
+        sold = OrderItem.objects.filter(variant=variant).aggregate(total=Sum('quantity'))['total'] or 0
+        variant.refresh_from_db()
+        paid = simulator.stats['payments'] - simulator.stats['failed_payments']
+        self.stdout.write(
+            f'Замовлень: {orders.count()} (успішних оплат у симуляторі: {paid}), дублікатів: {duplicates}; '
+            f'залишок {options["stock"]} -> {variant.stock_quantity}, утримано: {variant.reserved_quantity}'
+        )
+        problems = []
+        if duplicates:
+            problems.append('кілька замовлень на одну оплату')
+        if orders.count() != paid:
+            problems.append('кількість замовлень не збігається з успішними оплатами')
+        if sold + variant.stock_quantity != options['stock']:
+            problems.append('залишок не збігається з проданим')
+        if variant.reserved_quantity:
+            problems.append('лишилися утримання після завершених оплат')
+        if problems:
+            self.stderr.write(self.style.ERROR('; '.join(problems)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Кожна оплата дала рівно одне замовлення'))
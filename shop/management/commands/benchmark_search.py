@@ -0,0 +1,96 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from shop.models import Category, Flavor, Product, ProductVariant
+from shop.search import get_backend, index_products, search_product_ids
+
+WORDS = [
+    'протеїн', 'креатин', 'вітаміни', 'батончик', 'гейнер', 'амінокислоти', 'ізолят',
+    'whey', 'casein', 'bcaa', 'omega', 'shaker', 'energy', 'recovery', 'mass',
+]
+FLAVORS = ['Шоколад', 'Ваніль', 'Полуниця', 'Банан', 'Кокос', 'Карамель']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Порівнює повнотекстовий пошук з name__icontains на синтетичному каталозі. '
+        'Усі тестові дані створюються в транзакції і відкочуються в кінці.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=3000, help='Кількість синтетичних товарів')
+        parser.add_argument('--iterations', type=int, default=50, help='Повторів кожного запиту')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['products'], options['iterations'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, product_count, iterations):
+        rng = random.Random(42)
+        category = Category.objects.create(name='Benchmark')
+        flavors = [Flavor.objects.get_or_create(name=f'{name} bench')[0] for name in FLAVORS]
+
+        products = Product.objects.bulk_create([
+            Product(
+                name=' '.join(rng.sample(WORDS, 2)).capitalize() + f' {i}',
+                description=' '.join(rng.choices(WORDS, k=20)),
+                category=category,
+            )
+            for i in range(product_count)
+        ])
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, flavor=rng.choice(flavors), price=rng.randint(100, 3000), stock_quantity=5)
+            for product in products
+        ])
+        index_products([product.id for product in products])
+
+        queries = ['протеїн', 'whey ізолят', 'шоколад', 'bcaa energy', 'крео']
+        backend_name = type(get_backend()).__name__
+        self.stdout.write(f'Товарів: {product_count}, повторів: {iterations}, бекенд: {backend_name}')
+        self.stdout.write(f'{"запит":<14}{"icontains, мс":>16}{"знайдено":>10}{"full-text, мс":>16}{"знайдено":>10}')
+
+        for query in queries:
+            icontains_ms, icontains_found = self._measure(
+                lambda: list(Product.objects.filter(name__icontains=query).values_list('id', flat=True)),
+                iterations,
+            )
+            fulltext_ms, fulltext_found = self._measure(
+                lambda: search_product_ids(query),
+                iterations,
+            )
+            self.stdout.write(
+                f'{query:<14}{icontains_ms:>16.2f}{icontains_found:>10}{fulltext_ms:>16.2f}{fulltext_found:>10}'
+            )
+
+        # icontains, що покриває ті самі поля, що й індекс — чесне порівняння охоплення
+        extended_ms, extended_found = self._measure(
+            lambda: list(
+                Product.objects.filter(
+                    Q(name__icontains='шоколад') | Q(description__icontains='шоколад')
+                    | Q(category__name__icontains='шоколад') | Q(variants__flavor__name__icontains='шоколад')
+                ).distinct().values_list('id', flat=True)
+            ),
+            iterations,
+        )
+        self.stdout.write(f'icontains по всіх полях ("шоколад"): {extended_ms:.2f} мс, знайдено {extended_found}')
+
+    @staticmethod
+    def _measure(func, iterations):
+        result = func()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            result = func()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+        return elapsed_ms, len(result)
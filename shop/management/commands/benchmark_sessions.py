@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shop.models import Category, Flavor, Product, ProductVariant
+
+ENGINES = ('db', 'cached_db', 'signed_cookies')
+STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _SessionQueryCounter:
+    """execute_wrapper: рахує запити до таблиці сесій і їх записи"""
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'django_session' in sql:
+            if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+                self.writes += 1
+            else:
+                self.reads += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Рахує записи сесії на перегляд сторінки для різних сховищ сесій: '
+        'з SESSION_SAVE_EVERY_REQUEST (як раніше, коли сесія зберігалася на кожному запиті) '
+        'і з записом лише змін. Тестові дані відкочуються в кінці.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=5, help='Скільки разів пройти сценарій')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['rounds'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _scenario(self):
+        category = Category.objects.create(name='Session benchmark')
+        flavor, _ = Flavor.objects.get_or_create(name='Session benchmark')
+        product = Product.objects.create(name='Session benchmark', category=category, description='')
+        variant = ProductVariant.objects.create(product=product, flavor=flavor, price=500, stock_quantity=1000)
+        catalog = reverse('shop:catalog')
+        cart_args = {'variant_id': variant.id}
+        # (метод, url, дані) — типовий шлях гостя: перегляди, фільтри, кошик
+        return [
+            ('get', reverse('shop:home'), None),
+            ('get', catalog, None),
+            ('get', catalog, {'sort': 'price_asc'}),
+            ('get', catalog, {'sort': 'price_asc'}),
+            ('get', reverse('shop:product_detail', args=[product.id]), None),
+            ('post', reverse('shop:add_to_cart', args=[product.id]), cart_args),
+            ('get', reverse('shop:cart'), None),
+            ('post', reverse('shop:increase_quantity', args=[product.id]), cart_args),
+            ('get', catalog, {'sort': 'price_asc'}),
+            ('get', reverse('shop:product_detail', args=[product.id]), None),
+            ('get', reverse('shop:delivery'), None),
+            ('get', reverse('shop:cart'), None),
+        ]
+
+    def _run(self, rounds):
+        scenario = self._scenario()
+        self.stdout.write(f'Сценарій: {len(scenario)} запитів, повторів: {rounds}')
+        self.stdout.write(
+            f'{"сховище":<16}{"режим":<14}{"записів/перегляд":>18}{"SQL сесій/перегляд":>20}{"байт cookie":>13}'
+        )
+        for engine in ENGINES:
+            for save_every_request, mode in ((True, 'кожен запит'), (False, 'лише зміни')):
+                with override_settings(
+                    SESSION_ENGINE=settings.SESSION_BACKENDS[engine],
+                    SESSION_SAVE_EVERY_REQUEST=save_every_request,
+                    ALLOWED_HOSTS=['testserver'],
+                    STORAGES=STATIC_STORAGES,
+                    # Відвідування пишуться в цьому ж потоці й відкочуються разом з рештою,
+                    # а не фоновим потоком поза транзакцією
+                    SITE_VISIT_WRITER='sync',
+                ):
+                    writes, sql, cookie_bytes = self._measure(scenario, rounds)
+                views = len(scenario) * rounds
+                self.stdout.write(
+                    f'{engine:<16}{mode:<14}{writes / views:>18.2f}{sql / views:>20.2f}'
+                    f'{cookie_bytes / max(writes, 1):>13.0f}'
+                )
+
+    def _measure(self, scenario, rounds):
+        counter = _SessionQueryCounter()
+        writes = cookie_bytes = 0
+        with connection.execute_wrapper(counter):
+            for _ in range(rounds):
+                client = Client()
+                for method, url, data in scenario:
+                    response = getattr(client, method)(url, data)
+                    cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+                    # SessionMiddleware ставить cookie саме тоді, коли зберігає сесію
+                    if cookie is not None and cookie.value:
+                        writes += 1
+                        cookie_bytes += len(cookie.value)
+        return writes, counter.reads + counter.writes, cookie_bytes
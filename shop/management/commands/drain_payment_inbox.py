@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from shop.payment_inbox import InboxWorker, drain, inbox_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Обробляє чергу callback LiqPay. Без --loop — один прохід до спорожнення черги; '
+        'з --loop — постійний воркер (для PAYMENT_INBOX_WORKER=command)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Працювати постійно, опитуючи чергу')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write('Воркер черги callback LiqPay запущено')
+            InboxWorker(options['batch_size']).run_forever()
+            return
+        processed, failed = drain(options['batch_size'])
+        stats = inbox_stats()
+        self.stdout.write(
+            f'Оброблено: {processed}, невдалих спроб: {failed}, у черзі: {stats["depth"]} '
+            f'(з помилками: {stats["failing"]})'
+        )
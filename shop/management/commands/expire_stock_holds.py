@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.stock_holds import delete_stale_pending, expire_holds
+
+
+class Command(BaseCommand):
+    help = (
+        'Знімає прострочені утримання залишку (STOCK_HOLD_TTL) і видаляє незавершені '
+        'онлайн-оформлення, старші за PENDING_CHECKOUT_RETENTION; зручно запускати за розкладом'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        released = expire_holds(now, batch_size=options['batch_size'])
+        deleted = delete_stale_pending(now - timedelta(seconds=settings.PENDING_CHECKOUT_RETENTION))
+        self.stdout.write(f'Знято утримань: {released}, видалено незавершених оформлень: {deleted}')
@@ -0,0 +1,83 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from shop.models import (
+    CartItem, Order, PaymentCallback, PaymentEvent, PendingCheckout, Product, ProductVariant, SiteVisit, StockHold,
+)
+
+# Повний перегляд таблиці в плані: "SCAN table" без індексу (SQLite) чи "Seq Scan on table" (PostgreSQL)
+SEQ_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(?P<table>\w+)(?! USING)(?:\s|$)'),
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\w+)'),
+}
+SAMPLE_TOKEN = '00000000-0000-0000-0000-000000000000'
+
+
+def hot_queries():
+    """(назва, queryset) — запити, що виконуються на кожному запиті сторінки чи в кожній оплаті"""
+    now = timezone.now()
+    day_ago = now - timedelta(days=1)
+    return [
+        ('Оплата: замовлення за liqpay_token', Order.objects.filter(liqpay_token=SAMPLE_TOKEN)),
+        ('Оплата: журнал подій', PaymentEvent.objects.filter(liqpay_order_id=SAMPLE_TOKEN, status='success')),
+        ('Оплата: незавершене оформлення', PendingCheckout.objects.filter(token=SAMPLE_TOKEN)),
+        ('Оплата: черга callback', PaymentCallback.objects.filter(
+            processed_at__isnull=True, next_attempt_at__lte=now,
+        ).order_by('next_attempt_at')[:50]),
+        ('Утримання: прострочені', StockHold.objects.filter(expires_at__lte=now)[:500]),
+        ('Статистика: замовлення за період', Order.objects.filter(created_at__gte=day_ago, created_at__lt=now)),
+        ('Статистика: відвідування за період', SiteVisit.objects.filter(created_at__gte=day_ago, created_at__lt=now)),
+        ('Мої замовлення', Order.objects.filter(customer_id=1).order_by('-created_at')),
+        ('Каталог: новинки', Product.objects.order_by('-created_at', '-id')[:24]),
+        ('Товар: найдешевший варіант', ProductVariant.objects.filter(product_id=1).order_by('price')[:1]),
+        ('Каталог: смаки в наявності', ProductVariant.objects.filter(
+            product_id__in=[1, 2, 3], stock_quantity__gt=F('reserved_quantity'),
+        )),
+        ('Кошик: позиція', CartItem.objects.filter(cart_id=1, product_id=1, variant_id=1)),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Виконує EXPLAIN для гарячих запитів магазину на поточній базі й позначає повні перегляди таблиць. '
+        'Завершується з помилкою, якщо такі є, — зручно для CI після зміни моделей чи індексів.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Друкувати повні плани')
+        parser.add_argument(
+            '--planner-defaults', action='store_true',
+            help='PostgreSQL: не вимикати enable_seqscan (на малих таблицях планувальник і так обирає Seq Scan)',
+        )
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            self.stderr.write(self.style.WARNING(
+                f'Розбір планів для {connection.vendor} не підтримується — плани лише друкуються'
+            ))
+        flagged = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['planner_defaults']:
+                # Перевіряємо, чи індекс узагалі можна використати, незалежно від розміру таблиць
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in hot_queries():
+                plan = queryset.explain()
+                scans = sorted({match.group('table') for match in pattern.finditer(plan)}) if pattern else []
+                if scans:
+                    flagged.append(name)
+                    self.stdout.write(self.style.ERROR(f'SEQ SCAN  {name}: {", ".join(scans)}'))
+                else:
+                    self.stdout.write(f'ok        {name}')
+                if options['verbose_plans'] or scans:
+                    for line in plan.splitlines():
+                        self.stdout.write(f'          {line}')
+        if flagged:
+            raise CommandError(f'Повний перегляд таблиці в {len(flagged)} гарячих запитах')
+        self.stdout.write(self.style.SUCCESS(f'База: {connection.vendor}, повних переглядів таблиць немає'))
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.liqpay_simulator import LiqPaySimulator, SimulatorConfig
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускає локальний замінник LiqPay. Щоб магазин надсилав на нього покупців, '
+        'встановіть LIQPAY_CHECKOUT_URL на показану адресу (ключі LiqPay — ті самі, що в магазині).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        add_simulator_arguments(parser)
+
+    def handle(self, *args, **options):
+        if not settings.LIQPAY_PRIVATE_KEY:
+            raise CommandError('LIQPAY_PRIVATE_KEY не задано — симулятор не зможе перевіряти й підписувати дані')
+        simulator = LiqPaySimulator(simulator_config(options), host=options['host'], port=options['port'])
+        self.stdout.write(f'Симулятор LiqPay: {simulator.checkout_url} (Ctrl+C — зупинити)')
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
+            self.stdout.write(', '.join(f'{key}: {value}' for key, value in simulator.stats.items()))
+
+
+def add_simulator_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, nargs=2, default=(0, 0), metavar=('MIN', 'MAX'),
+                        help='Затримка проведення платежу, мс')
+    parser.add_argument('--callback-delay-ms', type=float, nargs=2, default=(0, 0), metavar=('MIN', 'MAX'),
+                        help='Затримка між оплатою і callback, мс')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Частка неуспішних платежів')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Частка callback, які не доставляються')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='Частка callback, доставлених двічі')
+
+
+def simulator_config(options, private_key=None):
+    return SimulatorConfig(
+        private_key=private_key or settings.LIQPAY_PRIVATE_KEY,
+        latency=tuple(value / 1000 for value in options['latency_ms']),
+        callback_delay=tuple(value / 1000 for value in options['callback_delay_ms']),
+        failure_rate=options['failure_rate'],
+        drop_rate=options['drop_rate'],
+        duplicate_rate=options['duplicate_rate'],
+    )
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.cart_store import purge_guest_carts
+
+
+class Command(BaseCommand):
+    help = (
+        'Видаляє покинуті гостьові кошики, які не змінювалися довше за GUEST_CART_RETENTION; '
+        'зручно запускати за розкладом разом з expire_stock_holds'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Замість GUEST_CART_RETENTION: скільки днів без змін')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            retention = timedelta(days=options['days'])
+        else:
+            retention = timedelta(seconds=max(settings.GUEST_CART_RETENTION, settings.SESSION_COOKIE_AGE))
+        deleted = purge_guest_carts(timezone.now() - retention)
+        self.stdout.write(f'Видалено гостьових кошиків: {deleted}')
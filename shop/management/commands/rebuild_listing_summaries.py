@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.listing_summary import refresh_listing_summaries
+
+
+class Command(BaseCommand):
+    help = 'Повністю перебудовує таблицю зведень товарів (ProductListingSummary)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Кількість товарів в одному пакеті')
+
+    def handle(self, *args, **options):
+        updated = refresh_listing_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Оновлено зведень: {updated}'))
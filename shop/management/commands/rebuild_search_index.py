@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_backend, reindex_all
+
+
+class Command(BaseCommand):
+    help = 'Перебудовує повнотекстовий індекс товарів (після зміни SEARCH_TS_CONFIG чи бекенда)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Кількість товарів в одному пакеті')
+
+    def handle(self, *args, **options):
+        count = reindex_all(batch_size=options['batch_size'])
+        backend = type(get_backend()).__name__
+        self.stdout.write(self.style.SUCCESS(f'Проіндексовано товарів: {count} ({backend})'))
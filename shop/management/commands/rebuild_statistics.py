@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.models import StatsRollup
+from shop.statistics import HOUR, day_start, hour_start, rebuild_statistics, refresh_range
+
+
+class Command(BaseCommand):
+    help = (
+        'Перебудовує погодинні та денні зведення статистики з замовлень і відвідувань. '
+        'З --recent-days (для деплою) повна перебудова виконується лише один раз, поки зведень '
+        'ще немає, а далі перераховуються тільки останні дні.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-days', type=int, default=31, help='Скільки днів перераховувати за раз')
+        parser.add_argument(
+            '--recent-days', type=int, default=None,
+            help='Якщо зведення вже є — перерахувати лише стільки останніх днів, не видаляючи решту',
+        )
+
+    def handle(self, *args, **options):
+        recent_days = options['recent_days']
+        if recent_days is not None and StatsRollup.objects.exists():
+            start = day_start(timezone.localdate() - timedelta(days=max(recent_days - 1, 0)))
+            refresh_range(start, hour_start(timezone.now()) + HOUR)
+            self.stdout.write(self.style.SUCCESS(f'Зведення статистики за останні {recent_days} дн. оновлено'))
+            return
+        chunks = rebuild_statistics(chunk_days=options['chunk_days'])
+        self.stdout.write(self.style.SUCCESS(f'Зведення статистики перебудовано ({chunks} частин)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop.bestsellers import refresh_bestsellers
+
+
+class Command(BaseCommand):
+    help = 'Перераховує рейтинг бестселерів (за весь час, 30 і 7 днів); зручно запускати за розкладом'
+
+    def handle(self, *args, **options):
+        rankings = refresh_bestsellers()
+        for window, ranking in rankings.items():
+            self.stdout.write(f'{window}: {len(ranking)} товарів')
+        self.stdout.write(self.style.SUCCESS('Рейтинг бестселерів оновлено'))
@@ -1,18 +1,30 @@
-from datetime import date
-from django.db.utils import OperationalError, ProgrammingError
+import hashlib
+import uuid
 
-from .models import Customer, SiteVisit
+from django.conf import settings
+
+from .visit_tracking import record_visit
+
+VISITOR_COOKIE = 'shop_visitor'
+VISITOR_COOKIE_SALT = 'shop.visitor'
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 3600
 
 
 class SiteVisitTrackingMiddleware:
+    """
+    Стоїть перед SessionMiddleware: після відповіді сесія вже збережена і має ключ.
+    Відвідування лише додається в буфер (shop/visit_tracking.py), без запитів до бази.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        self._track_visit(request)
-        return self.get_response(request)
+        response = self.get_response(request)
+        self._track_visit(request, response)
+        return response
 
-    def _track_visit(self, request):
+    def _track_visit(self, request, response):
         if request.method != 'GET':
             return
 
@@ -20,30 +32,27 @@ class SiteVisitTrackingMiddleware:
         if path.startswith('/admin/') or path.startswith('/static/') or path.startswith('/media/'):
             return
 
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.save()
-            session_key = request.session.session_key
-
-        if not session_key:
-            return
-
-        customer = None
-        customer_id = request.session.get('customer_id')
-        if customer_id:
-            customer = Customer.objects.filter(id=customer_id).first()
-
-        try:
-            site_visit, created = SiteVisit.objects.get_or_create(
-                visit_date=date.today(),
-                session_key=session_key,
-                defaults={
-                    'customer': customer,
-                },
-            )
-
-            if not created and customer and not site_visit.customer_id:
-                site_visit.customer = customer
-                site_visit.save(update_fields=['customer'])
-        except (OperationalError, ProgrammingError):
-            return
+        session = getattr(request, 'session', None)
+        session_key = session.session_key if session is not None else None
+        # Анонімний відвідувач, який лише переглядає сторінки, сесії не має (порожню сесію
+        # Django не зберігає) — його рахуємо за власною підписаною cookie. Вона ж лишається
+        # ключем і після появи сесії (кошик, вхід), щоб той самий день не рахувався двічі
+        visitor_id = request.get_signed_cookie(VISITOR_COOKIE, default=None, salt=VISITOR_COOKIE_SALT)
+        if visitor_id is None and not session_key:
+            visitor_id = self._new_visitor_id(response)
+
+        if visitor_id is None and len(session_key) > 64:
+            # signed_cookies: ключ — це сама cookie, довша за SiteVisit.session_key
+            session_key = hashlib.md5(session_key.encode('ascii')).hexdigest()
+
+        # Якщо view не читала сесію, не завантажуємо її заради customer_id
+        customer_id = session.get('customer_id') if session is not None and session.accessed else None
+        record_visit(visitor_id or session_key, customer_id)
+
+    def _new_visitor_id(self, response):
+        visitor_id = uuid.uuid4().hex
+        response.set_signed_cookie(
+            VISITOR_COOKIE, visitor_id, salt=VISITOR_COOKIE_SALT, max_age=VISITOR_COOKIE_MAX_AGE,
+            secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+        )
+        return visitor_id
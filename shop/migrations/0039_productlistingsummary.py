@@ -0,0 +1,59 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Avg, Count, Sum
+
+
+def build_summaries(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductListingSummary = apps.get_model('shop', 'ProductListingSummary')
+
+    summaries = []
+    for product in Product.objects.all():
+        cheapest = product.variants.order_by('price', 'id').first()
+        variant_stock = product.variants.aggregate(total=Sum('stock_quantity'))['total']
+        rating = product.reviews.aggregate(avg=Avg('rating'), count=Count('id'))
+        units_sold = product.orderitem_set.aggregate(total=Sum('quantity'))['total']
+        image = product.extra_images.order_by('order', 'id').first()
+        summaries.append(ProductListingSummary(
+            product=product,
+            min_price=cheapest.price if cheapest else 0,
+            min_old_price=cheapest.old_price if cheapest else None,
+            total_stock=variant_stock if variant_stock is not None else product.stock_quantity,
+            avg_rating=float(rating['avg'] or 0),
+            review_count=rating['count'] or 0,
+            units_sold=units_sold or 0,
+            main_image=image.image.name if image else '',
+        ))
+    ProductListingSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0038_newsletter_subscriber'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListingSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing_summary', serialize=False, to='shop.product')),
+                ('min_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('min_old_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('total_stock', models.PositiveIntegerField(default=0)),
+                ('avg_rating', models.FloatField(default=0)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('main_image', models.CharField(blank=True, default='', max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Зведення товару',
+                'verbose_name_plural': 'Зведення товарів',
+                'indexes': [models.Index(fields=['min_price', 'product'], name='shop_summary_price_idx'), models.Index(fields=['avg_rating', 'product'], name='shop_summary_rating_idx'), models.Index(fields=['units_sold'], name='shop_summary_sold_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
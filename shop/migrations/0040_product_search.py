@@ -0,0 +1,94 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE shop_productsearchdocument ADD COLUMN search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX shop_search_vector_gin ON shop_productsearchdocument USING GIN (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                'CREATE VIRTUAL TABLE shop_product_fts USING fts5('
+                'title, body, tokenize="unicode61 remove_diacritics 2")'
+            )
+        except OperationalError:
+            # SQLite без FTS5 — пошук працюватиме через SimpleSearchBackend
+            pass
+
+
+def build_documents(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductSearchDocument = apps.get_model('shop', 'ProductSearchDocument')
+
+    documents = []
+    for product in Product.objects.select_related('category__parent').prefetch_related('variants__flavor'):
+        parts = [product.description]
+        category = product.category
+        while category is not None:
+            parts.append(category.name)
+            category = category.parent
+        for variant in product.variants.all():
+            if variant.flavor:
+                parts.append(variant.flavor.name)
+            if variant.weight_label:
+                parts.append(variant.weight_label)
+        documents.append(ProductSearchDocument(
+            product=product,
+            title=product.name,
+            body=' '.join(part for part in dict.fromkeys(parts) if part),
+        ))
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        # Та сама конфігурація, що й у запитах пошуку (PostgresSearchBackend)
+        config = getattr(settings, 'SEARCH_TS_CONFIG', 'simple')
+        schema_editor.execute(
+            "UPDATE shop_productsearchdocument "
+            "SET search_vector = setweight(to_tsvector(%s::regconfig, title), 'A') "
+            "|| setweight(to_tsvector(%s::regconfig, body), 'B')",
+            [config, config],
+        )
+    elif vendor == 'sqlite' and 'shop_product_fts' in schema_editor.connection.introspection.table_names():
+        schema_editor.execute(
+            'INSERT INTO shop_product_fts(rowid, title, body) '
+            'SELECT product_id, title, body FROM shop_productsearchdocument'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS shop_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0039_productlistingsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='shop.product')),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Пошуковий документ',
+                'verbose_name_plural': 'Пошукові документи',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
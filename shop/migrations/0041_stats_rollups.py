@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0040_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Година'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('registered_visits', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Зведення статистики',
+                'verbose_name_plural': 'Зведення статистики',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket'), name='unique_stats_rollup_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsStatusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Година'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('status', models.CharField(choices=[('new', 'Новий'), ('processing', 'В обробці'), ('shipped', 'Відправлено'), ('completed', 'Виконано')], max_length=20)),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'status'), name='unique_stats_status_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsCustomerDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.customer')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'customer'), name='unique_stats_customer_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Година'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'product'), name='unique_stats_product_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0045_payment_callbacks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='shop_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'created_at'], name='shop_order_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='shop_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'price'], name='shop_variant_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('stock_quantity__gt', models.F('reserved_quantity'))), fields=['product', 'stock_quantity'], name='shop_variant_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sitevisit',
+            index=models.Index(fields=['created_at'], name='shop_visit_created_idx'),
+        ),
+    ]
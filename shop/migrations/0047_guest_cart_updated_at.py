@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:10
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    # Для наявних кошиків остання зміна невідома — рахуємо від створення
+    Cart = apps.get_model('shop', 'Cart')
+    Cart.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0046_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('customer__isnull', True)), fields=['updated_at'], name='shop_guest_cart_updated_idx'),
+        ),
+    ]
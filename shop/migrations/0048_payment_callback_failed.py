@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0047_guest_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentcallback',
+            name='shop_callback_due_idx',
+        ),
+        migrations.AddField(
+            model_name='paymentcallback',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentcallback',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('processed_at__isnull', True)), fields=['next_attempt_at'], name='shop_callback_due_idx'),
+        ),
+    ]
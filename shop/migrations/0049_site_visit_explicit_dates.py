@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0048_payment_callback_failed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sitevisit',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='sitevisit',
+            name='visit_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.db import models
+from django.db.models import DecimalField, F, FloatField, IntegerField, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
+from django.core.files.storage import default_storage
 from django.core.validators import MaxLengthValidator
+from django.utils import timezone
+from decimal import Decimal
 import hashlib
 import uuid
 
@@ -77,48 +82,134 @@ class Category(models.Model):
         return self.name
     
     def is_parent(self):
-        return self.subcategories.exists()
+        from .category_tree import get_category_tree
+        return get_category_tree().is_parent(self.id)
     
     def get_all_subcategories(self):
-        subcats = list(self.subcategories.all())
-        for subcat in self.subcategories.all():
-            subcats.extend(subcat.get_all_subcategories())
-        return subcats
+        """Вузли дерева (category_tree.CategoryNode) усіх підкатегорій"""
+        from .category_tree import get_category_tree
+        return get_category_tree().descendants(self.id)
+
+
+def listing_prefetches():
+    """Prefetch варіантів у наявності, потрібних карткам товару (вибір смаку)"""
+    return [
+        Prefetch(
+            'variants',
+            queryset=ProductVariant.objects.filter(stock_quantity__gt=F('reserved_quantity')).select_related('flavor'),
+            to_attr='in_stock_variants',
+        ),
+    ]
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Товари для списків (каталог, головна, рекомендації) з рейтингом, кількістю відгуків,
+        мінімальною ціною, старою ціною, залишком і головним фото з ProductListingSummary
+        та варіантами в наявності — фіксована кількість запитів незалежно від кількості товарів.
+        Сортування за цими полями йде по індексах таблиці зведень.
+        """
+        return (
+            self.select_related('category')
+            .annotate(
+                # Ключі сортування каталогу: без зведення (LEFT JOIN дає NULL) — значення за замовчуванням
+                # зведення, інакше курсор такого товару не розкодується і сторінка почнеться спочатку
+                min_price=Coalesce(
+                    F('listing_summary__min_price'), Value(Decimal('0')),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ),
+                min_old_price=F('listing_summary__min_old_price'),
+                avg_rating=Coalesce(F('listing_summary__avg_rating'), Value(0.0), output_field=FloatField()),
+                review_count=F('listing_summary__review_count'),
+                # Якщо зведення ще немає — використовується загальний залишок товару
+                available_stock=Coalesce(
+                    F('listing_summary__total_stock'), F('stock_quantity') - F('reserved_quantity'),
+                    output_field=IntegerField(),
+                ),
+                units_sold=F('listing_summary__units_sold'),
+                main_image_path=F('listing_summary__main_image'),
+            )
+            .prefetch_related(*listing_prefetches())
+        )
 
 
 class Product(models.Model):
     name = models.CharField(max_length=200)      
     stock_quantity = models.PositiveIntegerField(default=0, help_text="Кількість в наявності (використовується тільки якщо немає смаків)")
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False, help_text="Утримується для неоплачених замовлень LiqPay")
     description = models.TextField(blank=True, max_length=1000, validators=[MaxLengthValidator(1000)])     
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products')  # Категорія
     created_at = models.DateTimeField(auto_now_add=True)  
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Сортування "Новинки": ключ keyset-пагінації (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='shop_product_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
     def get_available_stock(self):
         """Отримати доступне кількість товару на основі варіантів або загального stock_quantity"""
-        from django.db.models import Sum
+        # Значення вже пораховане в Product.objects.for_listing()
+        if 'available_stock' in self.__dict__:
+            return self.available_stock
+        if self._has_prefetched('variants'):
+            variants = self.variants.all()
+            return sum(variant.available_quantity for variant in variants) if variants else self.available_quantity
         if self.variants.exists():
-            total = self.variants.aggregate(total=Sum('stock_quantity'))['total'] or 0
+            total = self.variants.aggregate(total=Sum(F('stock_quantity') - F('reserved_quantity')))['total'] or 0
             return total
         # Якщо немає варіантів — повертаємо загальне кількість з поля
-        return self.stock_quantity
+        return self.available_quantity
+
+    @property
+    def available_quantity(self):
+        """Загальний залишок без утриманого для неоплачених замовлень"""
+        return max(self.stock_quantity - self.reserved_quantity, 0)
 
     def get_min_price(self):
-        first = self.variants.order_by('price').first()
+        if 'min_price' in self.__dict__:
+            return self.min_price if self.min_price is not None else 0
+        first = self._cheapest_variant()
         return first.price if first else 0
 
     def get_min_old_price(self):
-        first = self.variants.order_by('price').first()
+        if 'min_old_price' in self.__dict__:
+            return self.min_old_price
+        first = self._cheapest_variant()
         return first.old_price if first and first.old_price is not None else None
 
+    def _has_prefetched(self, name):
+        return name in getattr(self, '_prefetched_objects_cache', {})
+
+    def _cheapest_variant(self):
+        if self._has_prefetched('variants'):
+            return min(self.variants.all(), key=lambda variant: (variant.price, variant.id), default=None)
+        return self.variants.order_by('price').first()
+
     @property
     def main_image(self):
+        if self._has_prefetched('extra_images'):
+            images = self.extra_images.all()
+            return images[0] if images else None
         return self.extra_images.order_by('order').first()
 
+    @property
+    def main_image_url(self):
+        # Шлях головного фото вже є у зведенні — без окремого запиту до ProductImage
+        if 'main_image_path' in self.__dict__:
+            return default_storage.url(self.main_image_path) if self.main_image_path else ''
+        image = self.main_image
+        return image.image.url if image else ''
+
     def get_all_images(self):
-        return [extra.image.url for extra in self.extra_images.order_by('order')]
+        images = self.extra_images.all() if self._has_prefetched('extra_images') else self.extra_images.order_by('order')
+        return [extra.image.url for extra in images]
 
 
 class ProductImage(models.Model):
@@ -133,19 +224,101 @@ class ProductImage(models.Model):
         return f"Фото {self.order} для {self.product.name}"
 
 
+class ProductListingSummary(models.Model):
+    """
+    Денормалізовані дані товару для каталогу, головної та адмінки.
+    Підтримуються сигналами (shop/signals.py), повна перебудова — rebuild_listing_summaries.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='listing_summary')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    min_old_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    total_stock = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+    main_image = models.CharField(max_length=255, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Зведення товару'
+        verbose_name_plural = 'Зведення товарів'
+        indexes = [
+            models.Index(fields=['min_price', 'product'], name='shop_summary_price_idx'),
+            models.Index(fields=['avg_rating', 'product'], name='shop_summary_rating_idx'),
+            models.Index(fields=['units_sold'], name='shop_summary_sold_idx'),
+        ]
+
+    def __str__(self):
+        return f"Зведення для {self.product_id}"
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Текст товару для повнотекстового пошуку (shop/search.py).
+    На PostgreSQL таблиця додатково має колонку search_vector (tsvector) з GIN-індексом,
+    на SQLite документ дублюється у FTS5-таблицю shop_product_fts.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Пошуковий документ'
+        verbose_name_plural = 'Пошукові документи'
+
+    def __str__(self):
+        return self.title
+
+
+class Cart(models.Model):
+    """
+    Кошик покупця або гостя (id гостьового кошика зберігається в сесії).
+    item_count — загальна кількість одиниць, оновлюється разом зі зміною позиції,
+    тож лічильник у шапці читається одним запитом за первинним ключем.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, null=True, blank=True, related_name='cart')
+    item_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Остання зміна позицій; покинуті гостьові кошики видаляє purge_guest_carts
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Кошик'
+        verbose_name_plural = 'Кошики'
+        indexes = [
+            models.Index(
+                fields=['updated_at'], condition=models.Q(customer__isnull=True), name='shop_guest_cart_updated_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Кошик {self.customer or self.pk}"
+
+
 class CartItem(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    variant = models.ForeignKey('ProductVariant', on_delete=models.SET_NULL, null=True, blank=True, related_name='cart_items')
+    variant = models.ForeignKey('ProductVariant', on_delete=models.CASCADE, null=True, blank=True, related_name='cart_items')
     quantity = models.PositiveIntegerField(default=1)
 
     def total_price(self):
-        price = self.variant.price if self.variant else self.product.price
+        price = self.variant.price if self.variant else self.product.get_min_price()
         return price * self.quantity
-    
+
     class Meta:
-        unique_together = ['customer', 'product', 'variant']
-    
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variant'], condition=models.Q(variant__isnull=False),
+                name='unique_cart_item_variant',
+            ),
+            models.UniqueConstraint(
+                fields=['cart', 'product'], condition=models.Q(variant__isnull=True),
+                name='unique_cart_item_product',
+            ),
+        ]
+
+
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     first_name = models.CharField(max_length=50, blank=True)
@@ -163,7 +336,15 @@ class Order(models.Model):
     shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
-    liqpay_token = models.CharField(max_length=64, blank=True, default='')
+    liqpay_token = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+    class Meta:
+        indexes = [
+            # Діапазони дат статистики
+            models.Index(fields=['created_at'], name='shop_order_created_idx'),
+            # Сторінка "Мої замовлення": замовлення покупця від нових до старих
+            models.Index(fields=['customer', 'created_at'], name='shop_order_customer_idx'),
+        ]
 
     def delivery_method_label(self):
         labels = {
@@ -215,7 +396,7 @@ class PendingCheckout(models.Model):
     token = models.UUIDField(default=uuid.uuid4, unique=True, db_index=True)
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     form_data = models.JSONField()        # поля форми checkout
-    cart_snapshot = models.JSONField()   # копія session['cart']
+    cart_snapshot = models.JSONField()   # копія кошика {"pid_vid": кількість}
     grand_total = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -227,11 +408,108 @@ class PendingCheckout(models.Model):
         return f"PendingCheckout {self.token}"
 
 
+class PaymentEvent(models.Model):
+    """
+    Журнал подій оплати LiqPay. Пара (liqpay_order_id, status) унікальна: подія
+    обробляється лише тим запитом (callback чи result), який першим її записав.
+    """
+    liqpay_order_id = models.CharField(max_length=64)  # order_id у LiqPay — токен PendingCheckout
+    status = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_events')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['liqpay_order_id', 'status'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.liqpay_order_id}: {self.status}"
+
+
+class PaymentCallback(models.Model):
+    """
+    Вхідна черга callback LiqPay: сирі data і signature записуються одразу,
+    а обробляє їх воркер (shop/payment_inbox.py) пакетами з повторами.
+    """
+    data = models.TextField()
+    signature = models.CharField(max_length=64)
+    received_at = models.DateTimeField(auto_now_add=True)
+    # Коли запис можна (знову) брати в обробку; при взятті зсувається на час оренди
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Остаточна невдача (дані не розкодовуються або вичерпано PAYMENT_INBOX_MAX_ATTEMPTS):
+    # запис лишається для розбору в адмінці й більше не береться в обробку
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Callback LiqPay'
+        verbose_name_plural = 'Черга callback LiqPay'
+        ordering = ['-received_at']
+        indexes = [
+            # Лише записи в черзі: індекс не росте разом з історією
+            models.Index(
+                fields=['next_attempt_at'], condition=models.Q(processed_at__isnull=True, failed_at__isnull=True),
+                name='shop_callback_due_idx',
+            ),
+            models.Index(fields=['processed_at'], name='shop_callback_processed_idx'),
+        ]
+
+    def __str__(self):
+        return f"Callback #{self.pk} ({self.received_at:%Y-%m-%d %H:%M:%S})"
+
+    @property
+    def status(self):
+        if self.processed_at is not None:
+            return 'Оброблено'
+        if self.failed_at is not None:
+            return 'Невдача'
+        return 'У черзі'
+
+    @property
+    def latency(self):
+        """Час від отримання до обробки"""
+        if self.processed_at is None:
+            return None
+        return self.processed_at - self.received_at
+
+
+class StockHold(models.Model):
+    """
+    Утримання залишку на час оплати PendingCheckout. Поки утримання активне,
+    його кількість входить у reserved_quantity варіанту (або товару без варіантів).
+    Після оплати утримання списується разом із залишком, після expires_at —
+    знімається командою expire_stock_holds.
+    """
+    pending = models.ForeignKey(PendingCheckout, on_delete=models.CASCADE, related_name='holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    variant = models.ForeignKey('ProductVariant', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Утримання залишку'
+        verbose_name_plural = 'Утримання залишку'
+        # Перевірки залишку читають reserved_quantity і таблицю не чіпають;
+        # індекс потрібен вибірці прострочених утримань
+        indexes = [
+            models.Index(fields=['expires_at'], name='shop_stockhold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} × {self.variant or self.product} до {self.expires_at:%H:%M}"
+
+
 class SiteVisit(models.Model):
-    visit_date = models.DateField(auto_now_add=True)
+    # Дату й час передає буфер відвідувань (момент запиту, а не запису)
+    visit_date = models.DateField(default=timezone.localdate)
     session_key = models.CharField(max_length=64)
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         verbose_name = 'Відвідування сайту'
@@ -239,11 +517,75 @@ class SiteVisit(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['visit_date', 'session_key'], name='unique_daily_session_visit')
         ]
+        indexes = [
+            models.Index(fields=['created_at'], name='shop_visit_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.visit_date} - {self.session_key}"
 
 
+ROLLUP_GRANULARITY_CHOICES = [
+    ('hour', 'Година'),
+    ('day', 'День'),
+]
+
+
+class StatsRollup(models.Model):
+    """Замовлення, виручка та відвідування за годину або день (див. shop/statistics.py)"""
+    granularity = models.CharField(max_length=4, choices=ROLLUP_GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    orders_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    visits = models.PositiveIntegerField(default=0)
+    registered_visits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Зведення статистики'
+        verbose_name_plural = 'Зведення статистики'
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket'], name='unique_stats_rollup_bucket')
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket}"
+
+
+class StatsStatusRollup(models.Model):
+    granularity = models.CharField(max_length=4, choices=ROLLUP_GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    orders_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket', 'status'], name='unique_stats_status_bucket')
+        ]
+
+
+class StatsProductRollup(models.Model):
+    granularity = models.CharField(max_length=4, choices=ROLLUP_GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='+')
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket', 'product'], name='unique_stats_product_bucket')
+        ]
+
+
+class StatsCustomerDay(models.Model):
+    """Зареєстровані покупці, що відвідали сайт у день — для кількості унікальних користувачів"""
+    day = models.DateField()
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'customer'], name='unique_stats_customer_day')
+        ]
+
+
 class Review(models.Model):
     RATING_CHOICES = [
         (1, '1 - Дуже погано'),
@@ -297,10 +639,21 @@ class ProductVariant(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     old_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text='Стара ціна (якщо є знижка)')
     stock_quantity = models.PositiveIntegerField(default=0)
+    # Сума активних утримань StockHold — доступно stock_quantity - reserved_quantity
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['id']
         unique_together = ['product', 'weight_label', 'flavor']
+        indexes = [
+            # Найдешевший варіант товару
+            models.Index(fields=['product', 'price'], name='shop_variant_price_idx'),
+            # Варіанти в наявності (смаки на картках каталогу): лише рядки з доступним залишком
+            models.Index(
+                fields=['product', 'stock_quantity'], condition=models.Q(stock_quantity__gt=F('reserved_quantity')),
+                name='shop_variant_in_stock_idx',
+            ),
+        ]
 
     def __str__(self):
         parts = [self.product.name]
@@ -310,8 +663,12 @@ class ProductVariant(models.Model):
             parts.append(self.flavor.name)
         return ' - '.join(parts)
 
+    @property
+    def available_quantity(self):
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
     def is_in_stock(self):
-        return self.stock_quantity > 0
+        return self.available_quantity > 0
 
 
 class Flavor(models.Model):
@@ -0,0 +1,139 @@
+"""
+Створення замовлення — спільне для оплати при отриманні та LiqPay.
+
+Замовлення записується одним INSERT (з уже встановленими статусами), позиції —
+одним bulk_create, а залишки списуються одним умовним UPDATE на таблицю:
+для варіантів і для товарів без варіантів. UPDATE змінює рядок лише якщо
+доступного залишку (stock_quantity - reserved_quantity, див. stock_holds)
+вистачає; якщо змінилося менше рядків, ніж позицій, уся транзакція
+відкочується і викидається InsufficientStock.
+
+Рядки не блокуються заздалегідь (select_for_update): конкуруючі оформлення
+одного товару серіалізуються лише на час самого UPDATE. Якщо база відповіла
+взаємоблокуванням чи "database is locked", спроба повторюється з
+експоненційною затримкою (ORDER_PLACEMENT_RETRIES разів).
+
+bulk_create не надсилає post_save для OrderItem, тож оновлення зведень
+товарів, кешу сторінок і рейтингу бестселерів плануються тут після коміту.
+Статистику перераховує сигнал самого Order.
+"""
+import logging
+import random
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .bestsellers import schedule_bestsellers_refresh
+from .models import OrderItem
+from .stock_holds import (
+    InsufficientStock, per_row, schedule_availability_refresh, shortage_labels, stock_models, take_holds,
+)
+
+logger = logging.getLogger(__name__)
+
+OrderLine = namedtuple('OrderLine', ['product_id', 'variant_id', 'quantity', 'price'])
+
+
+def lines_from_cart(cart_items):
+    """OrderLine з позицій кошика (cart_store.resolve_lines)"""
+    return [
+        OrderLine(
+            item['product'].id,
+            item['variant'].id if item['variant'] else None,
+            int(item['quantity']),
+            item['price'],
+        )
+        for item in cart_items
+    ]
+
+
+def _decrement(model, quantities, released, allow_shortage):
+    """
+    Списує залишки; released — утримання цього ж замовлення, які знімаються з
+    reserved_quantity. Повертає id рядків, яких не вистачило (лише з allow_shortage).
+    """
+    if not quantities:
+        return []
+    requested = per_row(quantities)
+    own_hold = per_row(released)
+    # Доступно цьому замовленню: stock - reserved + його власне утримання
+    enough = {'stock_quantity__gte': F('reserved_quantity') - own_hold + requested}
+    changes = {'stock_quantity': F('stock_quantity') - requested}
+    if released:
+        changes['reserved_quantity'] = Greatest(F('reserved_quantity') - own_hold, Value(0))
+    if allow_shortage:
+        short = list(model.objects.filter(pk__in=quantities).exclude(**enough).values_list('pk', flat=True))
+        changes['stock_quantity'] = Greatest(changes['stock_quantity'], Value(0))
+        model.objects.filter(pk__in=quantities).update(**changes)
+        return short
+    updated = model.objects.filter(pk__in=quantities, **enough).update(**changes)
+    if updated != len(quantities):
+        raise InsufficientStock()
+    return []
+
+
+def place_order(order, lines, allow_shortage=False, pending=None):
+    """
+    Зберігає незбережене замовлення order з позиціями lines (OrderLine) і списує залишки.
+    allow_shortage — для вже оплачених замовлень: залишок не опускається нижче нуля,
+    а нестача лише записується в лог замість відмови.
+    pending — PendingCheckout, чиї утримання залишку знімаються в тій самій транзакції.
+    Замовлення без жодної позиції не зберігається (ValueError).
+    """
+    lines = [line for line in lines if line.quantity > 0]
+    if not lines:
+        raise ValueError('Замовлення без позицій')
+    retries = settings.ORDER_PLACEMENT_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            return _place(order, lines, allow_shortage, pending)
+        except OperationalError:
+            # Усередині зовнішньої транзакції повторює той, хто її відкрив
+            if attempt == retries or transaction.get_connection().in_atomic_block:
+                raise
+            # Транзакцію відкочено — замовлення знову незбережене
+            order.pk = None
+            order._state.adding = True
+            backoff(attempt)
+
+
+def backoff(attempt):
+    """Експоненційна затримка з розкидом перед повтором спроби attempt"""
+    time.sleep(settings.ORDER_PLACEMENT_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _place(order, lines, allow_shortage, pending):
+    try:
+        with transaction.atomic():
+            released = take_holds(pending) if pending is not None else ({}, {})
+            (variants, variant_quantities), (products, product_quantities) = stock_models(lines)
+            short_variants = _decrement(variants, variant_quantities, released[0], allow_shortage)
+            short_products = _decrement(products, product_quantities, released[1], allow_shortage)
+            order.save(force_insert=True)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=line.product_id,
+                    variant_id=line.variant_id,
+                    quantity=line.quantity,
+                    price=line.price,
+                )
+                for line in lines
+            ])
+    except InsufficientStock:
+        raise InsufficientStock(shortage_labels(lines))
+
+    if short_variants or short_products:
+        logger.warning(
+            'Оплаченому замовленню #%s не вистачило залишку: варіанти %s, товари %s',
+            order.pk, short_variants, short_products,
+        )
+
+    schedule_availability_refresh(line.product_id for line in lines)
+    schedule_bestsellers_refresh()
+    return order
+
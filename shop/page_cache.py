@@ -0,0 +1,160 @@
+"""
+Кеш сторінок для анонімних відвідувачів.
+
+Головна, доставка, каталог і сторінка товару для анонімних відвідувачів
+залежать лише від GET-параметрів і даних каталогу. Під час рендеру для кешу
+персональні значення (лічильник кошика, посилання "назад до каталогу" з
+фільтрами сесії, CSRF-токен) замінюються мітками, які при кожній віддачі
+заповнюються значеннями конкретного запиту.
+
+Ключ містить версію 'catalog_pages', яку сигнали змінюють після записів у
+каталог. Відповідь має ETag (сторінка + персональні значення) і
+Last-Modified, тож повторний запит браузера чи проксі отримує 304.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from .caching import bump_version, get_version
+
+PAGE_CACHE_VERSION = 'catalog_pages'
+
+CART_COUNT_PLACEHOLDER = 'shop-page-cache-cart-count'
+CATALOG_URL_PLACEHOLDER = 'shop-page-cache-catalog-url'
+CSRF_TOKEN_PLACEHOLDER = 'shop-page-cache-csrf-token'
+
+PLACEHOLDER_CONTEXT = {
+    'cart_count': CART_COUNT_PLACEHOLDER,
+    'get_catalog_url': CATALOG_URL_PLACEHOLDER,
+    'csrf_token': CSRF_TOKEN_PLACEHOLDER,
+}
+
+
+def is_rendering_for_cache(request):
+    return getattr(request, '_page_cache_render', False)
+
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return False
+    # Для покупців, що увійшли, у шапці є ім'я — такі сторінки не кешуємо
+    return not request.session.get('customer_id')
+
+
+def _fingerprint(request, vary_on):
+    """Хеш шляху та значущих GET-параметрів (порядок і сторонні параметри не впливають)"""
+    params = urlencode(sorted(
+        (name, value)
+        for name in vary_on
+        for value in request.GET.getlist(name)
+    ))
+    return hashlib.md5(f'{request.path}?{params}'.encode('utf-8')).hexdigest()
+
+
+def _page_key(request, view_name, vary_on):
+    return f'shop:page:{get_version(PAGE_CACHE_VERSION)}:{view_name}:{_fingerprint(request, vary_on)}'
+
+
+def catalog_etag(request, vary_on):
+    """
+    ETag AJAX-відповіді каталогу: версія даних каталогу + відбиток фільтрів.
+    Рахується без запитів до бази, тож 304 віддається до будь-якої роботи view.
+    """
+    return '"%s"' % hashlib.md5(
+        f'{get_version(PAGE_CACHE_VERSION)}:{_fingerprint(request, vary_on)}'.encode('ascii')
+    ).hexdigest()
+
+
+def _personal_values(request):
+    from .context_processors import build_catalog_url, count_cart_items
+
+    return {
+        CART_COUNT_PLACEHOLDER: str(count_cart_items(request)),
+        CATALOG_URL_PLACEHOLDER: build_catalog_url(request),
+        CSRF_TOKEN_PLACEHOLDER: get_token(request),
+    }
+
+
+def _fill_holes(content, values):
+    for placeholder, value in values.items():
+        content = content.replace(placeholder.encode('ascii'), value.encode('utf-8'))
+    return content
+
+
+def _serve(request, entry):
+    values = _personal_values(request)
+    # Маскований CSRF-токен щоразу інший, тому в ETag іде незмінний секрет із cookie
+    personal = '|'.join([
+        values[CART_COUNT_PLACEHOLDER],
+        values[CATALOG_URL_PLACEHOLDER],
+        request.META.get('CSRF_COOKIE', ''),
+    ])
+    etag = '"%s"' % hashlib.md5(f"{entry['etag']}|{personal}".encode('utf-8')).hexdigest()
+
+    response = HttpResponse(_fill_holes(entry['content'], values), content_type=entry['content_type'])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    # Сторінка персональна (кошик, CSRF) — кеші можуть її зберігати лише з перевіркою
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Cookie'])
+    return get_conditional_response(
+        request, etag=etag, last_modified=entry['last_modified'], response=response,
+    )
+
+
+def cache_anonymous_page(vary_on=(), on_hit=None):
+    """
+    Кешує сторінку для анонімних відвідувачів.
+    vary_on — GET-параметри, від яких залежить сторінка (решта, як-от utm, ігнорується);
+    on_hit(request) — побічні дії view, які треба виконати й при віддачі з кешу.
+    """
+    def decorator(view):
+        view_name = view.__name__
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            key = _page_key(request, view_name, vary_on)
+            entry = cache.get(key)
+            if entry is not None:
+                if on_hit is not None:
+                    on_hit(request)
+                return _serve(request, entry)
+
+            request._page_cache_render = True
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                request._page_cache_render = False
+
+            if response.status_code != 200 or response.streaming or response.cookies:
+                if not response.streaming:
+                    response.content = _fill_holes(response.content, _personal_values(request))
+                return response
+
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': hashlib.md5(response.content).hexdigest(),
+                'last_modified': int(time.time()),
+            }
+            cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT)
+            return _serve(request, entry)
+
+        return wrapped
+    return decorator
+
+
+def invalidate_page_cache():
+    bump_version(PAGE_CACHE_VERSION)
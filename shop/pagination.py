@@ -0,0 +1,107 @@
+"""
+Keyset (cursor) пагінація каталогу.
+
+Замість OFFSET кожна наступна сторінка починається одразу після останнього
+товару попередньої: курсор зберігає значення ключів сортування цього товару,
+тож вартість запиту не залежить від того, наскільки далеко прокрутив користувач.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+CATALOG_PAGE_SIZE = 24
+
+# Ключі сортування для кожного режиму каталогу: (поле, за спаданням).
+# Останнім ключем завжди йде id, щоб порядок був однозначним.
+SORT_KEYS = {
+    'price_asc': (('min_price', False), ('id', False)),
+    'price_desc': (('min_price', True), ('id', True)),
+    'rating_desc': (('avg_rating', True), ('created_at', True), ('id', True)),
+    'newest': (('created_at', True), ('id', True)),
+    # Порядок результатів пошуку (анотація search_rank у views.catalog)
+    'relevance': (('search_rank', False), ('id', False)),
+}
+DEFAULT_SORT_KEYS = (('id', False),)
+
+_DECODERS = {
+    'min_price': Decimal,
+    'avg_rating': float,
+    'created_at': datetime.fromisoformat,
+    'search_rank': int,
+    'id': int,
+}
+
+
+def get_sort_keys(sort):
+    return SORT_KEYS.get(sort, DEFAULT_SORT_KEYS)
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(sort, obj):
+    keys = get_sort_keys(sort)
+    payload = {
+        's': sort or '',
+        'v': [_encode_value(getattr(obj, field)) for field, _ in keys],
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    """Повертає значення ключів із курсора або None, якщо курсор невалідний чи від іншого сортування"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if payload.get('s') != (sort or ''):
+            return None
+        keys = get_sort_keys(sort)
+        raw_values = payload.get('v') or []
+        if len(raw_values) != len(keys):
+            return None
+        return [_DECODERS[field](value) for (field, _), value in zip(keys, raw_values)]
+    except (ValueError, TypeError, KeyError, AttributeError, InvalidOperation, binascii.Error, UnicodeError):
+        return None
+
+
+def _after_filter(keys, values):
+    """(k1, k2, ...) > (v1, v2, ...) з урахуванням напрямку кожного ключа"""
+    condition = Q()
+    equal_prefix = Q()
+    for (field, descending), value in zip(keys, values):
+        lookup = 'lt' if descending else 'gt'
+        condition |= equal_prefix & Q(**{f'{field}__{lookup}': value})
+        equal_prefix &= Q(**{field: value})
+    return condition
+
+
+def paginate_keyset(queryset, sort, cursor=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    Повертає (товари сторінки, курсор наступної сторінки або None).
+    queryset має містити анотації, що використовуються в ключах (див. Product.objects.for_listing()).
+    """
+    keys = get_sort_keys(sort)
+    queryset = queryset.order_by(*[('-' if descending else '') + field for field, descending in keys])
+
+    values = decode_cursor(sort, cursor)
+    if values is not None:
+        queryset = queryset.filter(_after_filter(keys, values))
+
+    # Беремо на один запис більше, щоб знати, чи є наступна сторінка
+    items = list(queryset[:page_size + 1])
+    if len(items) > page_size:
+        items = items[:page_size]
+        return items, encode_cursor(sort, items[-1])
+    return items, None
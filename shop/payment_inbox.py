@@ -0,0 +1,197 @@
+"""
+Вхідна черга callback LiqPay.
+
+liqpay_callback лише перевіряє підпис і записує сирі data/signature у
+PaymentCallback: LiqPay отримує відповідь після одного INSERT, скільки б не
+тривало створення замовлення. Чергу розбирає drain(): бере пакет готових
+записів, "орендуючи" їх (next_attempt_at зсувається на PAYMENT_INBOX_LEASE),
+і передає кожен у payments.process_payment. Невдала обробка повторюється з
+експоненційною затримкою; якщо воркер упав посеред пакета, записи після
+закінчення оренди візьме наступний. Повторна обробка безпечна — дублікати
+відсікає журнал PaymentEvent. Запис, який не розкодовується або не вдався
+PAYMENT_INBOX_MAX_ATTEMPTS разів, отримує failed_at і лишається в адмінці
+для розбору (звідти його можна повернути в чергу).
+
+Розбирає чергу або фоновий потік процесу (PAYMENT_INBOX_WORKER='thread';
+запускається першим запитом до воркера, тож записи, що лишилися в черзі після
+перезапуску, не чекають нового callback, і будиться кожним новим callback),
+або окремий процес — команда drain_payment_inbox --loop (PAYMENT_INBOX_WORKER='command').
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import liqpay as liqpay_helper
+from .models import PaymentCallback
+from .payments import process_payment
+
+logger = logging.getLogger(__name__)
+
+# Оброблені записи видаляються не частіше ніж раз на годину
+PURGE_INTERVAL = timedelta(hours=1)
+
+
+def enqueue(data, signature):
+    callback = PaymentCallback.objects.create(data=data, signature=signature)
+    if settings.PAYMENT_INBOX_WORKER == 'thread':
+        transaction.on_commit(inbox_worker.wake)
+    return callback
+
+
+def retry_delay(attempts):
+    """Затримка в секундах перед наступною спробою після attempts невдалих"""
+    return min(settings.PAYMENT_INBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.PAYMENT_INBOX_MAX_RETRY_DELAY)
+
+
+def _claim(batch_size, now):
+    """Бере в оренду до batch_size готових записів; записи, які вже бере інший воркер, пропускаються"""
+    with transaction.atomic():
+        ids = list(
+            PaymentCallback.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, failed_at__isnull=True, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        PaymentCallback.objects.filter(pk__in=ids).update(
+            next_attempt_at=now + timedelta(seconds=settings.PAYMENT_INBOX_LEASE),
+            attempts=F('attempts') + 1,
+        )
+    return list(PaymentCallback.objects.filter(pk__in=ids).order_by('received_at'))
+
+
+def drain(batch_size=None):
+    """Обробляє готові записи черги пакетами, доки вони є; повертає (оброблено, невдалих спроб)"""
+    batch_size = batch_size or settings.PAYMENT_INBOX_BATCH_SIZE
+    processed = failed = 0
+    while True:
+        batch = _claim(batch_size, timezone.now())
+        if not batch:
+            return processed, failed
+        done = []
+        for callback in batch:
+            try:
+                payload = liqpay_helper.decode_callback(callback.data)
+            except ValueError as exc:
+                # base64/UTF-8/JSON — повтор нічого не змінить
+                failed += 1
+                _fail(callback, exc, permanent=True)
+                continue
+            try:
+                process_payment(payload)
+            except Exception as exc:
+                failed += 1
+                _fail(callback, exc, permanent=callback.attempts >= settings.PAYMENT_INBOX_MAX_ATTEMPTS)
+            else:
+                done.append(callback.pk)
+        if done:
+            PaymentCallback.objects.filter(pk__in=done).update(processed_at=timezone.now(), last_error='')
+            processed += len(done)
+
+
+def _fail(callback, exc, permanent):
+    error = f'{type(exc).__name__}: {exc}'[:1000]
+    now = timezone.now()
+    if permanent:
+        logger.exception('Callback LiqPay #%s не оброблено остаточно (спроба %s)', callback.pk, callback.attempts)
+        PaymentCallback.objects.filter(pk=callback.pk).update(failed_at=now, last_error=error)
+    else:
+        logger.exception('Не вдалося обробити callback LiqPay #%s (спроба %s)', callback.pk, callback.attempts)
+        PaymentCallback.objects.filter(pk=callback.pk).update(
+            next_attempt_at=now + timedelta(seconds=retry_delay(callback.attempts)), last_error=error,
+        )
+
+
+def requeue(callbacks):
+    """Повертає остаточно невдалі записи в чергу з новим лічильником спроб"""
+    return callbacks.filter(failed_at__isnull=False).update(
+        failed_at=None, attempts=0, next_attempt_at=timezone.now(),
+    )
+
+
+def purge_processed(older_than):
+    """Видаляє записи, оброблені раніше older_than"""
+    deleted, _ = PaymentCallback.objects.filter(processed_at__lt=older_than).delete()
+    return deleted
+
+
+def inbox_stats(window=timedelta(hours=1)):
+    """Глибина черги й затримка обробки за останній window — для адмінки"""
+    now = timezone.now()
+    queued = PaymentCallback.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+    summary = queued.aggregate(oldest=Min('received_at'))
+    latencies = sorted(
+        processed_at - received_at
+        for received_at, processed_at in PaymentCallback.objects.filter(processed_at__gte=now - window)
+        .values_list('received_at', 'processed_at')
+    )
+    total = len(latencies)
+    return {
+        'depth': queued.count(),
+        'failing': queued.exclude(last_error='').count(),
+        'dead': PaymentCallback.objects.filter(failed_at__isnull=False).count(),
+        'oldest_age': now - summary['oldest'] if summary['oldest'] else None,
+        'window': window,
+        'processed': total,
+        'latency_p50': latencies[total // 2] if latencies else None,
+        'latency_p95': latencies[min(total - 1, int(total * 0.95))] if latencies else None,
+        'latency_max': latencies[-1] if latencies else None,
+    }
+
+
+class InboxWorker:
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._purged_at = None
+
+    def wake(self):
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def run_once(self):
+        processed, failed = drain(self.batch_size)
+        now = timezone.now()
+        if self._purged_at is None or now - self._purged_at >= PURGE_INTERVAL:
+            purge_processed(now - timedelta(seconds=settings.PAYMENT_INBOX_RETENTION))
+            self._purged_at = now
+        return processed, failed
+
+    def run_forever(self):
+        while True:
+            try:
+                self.run_once()
+            except DatabaseError:
+                logger.exception('Помилка бази під час розбору черги callback LiqPay')
+            finally:
+                # Потік живе довго — не тримаємо відкрите з'єднання між пакетами
+                connections.close_all()
+            self._wakeup.wait(settings.PAYMENT_INBOX_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run_forever, name='payment-inbox-worker', daemon=True)
+            self._thread.start()
+
+
+inbox_worker = InboxWorker()
+
+
+def start_worker_on_first_request(sender, **kwargs):
+    """request_started (PAYMENT_INBOX_WORKER='thread'): запускає потік у кожному веб-воркері"""
+    request_started.disconnect(start_worker_on_first_request)
+    inbox_worker.wake()
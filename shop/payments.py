@@ -0,0 +1,114 @@
+"""
+Обробка подій оплати LiqPay — спільна для liqpay_callback і liqpay_result.
+
+Для одного платежу обидва запити можуть прийти одночасно, а LiqPay ще й
+повторює callback. Кожна подія спершу записується в журнал PaymentEvent з
+унікальною парою (liqpay_order_id, status) — у тій самій транзакції, що й
+створення замовлення. Обробляє подію лише запит, чий INSERT пройшов; інший
+отримує IntegrityError і просто читає вже створене замовлення (конкурентний
+INSERT чекає на коміт першої транзакції, тож замовлення на той момент уже є).
+Якщо створення замовлення впало, запис журналу відкочується разом із ним і
+наступна доставка обробить подію заново.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, transaction
+
+from .cart_store import CartKey, resolve_lines
+from .models import Order, PaymentEvent, PendingCheckout
+from .order_placement import backoff, lines_from_cart, place_order
+from .stock_holds import release_pending_holds
+
+SUCCESS_STATUSES = ('success', 'sandbox')
+FAILURE_STATUSES = ('failure', 'error', 'reversed')
+
+
+def create_order_from_pending(pending):
+    """Створює Order з позиціями з даних PendingCheckout, списує залишок і знімає утримання"""
+    form_data = pending.form_data
+    items = {}
+    for cart_key, quantity in pending.cart_snapshot.items():
+        items[CartKey.parse(cart_key)] = int(quantity)
+    cart_items, _ = resolve_lines(items)
+
+    order = Order(
+        customer=pending.customer,
+        total=pending.grand_total,
+        payment_method='online',
+        payment_status='paid',
+        status='processing',
+        liqpay_token=str(pending.token),
+        first_name=form_data.get('first_name', ''),
+        last_name=form_data.get('last_name', ''),
+        email=form_data.get('email', ''),
+        phone=form_data.get('phone', ''),
+        address=form_data.get('address', ''),
+        city=form_data.get('city', ''),
+        postal_code=form_data.get('postal_code', ''),
+        postal_branch=form_data.get('postal_branch', ''),
+        delivery_method=form_data.get('delivery_method', ''),
+        shipping_cost=pending.shipping_cost,
+    )
+    # Оплату вже отримано — замовлення створюється навіть якщо залишку забракло
+    place_order(order, lines_from_cart(cart_items), allow_shortage=True, pending=pending)
+    return order
+
+
+def paid_order(liqpay_order_id):
+    """Замовлення, створене за оплатою liqpay_order_id, або None"""
+    return Order.objects.filter(liqpay_token=str(liqpay_order_id)).first()
+
+
+def _pending(liqpay_order_id):
+    try:
+        return PendingCheckout.objects.filter(token=liqpay_order_id).first()
+    except ValidationError:
+        return None
+
+
+def _record(liqpay_order_id, status, payload):
+    """Записує подію в журнал; None, якщо її вже записав інший запит"""
+    try:
+        with transaction.atomic():
+            return PaymentEvent.objects.create(liqpay_order_id=liqpay_order_id, status=status, payload=payload)
+    except IntegrityError:
+        return None
+
+
+def process_payment(payload):
+    """
+    Обробляє розкодований payload LiqPay рівно один раз на пару (order_id, status).
+    Повертає оплачене замовлення (створене зараз чи раніше) або None.
+    """
+    liqpay_order_id = str(payload.get('order_id') or '')
+    status = str(payload.get('status') or '')
+    if not liqpay_order_id or not status:
+        return None
+    retries = settings.ORDER_PLACEMENT_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            return _process(liqpay_order_id, status, payload)
+        except OperationalError:
+            if attempt == retries:
+                raise
+            backoff(attempt)
+
+
+def _process(liqpay_order_id, status, payload):
+    with transaction.atomic():
+        event = _record(liqpay_order_id, status, payload)
+        if event is None:
+            return paid_order(liqpay_order_id)
+
+        pending = _pending(liqpay_order_id)
+        if status in SUCCESS_STATUSES:
+            if pending is None:
+                # Оформлення оброблено ще до появи журналу
+                return paid_order(liqpay_order_id)
+            event.order = create_order_from_pending(pending)
+            event.save(update_fields=['order'])
+            pending.delete()
+            return event.order
+        if status in FAILURE_STATUSES and pending is not None:
+            release_pending_holds(pending)
+    return None
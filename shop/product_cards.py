@@ -0,0 +1,54 @@
+"""
+Кеш HTML-карток товарів каталогу.
+
+Кожна картка кешується окремо під ключем з версією товару. Версія змінюється
+після оновлення зведення товару (ProductListingSummary), яке перераховується
+при записі товару, його варіантів, фото, відгуків і продажів, а також при зміні
+смаку (назва й колір є в картці), — тож картка завжди відповідає даним, з яких
+вона побудована. Версії й картки читаються
+get_many, тому сторінка з 24 товарів — це два звернення до кешу.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .caching import bump_versions, get_versions
+
+CARD_TEMPLATE = 'shop/partials/product_card.html'
+
+
+def _version_name(product_id):
+    return f'product:{product_id}'
+
+
+def _card_key(product_id, version):
+    return f'shop:card:{product_id}:{version}'
+
+
+def render_product_cards(products):
+    """HTML карток у порядку products (товари з Product.objects.for_listing() і _attach_listing_data)"""
+    products = list(products)
+    if not products:
+        return []
+
+    versions = get_versions(_version_name(product.id) for product in products)
+    keys = {product.id: _card_key(product.id, versions[_version_name(product.id)]) for product in products}
+    cached = cache.get_many(keys.values())
+
+    cards = []
+    missing = {}
+    for product in products:
+        html = cached.get(keys[product.id])
+        if html is None:
+            html = render_to_string(CARD_TEMPLATE, {'product': product})
+            missing[keys[product.id]] = html
+        cards.append(mark_safe(html))
+
+    if missing:
+        cache.set_many(missing, settings.PRODUCT_CARD_CACHE_TIMEOUT)
+    return cards
+
+
+def invalidate_product_cards(product_ids):
+    bump_versions(_version_name(product_id) for product_id in product_ids)
@@ -0,0 +1,51 @@
+"""
+Дані сторінки товару за фіксовану кількість запитів.
+
+Товар із категорією, варіанти зі смаками, фото, відгуки з авторами та
+відповідями і схожі товари завантажуються наперед (7 запитів незалежно від
+кількості варіантів, фото, відгуків), а рейтинг, мінімальна ціна й залишок
+рахуються в Python з уже завантажених даних.
+"""
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+
+from .models import Product, ProductVariant, Review, ReviewReply
+
+RELATED_PRODUCTS_LIMIT = 4
+
+
+def load_product_page(product_id):
+    product = get_object_or_404(
+        Product.objects
+        .select_related('category')
+        .prefetch_related(
+            Prefetch('variants', queryset=ProductVariant.objects.select_related('flavor').order_by('id')),
+            'extra_images',
+            Prefetch(
+                'reviews',
+                queryset=Review.objects.select_related('customer').prefetch_related(
+                    Prefetch('replies', queryset=ReviewReply.objects.select_related('admin')),
+                ),
+            ),
+        ),
+        id=product_id,
+    )
+
+    reviews = product.reviews.all()
+    ratings = [review.rating for review in reviews]
+    avg_rating = sum(ratings) / len(ratings) if ratings else None
+
+    related_products = list(
+        Product.objects.for_listing().exclude(id=product.id).order_by('-created_at')[:RELATED_PRODUCTS_LIMIT]
+    )
+
+    return {
+        'product': product,
+        'reviews': reviews,
+        'review_count': len(ratings),
+        'aggregate_avg_rating': int(round(avg_rating)) if avg_rating is not None else 0,
+        'min_price': product.get_min_price(),
+        'variants': product.variants.all(),
+        'available_stock': product.get_available_stock(),
+        'related_products': related_products,
+    }
@@ -0,0 +1,258 @@
+"""
+Профілювання запитів: скільки SQL і часу бази коштує кожна view.
+
+QueryProfilingMiddleware (вмикається QUERY_PROFILING) на час запиту ставить
+connection.execute_wrapper, що рахує запити, їх час і "відбитки" — SQL без
+параметрів, тож однаковий запит з різними id (типовий N+1) дає дублікати.
+Час рендерингу шаблонів міряє бекенд ProfilingTemplates. Результат іде в
+заголовок Server-Timing і в кільцевий буфер процесу, з якого будується звіт
+за іменами маршрутів (shop:catalog, shop:cart, …) на сторінці admin/performance/.
+
+Бюджети запитів QUERY_BUDGETS перевіряються в тестах:
+
+    with profile_queries() as profile:
+        response = self.client.get(url)
+    check_query_budget(response.resolver_match.view_name, profile)
+
+а з увімкненим профілюванням перевищення ще й пишуться в лог.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# Найбільше SQL-запитів і повторних запитів (сума повторів відбитків) на один запит сторінки
+QueryBudget = namedtuple('QueryBudget', ['queries', 'duplicates'], defaults=[0])
+
+# Для сторінки без кешу й анонімного покупця; кількість не має залежати від числа товарів
+QUERY_BUDGETS = {
+    'shop:home': QueryBudget(6),
+    'shop:catalog': QueryBudget(4),
+    'shop:product_detail': QueryBudget(8),
+    'shop:cart': QueryBudget(8),
+    'shop:add_to_cart': QueryBudget(16),
+    'shop:checkout': QueryBudget(7),
+}
+
+RequestSample = namedtuple('RequestSample', [
+    'view_name', 'method', 'status', 'finished_at', 'total', 'db_time', 'queries', 'duplicates', 'render_time',
+    'top_duplicate',
+])
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+_current = ContextVar('query_profile', default=None)
+
+
+def fingerprint(sql):
+    """SQL без параметрів; списки IN (%s, …) різної довжини зводяться до одного"""
+    return _IN_LIST.sub('IN (...)', _WHITESPACE.sub(' ', sql.strip()))
+
+
+class QueryProfile:
+    """execute_wrapper: рахує запити, час бази й повтори відбитків"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.fingerprints = Counter()
+        self._render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.fingerprints.values() if count > 1)
+
+    def repeated(self):
+        """[(відбиток, кількість)] запитів, виконаних більше одного разу, від найчастіших"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+
+@contextmanager
+def profile_queries():
+    """Профіль усіх запитів до бази (і рендерингу, якщо увімкнено ProfilingTemplates) у блоці"""
+    profile = QueryProfile()
+    token = _current.set(profile)
+    try:
+        with connection.execute_wrapper(profile):
+            yield profile
+    finally:
+        _current.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def budget_problems(view_name, profile):
+    budget = QUERY_BUDGETS.get(view_name)
+    if budget is None:
+        return []
+    problems = []
+    if profile.queries > budget.queries:
+        problems.append(f'{profile.queries} запитів при бюджеті {budget.queries}')
+    if profile.duplicates > budget.duplicates:
+        repeated = '; '.join(f'{count}× {sql[:200]}' for sql, count in profile.repeated()[:3])
+        problems.append(f'{profile.duplicates} повторних запитів (бюджет {budget.duplicates}): {repeated}')
+    return problems
+
+
+def check_query_budget(view_name, profile):
+    """QueryBudgetExceeded, якщо view_name вийшла за свій бюджет у QUERY_BUDGETS"""
+    problems = budget_problems(view_name, profile)
+    if problems:
+        raise QueryBudgetExceeded(f'{view_name}: ' + '; '.join(problems))
+
+
+class SampleBuffer:
+    """Останні QUERY_PROFILING_BUFFER_SIZE запитів процесу"""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def add(self, sample):
+        with self._lock:
+            self._samples.append(sample)
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+sample_buffer = SampleBuffer(getattr(settings, 'QUERY_PROFILING_BUFFER_SIZE', 2000))
+
+
+def view_report(samples=None):
+    """Зведення буфера за іменами маршрутів, від найдорожчих за сумарним часом"""
+    by_view = {}
+    for sample in sample_buffer.samples() if samples is None else samples:
+        by_view.setdefault(sample.view_name, []).append(sample)
+    report = []
+    for view_name, rows in by_view.items():
+        count = len(rows)
+        totals = sorted(row.total for row in rows)
+        budget = QUERY_BUDGETS.get(view_name)
+        worst = max(rows, key=lambda row: (row.duplicates, row.queries))
+        report.append({
+            'view_name': view_name,
+            'requests': count,
+            'queries_avg': sum(row.queries for row in rows) / count,
+            'queries_max': max(row.queries for row in rows),
+            'budget': budget.queries if budget else None,
+            'over_budget': sum(1 for row in rows if budget and row.queries > budget.queries),
+            'db_ms_avg': sum(row.db_time for row in rows) / count * 1000,
+            'render_ms_avg': sum(row.render_time for row in rows) / count * 1000,
+            'total_ms_avg': sum(totals) / count * 1000,
+            'total_ms_p95': totals[min(count - 1, int(count * 0.95))] * 1000,
+            'duplicates_max': worst.duplicates,
+            'top_duplicate': worst.top_duplicate,
+            'time_share': sum(totals),
+        })
+    report.sort(key=lambda row: row['time_share'], reverse=True)
+    return report
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<без маршруту>'
+    return match.view_name or match._func_path
+
+
+def _server_timing(profile, total):
+    return ', '.join([
+        f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries, {profile.duplicates} duplicates"',
+        f'render;dur={profile.render_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class QueryProfilingMiddleware:
+    """
+    Стоїть першою в MIDDLEWARE (див. QUERY_PROFILING у settings), щоб враховувати
+    і запити інших middleware — сесії, кошика в context processors тощо.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        view_name = _view_name(request)
+        repeated = profile.repeated()
+        sample_buffer.add(RequestSample(
+            view_name=view_name,
+            method=request.method,
+            status=response.status_code,
+            finished_at=time.time(),
+            total=total,
+            db_time=profile.db_time,
+            queries=profile.queries,
+            duplicates=profile.duplicates,
+            render_time=profile.render_time,
+            top_duplicate=f'{repeated[0][1]}× {repeated[0][0][:300]}' if repeated else '',
+        ))
+        problems = budget_problems(view_name, profile)
+        if problems:
+            logger.warning('%s %s: %s', view_name, request.path, '; '.join(problems))
+        response['Server-Timing'] = _server_timing(profile, total)
+        return response
+
+
+class ProfilingTemplates(DjangoTemplates):
+    """Шаблонний бекенд, що додає час рендерингу до профілю поточного запиту"""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return self.template.render(context, request)
+        # Вкладений render_to_string (шаблонні теги, картки товарів) уже в часі зовнішнього
+        profile._render_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            profile._render_depth -= 1
+            if not profile._render_depth:
+                profile.render_time += time.perf_counter() - started
@@ -0,0 +1,227 @@
+"""
+Повнотекстовий пошук товарів.
+
+Документ товару (назва + опис, категорія, смаки, грамовки) зберігається в
+ProductSearchDocument, а індекс будує бекенд, що відповідає базі даних:
+- PostgreSQL: колонка tsvector з GIN-індексом (конфігурація SEARCH_TS_CONFIG);
+- SQLite: віртуальна таблиця FTS5 з ранжуванням bm25;
+- інші бази: простий icontains без ранжування.
+Бекенд можна перевизначити через settings.SEARCH_BACKEND (шлях до класу).
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductSearchDocument
+
+# Каталог показує не більше стільки результатів пошуку (про обрізання сповіщає shop/partials/catalog_pager.html)
+SEARCH_RESULT_LIMIT = 500
+
+FTS_TABLE = 'shop_product_fts'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _query_terms(query):
+    return _TERM_RE.findall((query or '').lower())[:10]
+
+
+def build_documents(product_ids):
+    """Створює/оновлює ProductSearchDocument для товарів і повертає їх"""
+    products = (
+        Product.objects
+        .filter(id__in=product_ids)
+        .select_related('category__parent')
+        .prefetch_related('variants__flavor')
+    )
+    documents = []
+    for product in products:
+        parts = [product.description]
+        category = product.category
+        while category is not None:
+            parts.append(category.name)
+            category = category.parent
+        for variant in product.variants.all():
+            if variant.flavor:
+                parts.append(variant.flavor.name)
+            if variant.weight_label:
+                parts.append(variant.weight_label)
+        documents.append(ProductSearchDocument(
+            product_id=product.id,
+            title=product.name,
+            body=' '.join(part for part in dict.fromkeys(parts) if part),
+        ))
+    if documents:
+        ProductSearchDocument.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['title', 'body', 'updated_at'],
+        )
+    return documents
+
+
+class SimpleSearchBackend:
+    """Пошук без індексу: icontains по документу товару"""
+
+    def index(self, documents):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(body__icontains=term)
+        return list(
+            ProductSearchDocument.objects
+            .filter(condition)
+            .order_by('product_id')
+            .values_list('product_id', flat=True)[:limit]
+        )
+
+
+class PostgresSearchBackend(SimpleSearchBackend):
+    """tsvector (назва з вагою A, решта — B) + GIN-індекс, ранжування ts_rank"""
+
+    @property
+    def config(self):
+        return getattr(settings, 'SEARCH_TS_CONFIG', 'simple')
+
+    def index(self, documents):
+        ids = [document.product_id for document in documents]
+        if not ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE shop_productsearchdocument '
+                'SET search_vector = setweight(to_tsvector(%s::regconfig, title), \'A\') '
+                '|| setweight(to_tsvector(%s::regconfig, body), \'B\') '
+                'WHERE product_id = ANY(%s)',
+                [self.config, self.config, ids],
+            )
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        # Кожне слово шукаємо як префікс, щоб працював пошук під час набору
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT product_id FROM shop_productsearchdocument '
+                'WHERE search_vector @@ to_tsquery(%s::regconfig, %s) '
+                'ORDER BY ts_rank(search_vector, to_tsquery(%s::regconfig, %s)) DESC, product_id '
+                'LIMIT %s',
+                [self.config, tsquery, self.config, tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SqliteFtsSearchBackend(SimpleSearchBackend):
+    """FTS5-таблиця shop_product_fts (rowid = id товару), ранжування bm25"""
+
+    def index(self, documents):
+        if not documents:
+            return
+        self.remove([document.product_id for document in documents])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (%s, %s, %s)',
+                [(document.product_id, document.title, document.body) for document in documents],
+            )
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), rowid LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_fts_table_exists = None
+
+
+def _sqlite_fts_available():
+    # Збірка SQLite може бути без FTS5 — тоді міграція не створює таблицю
+    global _fts_table_exists
+    if _fts_table_exists is None:
+        _fts_table_exists = FTS_TABLE in connection.introspection.table_names()
+    return _fts_table_exists
+
+
+def get_backend():
+    backend_path = getattr(settings, 'SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and _sqlite_fts_available():
+        return SqliteFtsSearchBackend()
+    return SimpleSearchBackend()
+
+
+def search_product_ids(query, limit=SEARCH_RESULT_LIMIT):
+    """Id товарів, що відповідають запиту, від найрелевантнішого"""
+    return get_backend().search(query, limit=limit)
+
+
+def index_products(product_ids):
+    backend = get_backend()
+    product_ids = set(product_ids)
+    documents = build_documents(product_ids)
+    backend.index(documents)
+    # Товари, яких уже немає, прибираємо з індексу
+    removed = product_ids - {document.product_id for document in documents}
+    if removed:
+        backend.remove(removed)
+
+
+def reindex_all(batch_size=500):
+    ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), batch_size):
+        index_products(ids[start:start + batch_size])
+    return len(ids)
+
+
+_pending = threading.local()
+
+
+def schedule_search_reindex(product_ids):
+    """
+    Переіндексовує товари після коміту. Товари збираються до коміту, тож товар,
+    збережений разом із варіантами, індексується один раз.
+    """
+    product_ids = {product_id for product_id in product_ids if product_id}
+    if not product_ids:
+        return
+    _pending.__dict__.setdefault('product_ids', set()).update(product_ids)
+    transaction.on_commit(_reindex_pending)
+
+
+def _reindex_pending():
+    product_ids = _pending.__dict__.pop('product_ids', None)
+    if product_ids:
+        index_products(product_ids)
@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .listing_summary import schedule_listing_summary_refresh
+from .models import CartItem, Category, Flavor, Order, OrderItem, Product, ProductImage, ProductVariant, Review, ReviewReply
+from .cart_store import invalidate_cart_prices, recount_cart
+from .category_tree import invalidate_category_tree
+from .page_cache import invalidate_page_cache
+from .product_cards import invalidate_product_cards
+from .search import schedule_search_reindex
+from .statistics import schedule_statistics_refresh
+from .suggest import invalidate_suggestions
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    schedule_listing_summary_refresh([instance.pk])
+    schedule_search_reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    schedule_search_reindex([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def product_listing_data_changed(sender, instance, **kwargs):
+    """Зміни варіантів, відгуків, фото та продажів впливають на зведення товару"""
+    schedule_listing_summary_refresh([instance.product_id])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def product_variant_search_changed(sender, instance, **kwargs):
+    # Смаки та грамовки варіантів входять у пошуковий документ товару
+    schedule_search_reindex([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    category_ids = [instance.pk]
+    level = [instance.pk]
+    while level:
+        level = list(Category.objects.filter(parent_id__in=level).values_list('id', flat=True))
+        category_ids.extend(level)
+    schedule_search_reindex(Product.objects.filter(category_id__in=category_ids).values_list('id', flat=True))
+
+
+def _flavor_changed(flavor):
+    product_ids = list(ProductVariant.objects.filter(flavor=flavor).values_list('product_id', flat=True).distinct())
+    schedule_search_reindex(product_ids)
+    # Назва й колір смаку вбудовані в закешовані картки товарів (flavors_json)
+    transaction.on_commit(lambda: invalidate_product_cards(product_ids))
+
+
+@receiver(post_save, sender=Flavor)
+def flavor_saved(sender, instance, **kwargs):
+    _flavor_changed(instance)
+
+
+@receiver(pre_delete, sender=Flavor)
+def flavor_deleted(sender, instance, **kwargs):
+    # Після видалення варіанти вже без смаку (SET_NULL), тож товари збираємо до нього
+    _flavor_changed(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Flavor)
+@receiver(post_delete, sender=Flavor)
+def suggestion_names_changed(sender, instance, **kwargs):
+    # Індекс підказок будується з назв — перебудуємо його при наступному запиті
+    transaction.on_commit(invalidate_suggestions)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_tree_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def cart_prices_changed(sender, instance, **kwargs):
+    # Ціни позицій у кеші сум кошиків беруться з варіантів
+    transaction.on_commit(invalidate_cart_prices)
+
+
+@receiver(post_delete, sender=CartItem)
+def cart_item_deleted(sender, instance, **kwargs):
+    # Позиції зникають і каскадом від товару чи варіанту — лічильник кошика звіряємо з рештою
+    recount_cart(instance.cart_id)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_statistics_changed(sender, instance, **kwargs):
+    schedule_statistics_refresh(instance.created_at)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_statistics_changed(sender, instance, **kwargs):
+    if OrderItem.order.is_cached(instance):
+        created_at = instance.order.created_at
+    else:
+        # Якщо замовлення вже видалене, годину перерахує сигнал самого Order
+        created_at = Order.objects.filter(pk=instance.order_id).values_list('created_at', flat=True).first()
+    schedule_statistics_refresh(created_at)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=ReviewReply)
+@receiver(post_delete, sender=ReviewReply)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Flavor)
+@receiver(post_delete, sender=Flavor)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def catalog_pages_changed(sender, instance, **kwargs):
+    # Закешовані сторінки каталогу (shop/page_cache.py) стають неактуальними;
+    # продажі змінюють залишки та популярні товари на головній
+    transaction.on_commit(invalidate_page_cache)
@@ -1,7 +1,10 @@
 
 
 document.addEventListener('DOMContentLoaded', function() {
+    // Підказки реєструють Enter раніше за фільтри, щоб перехоплювати вибір підказки
+    initializeSearchSuggestions();
     initializeFilters();
+    initializeInfiniteScroll();
     initializeAnimations();
     initializeCartFeatures();
     initializeFormValidation();
@@ -33,12 +36,139 @@ function initializeFilters() {
     }
 }
 
+// === ПІДКАЗКИ ПОШУКУ ===
+const SUGGESTION_ICONS = {
+    product: 'fa-box',
+    category: 'fa-folder',
+    flavor: 'fa-tint'
+};
+
+function initializeSearchSuggestions() {
+    const searchInput = document.getElementById('searchInput');
+    const list = document.getElementById('searchSuggestions');
+    if (!searchInput || !list || !searchInput.dataset.suggestUrl) return;
+
+    let activeIndex = -1;
+    let controller = null;
+
+    const hide = () => {
+        list.classList.add('hidden');
+        list.innerHTML = '';
+        activeIndex = -1;
+    };
+
+    const highlight = (index) => {
+        const items = list.querySelectorAll('li');
+        items.forEach((item, i) => item.classList.toggle('bg-blue-50', i === index));
+        activeIndex = index;
+    };
+
+    const render = (suggestions) => {
+        list.innerHTML = '';
+        if (!suggestions.length) {
+            hide();
+            return;
+        }
+        suggestions.forEach((suggestion) => {
+            const item = document.createElement('li');
+            item.className = 'flex items-center gap-2 px-3 py-2 cursor-pointer hover:bg-blue-50 text-gray-800';
+            item.dataset.url = suggestion.url;
+            const icon = document.createElement('i');
+            icon.className = 'fas ' + (SUGGESTION_ICONS[suggestion.type] || 'fa-search') + ' text-blue-600 w-4';
+            const label = document.createElement('span');
+            label.textContent = suggestion.label;
+            item.append(icon, label);
+            // mousedown спрацьовує раніше за blur поля
+            item.addEventListener('mousedown', (e) => {
+                e.preventDefault();
+                window.location.href = suggestion.url;
+            });
+            list.appendChild(item);
+        });
+        activeIndex = -1;
+        list.classList.remove('hidden');
+    };
+
+    const fetchSuggestions = debounce(() => {
+        const query = searchInput.value.trim();
+        if (controller) controller.abort();
+        if (query.length < 2) {
+            hide();
+            return;
+        }
+        controller = new AbortController();
+        const url = searchInput.dataset.suggestUrl + '?' + new URLSearchParams({ q: query });
+        fetch(url, { signal: controller.signal, headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.json())
+            .then(data => {
+                if (data.query === searchInput.value.trim()) {
+                    render(data.suggestions || []);
+                }
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') hide();
+            });
+    }, 150);
+
+    searchInput.addEventListener('input', fetchSuggestions);
+    searchInput.addEventListener('blur', hide);
+    searchInput.addEventListener('keydown', (e) => {
+        const items = list.querySelectorAll('li');
+        if (e.key === 'Escape') {
+            hide();
+        } else if (e.key === 'ArrowDown' && items.length) {
+            e.preventDefault();
+            highlight((activeIndex + 1) % items.length);
+        } else if (e.key === 'ArrowUp' && items.length) {
+            e.preventDefault();
+            highlight((activeIndex - 1 + items.length) % items.length);
+        } else if (e.key === 'Enter' && activeIndex >= 0 && items[activeIndex]) {
+            e.preventDefault();
+            e.stopImmediatePropagation();
+            window.location.href = items[activeIndex].dataset.url;
+        } else if (e.key === 'Enter') {
+            hide();
+        }
+    });
+}
+
+// === КЕШ РЕЗУЛЬТАТІВ ФІЛЬТРІВ ===
+// Невеликий LRU останніх відповідей каталогу; записи старіють, щоб не показувати
+// застарілі ціни й залишки довше за CATALOG_CACHE_TTL_MS
+const CATALOG_CACHE_SIZE = 12;
+const CATALOG_CACHE_TTL_MS = 2 * 60 * 1000;
+
+const catalogResultsCache = {
+    entries: new Map(),
+
+    get(key) {
+        const entry = this.entries.get(key);
+        if (!entry) return null;
+        this.entries.delete(key);
+        if (Date.now() - entry.storedAt > CATALOG_CACHE_TTL_MS) {
+            return null;
+        }
+        // Перевставлення робить запис найсвіжішим
+        this.entries.set(key, entry);
+        return entry.data;
+    },
+
+    set(key, data) {
+        this.entries.delete(key);
+        this.entries.set(key, { data, storedAt: Date.now() });
+        while (this.entries.size > CATALOG_CACHE_SIZE) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+    }
+};
+
 function applyFilters() {
     const categoryFilter = document.getElementById('categoryFilter');
     const sortFilter = document.getElementById('sortFilter');
     const searchInput = document.getElementById('searchInput');
     const productsGrid = document.getElementById('productsGrid');
     const catalogHero = document.getElementById('catalogHero');
+    const catalogPager = document.getElementById('catalogPager');
     const categoryId = categoryFilter ? categoryFilter.value : '';
     const sortValue = sortFilter ? sortFilter.value : '';
     const searchValue = searchInput ? searchInput.value.trim() : '';
@@ -59,8 +189,29 @@ function applyFilters() {
         return;
     }
 
+    const renderCatalog = (data) => {
+        productsGrid.innerHTML = data.products_html;
+        if (catalogHero && typeof data.hero_html === 'string') {
+            catalogHero.innerHTML = data.hero_html;
+        }
+        if (catalogPager) {
+            catalogPager.innerHTML = data.pager_html || '';
+            observeCatalogPager();
+        }
+        productsGrid.style.opacity = '1';
+        window.history.pushState({}, '', url);
+    };
+
+    // Повторна комбінація фільтрів показується з пам'яті, без запиту до сервера
+    const cached = catalogResultsCache.get(url);
+    if (cached) {
+        renderCatalog(cached);
+        return;
+    }
+
     productsGrid.style.opacity = '0.55';
 
+    // Браузер сам надсилає If-None-Match і на 304 віддає збережену відповідь
     fetch(url, {
         method: 'GET',
         credentials: 'same-origin',
@@ -79,12 +230,8 @@ function applyFilters() {
             throw new Error('catalog_filters_invalid_payload');
         }
 
-        productsGrid.innerHTML = data.products_html;
-        if (catalogHero && typeof data.hero_html === 'string') {
-            catalogHero.innerHTML = data.hero_html;
-        }
-        productsGrid.style.opacity = '1';
-        window.history.pushState({}, '', url);
+        catalogResultsCache.set(url, data);
+        renderCatalog(data);
     })
     .catch(() => {
         productsGrid.style.opacity = '1';
@@ -92,6 +239,86 @@ function applyFilters() {
     });
 }
 
+// === НЕСКІНЧЕННЕ ПРОКРУЧУВАННЯ КАТАЛОГУ ===
+let catalogPagerObserver = null;
+let catalogLoadingMore = false;
+
+function initializeInfiniteScroll() {
+    const catalogPager = document.getElementById('catalogPager');
+    if (!catalogPager) {
+        return;
+    }
+
+    // Кнопка "Показати ще" працює і без IntersectionObserver
+    catalogPager.addEventListener('click', (e) => {
+        const link = e.target.closest('[data-catalog-load-more]');
+        if (link) {
+            e.preventDefault();
+            loadMoreProducts();
+        }
+    });
+
+    if ('IntersectionObserver' in window) {
+        catalogPagerObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreProducts();
+            }
+        }, { rootMargin: '0px 0px 400px 0px' });
+        observeCatalogPager();
+    }
+}
+
+function observeCatalogPager() {
+    const catalogPager = document.getElementById('catalogPager');
+    if (!catalogPagerObserver || !catalogPager) {
+        return;
+    }
+    // Повторна підписка змушує observer одразу перевірити, чи пейджер ще видно
+    catalogPagerObserver.unobserve(catalogPager);
+    catalogPagerObserver.observe(catalogPager);
+}
+
+function loadMoreProducts() {
+    const productsGrid = document.getElementById('productsGrid');
+    const catalogPager = document.getElementById('catalogPager');
+    const link = catalogPager ? catalogPager.querySelector('[data-catalog-load-more]') : null;
+    if (!productsGrid || !link || catalogLoadingMore) {
+        return;
+    }
+
+    const nextUrl = link.getAttribute('href');
+    catalogLoadingMore = true;
+    link.classList.add('is-loading');
+
+    fetch(nextUrl, {
+        method: 'GET',
+        credentials: 'same-origin',
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest',
+        },
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error('catalog_page_failed');
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (!data || !data.success || typeof data.products_html !== 'string') {
+            throw new Error('catalog_page_invalid_payload');
+        }
+
+        productsGrid.insertAdjacentHTML('beforeend', data.products_html);
+        catalogPager.innerHTML = data.pager_html || '';
+        catalogLoadingMore = false;
+        observeCatalogPager();
+    })
+    .catch(() => {
+        catalogLoadingMore = false;
+        window.location.href = nextUrl;
+    });
+}
+
 // === АНІМАЦІЇ ===
 function initializeAnimations() {
     // Відстежувати елементи для анімацій появи
@@ -0,0 +1,221 @@
+"""
+Зведення (rollup) для статистики адмінки.
+
+Погодинні рядки StatsRollup / StatsStatusRollup / StatsProductRollup
+перераховуються з сирих Order, OrderItem і SiteVisit для змінених годин,
+а денні — підсумовуванням погодинних за відповідні дні. Дашборд читає лише
+ці таблиці, тож час його завантаження не залежить від обсягу історії.
+
+Оновлення:
+- сигнали Order/OrderItem після коміту перераховують годину замовлення;
+- буфер відвідувань (shop/visit_tracking.py) — години записаних відвідувань;
+- команда rebuild_statistics перебудовує зведення за весь період.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import (
+    Order, OrderItem, SiteVisit, StatsCustomerDay, StatsProductRollup, StatsRollup, StatsStatusRollup,
+)
+
+HOUR = timedelta(hours=1)
+ROLLUP_MODELS = (StatsRollup, StatsStatusRollup, StatsProductRollup)
+
+
+def hour_start(value):
+    return timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _bucket_day(bucket):
+    return timezone.localtime(bucket).date()
+
+
+def _hour_rows(start_dt, end_dt):
+    """Погодинні зведення з сирих даних: (загальні, за статусами, за товарами)"""
+    totals = defaultdict(lambda: {'orders_count': 0, 'revenue': Decimal('0'), 'visits': 0, 'registered_visits': 0})
+
+    orders = Order.objects.filter(created_at__gte=start_dt, created_at__lt=end_dt)
+    for row in (
+        orders.annotate(bucket=TruncHour('created_at'))
+        .values('bucket')
+        .annotate(orders_count=Count('id'), revenue=Sum('total'))
+        .order_by()
+    ):
+        totals[row['bucket']]['orders_count'] = row['orders_count']
+        totals[row['bucket']]['revenue'] = row['revenue'] or Decimal('0')
+
+    for row in (
+        SiteVisit.objects.filter(created_at__gte=start_dt, created_at__lt=end_dt)
+        .annotate(bucket=TruncHour('created_at'))
+        .values('bucket')
+        .annotate(visits=Count('id'), registered_visits=Count('id', filter=Q(customer__isnull=False)))
+        .order_by()
+    ):
+        totals[row['bucket']]['visits'] = row['visits']
+        totals[row['bucket']]['registered_visits'] = row['registered_visits']
+
+    statuses = [
+        StatsStatusRollup(granularity='hour', bucket=row['bucket'], status=row['status'], orders_count=row['count'])
+        for row in (
+            orders.annotate(bucket=TruncHour('created_at'))
+            .values('bucket', 'status')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+    ]
+    products = [
+        StatsProductRollup(granularity='hour', bucket=row['bucket'], product_id=row['product_id'], units=row['units'])
+        for row in (
+            OrderItem.objects.filter(order__created_at__gte=start_dt, order__created_at__lt=end_dt)
+            .annotate(bucket=TruncHour('order__created_at'))
+            .values('bucket', 'product_id')
+            .annotate(units=Sum('quantity'))
+            .order_by()
+        )
+    ]
+    rollups = [StatsRollup(granularity='hour', bucket=bucket, **values) for bucket, values in totals.items()]
+    return rollups, statuses, products
+
+
+def _day_rows(first_day, last_day):
+    """Денні зведення як суми погодинних"""
+    start_dt, end_dt = day_start(first_day), day_start(last_day + timedelta(days=1))
+    hour_filter = {'granularity': 'hour', 'bucket__gte': start_dt, 'bucket__lt': end_dt}
+
+    totals = defaultdict(lambda: {'orders_count': 0, 'revenue': Decimal('0'), 'visits': 0, 'registered_visits': 0})
+    for row in StatsRollup.objects.filter(**hour_filter):
+        values = totals[day_start(_bucket_day(row.bucket))]
+        values['orders_count'] += row.orders_count
+        values['revenue'] += row.revenue
+        values['visits'] += row.visits
+        values['registered_visits'] += row.registered_visits
+
+    statuses = defaultdict(int)
+    for row in StatsStatusRollup.objects.filter(**hour_filter).values('bucket', 'status', 'orders_count'):
+        statuses[(day_start(_bucket_day(row['bucket'])), row['status'])] += row['orders_count']
+
+    products = defaultdict(int)
+    for row in StatsProductRollup.objects.filter(**hour_filter).values('bucket', 'product_id', 'units'):
+        products[(day_start(_bucket_day(row['bucket'])), row['product_id'])] += row['units']
+
+    return (
+        [StatsRollup(granularity='day', bucket=bucket, **values) for bucket, values in totals.items()],
+        [
+            StatsStatusRollup(granularity='day', bucket=bucket, status=status, orders_count=count)
+            for (bucket, status), count in statuses.items()
+        ],
+        [
+            StatsProductRollup(granularity='day', bucket=bucket, product_id=product_id, units=units)
+            for (bucket, product_id), units in products.items()
+        ],
+    )
+
+
+def _replace_rows(granularity, start_dt, end_dt, rows_by_model):
+    for model, rows in zip(ROLLUP_MODELS, rows_by_model):
+        model.objects.filter(granularity=granularity, bucket__gte=start_dt, bucket__lt=end_dt).delete()
+        # ignore_conflicts: паралельне оновлення тієї ж години могло вже вставити рядки
+        model.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def _refresh_customer_days(first_day, last_day):
+    StatsCustomerDay.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+    StatsCustomerDay.objects.bulk_create(
+        [
+            StatsCustomerDay(day=row['visit_date'], customer_id=row['customer_id'])
+            for row in (
+                SiteVisit.objects
+                .filter(visit_date__gte=first_day, visit_date__lte=last_day, customer__isnull=False)
+                .values('visit_date', 'customer_id')
+                .distinct()
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def refresh_range(start_dt, end_dt):
+    """Перераховує погодинні зведення за [start_dt, end_dt) і денні за дні, яких вони торкаються"""
+    start_dt = hour_start(start_dt)
+    end_dt = hour_start(end_dt - timedelta(microseconds=1)) + HOUR
+    first_day = timezone.localtime(start_dt).date()
+    last_day = timezone.localtime(end_dt - HOUR).date()
+
+    with transaction.atomic():
+        _replace_rows('hour', start_dt, end_dt, _hour_rows(start_dt, end_dt))
+        _replace_rows(
+            'day', day_start(first_day), day_start(last_day + timedelta(days=1)),
+            _day_rows(first_day, last_day),
+        )
+        _refresh_customer_days(first_day, last_day)
+
+
+def rebuild_statistics(chunk_days=31):
+    """
+    Перебудовує всі зведення від першого замовлення/відвідування до поточної години.
+    Кожна частина замінюється в окремій транзакції (refresh_range), тож дашборд під час
+    перебудови бачить старі або вже нові цифри, а збій посередині не лишає зведення порожніми.
+    """
+    first_dates = [
+        value for value in (
+            Order.objects.order_by('created_at').values_list('created_at', flat=True).first(),
+            SiteVisit.objects.order_by('created_at').values_list('created_at', flat=True).first(),
+        ) if value
+    ]
+    if not first_dates:
+        with transaction.atomic():
+            for model in ROLLUP_MODELS:
+                model.objects.all().delete()
+            StatsCustomerDay.objects.all().delete()
+        return 0
+
+    start = day_start(timezone.localtime(min(first_dates)).date())
+    end = hour_start(timezone.now()) + HOUR
+    # Рядки поза періодом даних (замовлення й відвідування, яких уже немає) перерахунок не зачепить
+    with transaction.atomic():
+        for model in ROLLUP_MODELS:
+            model.objects.filter(Q(bucket__lt=start) | Q(bucket__gte=end)).delete()
+        StatsCustomerDay.objects.filter(
+            Q(day__lt=timezone.localtime(start).date()) | Q(day__gt=timezone.localtime(end - HOUR).date()),
+        ).delete()
+
+    chunks = 0
+    while start < end:
+        chunk_end = min(start + timedelta(days=chunk_days), end)
+        refresh_range(start, chunk_end)
+        start = chunk_end
+        chunks += 1
+    return chunks
+
+
+_pending = threading.local()
+
+
+def schedule_statistics_refresh(created_at):
+    """
+    Перераховує годину created_at після коміту. Кілька змін однієї години в
+    транзакції (замовлення і його позиції) дають один перерахунок.
+    """
+    if created_at is None:
+        return
+    hour = hour_start(created_at)
+    pending = _pending.__dict__.setdefault('hours', set())
+    pending.add(hour)
+
+    def refresh():
+        if hour in pending:
+            pending.discard(hour)
+            refresh_range(hour, hour + HOUR)
+
+    transaction.on_commit(refresh)
@@ -0,0 +1,197 @@
+"""
+Утримання залишку на час онлайн-оплати.
+
+Під час оформлення з оплатою LiqPay для кожної позиції створюється StockHold
+з терміном STOCK_HOLD_TTL, а reserved_quantity варіанту (чи товару без
+варіантів) збільшується умовним UPDATE — лише якщо stock_quantity - reserved_quantity
+вистачає. Доступний залишок скрізь рахується як stock_quantity - reserved_quantity,
+тож перевірки в каталозі й кошику не звертаються до таблиці утримань.
+
+Утримання знімаються:
+- після оплати — place_order списує їх разом із залишком (take_holds);
+- після невдалої оплати — release_pending_holds;
+- після закінчення терміну — команда expire_stock_holds (expire_holds),
+  а також спроба утримати товар, якому бракує залишку.
+Рядки утримань блокуються перед зняттям, тож оплата і прибирання не можуть
+зменшити reserved_quantity двічі.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .listing_summary import schedule_listing_summary_refresh
+from .models import PendingCheckout, Product, ProductVariant, StockHold
+from .page_cache import invalidate_page_cache
+
+
+class InsufficientStock(Exception):
+    def __init__(self, labels=()):
+        self.labels = list(labels)
+        super().__init__(', '.join(self.labels))
+
+
+def quantities_by_row(lines, by_variant):
+    """{id варіанту або товару: кількість} для позицій з варіантом (by_variant) чи без"""
+    quantities = {}
+    for line in lines:
+        if bool(line.variant_id) == by_variant:
+            pk = line.variant_id if by_variant else line.product_id
+            quantities[pk] = quantities.get(pk, 0) + line.quantity
+    return quantities
+
+
+def per_row(quantities):
+    """CASE id WHEN … THEN кількість — значення для кожного рядка в одному UPDATE"""
+    if not quantities:
+        return Value(0)
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def stock_models(lines):
+    """(модель, {id: кількість}) для варіантів і товарів без варіантів"""
+    return [
+        (ProductVariant, quantities_by_row(lines, by_variant=True)),
+        (Product, quantities_by_row(lines, by_variant=False)),
+    ]
+
+
+def shortage_labels(lines):
+    """Назви позицій, яким бракує доступного залишку"""
+    labels = []
+    variant_quantities, product_quantities = (quantities for _, quantities in stock_models(lines))
+    for variant in (
+        ProductVariant.objects.filter(pk__in=variant_quantities)
+        .select_related('product', 'flavor').order_by('pk')
+    ):
+        if variant.available_quantity < variant_quantities[variant.pk]:
+            parts = [part for part in (variant.weight_label, variant.flavor.name if variant.flavor else '') if part]
+            labels.append(f"{variant.product.name} ({', '.join(parts)})" if parts else variant.product.name)
+    for product in Product.objects.filter(pk__in=product_quantities).order_by('pk'):
+        if product.available_quantity < product_quantities[product.pk]:
+            labels.append(product.name)
+    return labels
+
+
+def schedule_availability_refresh(product_ids):
+    """Доступний залишок змінився: після коміту оновлюємо зведення товарів і кеш сторінок"""
+    product_ids = set(product_ids)
+    if product_ids:
+        schedule_listing_summary_refresh(product_ids)
+        transaction.on_commit(invalidate_page_cache)
+
+
+def _reserve(lines, pending, expires_at):
+    with transaction.atomic():
+        for model, quantities in stock_models(lines):
+            if not quantities:
+                continue
+            requested = per_row(quantities)
+            updated = model.objects.filter(
+                pk__in=quantities, stock_quantity__gte=F('reserved_quantity') + requested,
+            ).update(reserved_quantity=F('reserved_quantity') + requested)
+            if updated != len(quantities):
+                raise InsufficientStock()
+        StockHold.objects.bulk_create([
+            StockHold(
+                pending=pending,
+                product_id=line.product_id,
+                variant_id=line.variant_id,
+                quantity=line.quantity,
+                expires_at=expires_at,
+            )
+            for line in lines
+        ])
+
+
+def hold_stock(pending, lines):
+    """Утримує залишок позицій lines (OrderLine) для pending; InsufficientStock, якщо бракує"""
+    lines = [line for line in lines if line.quantity > 0]
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    try:
+        _reserve(lines, pending, expires_at)
+    except InsufficientStock:
+        # Залишок можуть займати прострочені, ще не зняті утримання
+        if not expire_holds():
+            raise InsufficientStock(shortage_labels(lines))
+        try:
+            _reserve(lines, pending, expires_at)
+        except InsufficientStock:
+            raise InsufficientStock(shortage_labels(lines))
+    schedule_availability_refresh(line.product_id for line in lines)
+
+
+def take_holds(pending):
+    """
+    Знімає утримання pending перед списанням залишку при оплаті.
+    Повертає {id варіанту: кількість}, {id товару: кількість} — на скільки
+    зменшити reserved_quantity. Викликається всередині транзакції place_order.
+    """
+    rows = list(
+        StockHold.objects.select_for_update().filter(pending=pending)
+        .values_list('pk', 'product_id', 'variant_id', 'quantity')
+    )
+    if rows:
+        StockHold.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    return _group(rows)
+
+
+def _group(rows):
+    variants, products = {}, {}
+    for _, product_id, variant_id, quantity in rows:
+        target, pk = (variants, variant_id) if variant_id else (products, product_id)
+        target[pk] = target.get(pk, 0) + quantity
+    return variants, products
+
+
+def _release(holds):
+    """Знімає утримання з вибірки holds; рядки, які вже обробляє інша транзакція, пропускаються"""
+    with transaction.atomic():
+        rows = list(
+            holds.select_for_update(skip_locked=True)
+            .values_list('pk', 'product_id', 'variant_id', 'quantity')
+        )
+        if not rows:
+            return 0
+        for model, released in zip((ProductVariant, Product), _group(rows)):
+            if released:
+                model.objects.filter(pk__in=released).update(
+                    reserved_quantity=Greatest(F('reserved_quantity') - per_row(released), Value(0)),
+                )
+        StockHold.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        schedule_availability_refresh(row[1] for row in rows)
+    return len(rows)
+
+
+def release_pending_holds(pending):
+    return _release(StockHold.objects.filter(pending=pending))
+
+
+def expire_holds(now=None, batch_size=500):
+    """Знімає прострочені утримання пакетами; повертає їх кількість"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        ids = list(StockHold.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return released
+        count = _release(StockHold.objects.filter(pk__in=ids))
+        if not count:
+            # Усі рядки пакета зараз обробляє інша транзакція
+            return released
+        released += count
+
+
+def delete_stale_pending(older_than):
+    """Видаляє PendingCheckout, створені раніше older_than, знявши їхні утримання"""
+    stale = PendingCheckout.objects.filter(created_at__lt=older_than)
+    _release(StockHold.objects.filter(pending__in=stale))
+    _, deleted = stale.delete()
+    return deleted.get(PendingCheckout._meta.label, 0)
@@ -0,0 +1,161 @@
+"""
+Автодоповнення пошуку каталогу.
+
+Індекс будується в пам'яті процесу з назв товарів, категорій і смаків:
+префіксний пошук по словах (bisect по відсортованому списку) плюс триграми
+для запитів з одруківками. Після змін у моделях сигнали змінюють версію
+'search_suggest', і індекс перебудовується при наступному запиті.
+"""
+import bisect
+import re
+import threading
+from collections import Counter, namedtuple
+
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .caching import bump_version, get_version
+from .models import Category, Flavor, Product
+
+SUGGEST_VERSION = 'search_suggest'
+SUGGEST_LIMIT = 8
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+Suggestion = namedtuple('Suggestion', 'type label url')
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Однаковий вибір рівних за оцінкою підказок: спершу товари, потім категорії, смаки
+_TYPE_ORDER = {'product': 0, 'category': 1, 'flavor': 2}
+
+
+def _normalize(text):
+    return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+
+def _trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SuggestionIndex:
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        self.labels = [_normalize(item.label) for item in suggestions]
+        self.words = sorted(
+            (word, position)
+            for position, label in enumerate(self.labels)
+            for word in set(label.split())
+        )
+        self.word_keys = [word for word, _ in self.words]
+        # Триграми рахуються по окремих словах, щоб одруківка в одному слові
+        # не губилась на тлі довгої назви
+        self.word_positions = {}
+        for word, position in self.words:
+            self.word_positions.setdefault(word, []).append(position)
+        self.word_trigrams = {word: _trigrams(word) for word in self.word_positions}
+        self.postings = {}
+        for word, grams in self.word_trigrams.items():
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(word)
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self.word_keys, prefix)
+        matches = set()
+        for word, position in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            matches.add(position)
+        return matches
+
+    def search(self, query, limit=SUGGEST_LIMIT):
+        query = _normalize(query)
+        if not query:
+            return []
+
+        terms = query.split()
+        scores = {}
+
+        # Префіксні збіги: усі слова запиту мають бути початками слів назви
+        prefix_hits = None
+        for term in terms:
+            hits = self._prefix_matches(term)
+            prefix_hits = hits if prefix_hits is None else prefix_hits & hits
+        for position in prefix_hits or ():
+            scores[position] = 3.0 if self.labels[position].startswith(query) else 2.0
+
+        # Триграми: знаходять назви навіть з одруківками. Оцінка назви — середня
+        # схожість найближчого слова для кожного слова запиту
+        fuzzy = Counter()
+        for term in terms:
+            term_grams = _trigrams(term)
+            shared = Counter()
+            for gram in term_grams:
+                for word in self.postings.get(gram, ()):
+                    shared[word] += 1
+            best = {}
+            for word, common in shared.items():
+                similarity = common / (len(term_grams) + len(self.word_trigrams[word]) - common)
+                if similarity < MIN_TRIGRAM_SIMILARITY:
+                    continue
+                for position in self.word_positions[word]:
+                    best[position] = max(best.get(position, 0), similarity)
+            for position, similarity in best.items():
+                fuzzy[position] += similarity
+        for position, total in fuzzy.items():
+            scores[position] = max(scores.get(position, 0), total / len(terms))
+
+        ranked = sorted(
+            scores,
+            key=lambda position: (
+                -scores[position],
+                _TYPE_ORDER[self.suggestions[position].type],
+                len(self.labels[position]),
+                self.labels[position],
+            ),
+        )
+        return [self.suggestions[position] for position in ranked[:limit]]
+
+
+def _build_index():
+    catalog_url = reverse('shop:catalog')
+    suggestions = [
+        Suggestion('product', name, reverse('shop:product_detail', args=[product_id]))
+        for product_id, name in Product.objects.values_list('id', 'name')
+    ]
+    suggestions += [
+        Suggestion('category', name, f"{catalog_url}?{urlencode({'category': category_id})}")
+        for category_id, name in Category.objects.values_list('id', 'name')
+    ]
+    suggestions += [
+        Suggestion('flavor', name, f"{catalog_url}?{urlencode({'q': name})}")
+        for name in Flavor.objects.values_list('name', flat=True)
+    ]
+    return SuggestionIndex(suggestions)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _index_version
+    version = get_version(SUGGEST_VERSION)
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = _build_index()
+                _index_version = version
+    return _index
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    return get_index().search(query, limit=limit)
+
+
+def invalidate_suggestions():
+    bump_version(SUGGEST_VERSION)
@@ -1,5 +1,5 @@
 from django import template
-from shop.models import Category
+from shop.category_tree import get_category_tree
 
 register = template.Library()
 
@@ -7,4 +7,4 @@ register = template.Library()
 @register.simple_tag
 def get_categories_with_subcategories():
     """Отримує всі батьківські категорії з їх підкатегоріями"""
-    return Category.objects.filter(parent__isnull=True).prefetch_related('subcategories')
+    return get_category_tree().roots
@@ -0,0 +1,701 @@
+import re
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import OperationalError, connection
+from django.shortcuts import render
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Cart, Category, Customer, Flavor, Order, OrderItem, PaymentCallback, PaymentEvent, PendingCheckout, Product,
+    ProductImage, ProductListingSummary, ProductVariant, Review, ReviewReply, SiteVisit, StatsRollup, StockHold,
+)
+from . import liqpay
+from .caching import get_versions
+from .cart_store import CartKey, CartStore, purge_guest_carts
+from .category_tree import get_category_tree
+from .order_placement import InsufficientStock, OrderLine, place_order
+from .payment_inbox import drain, inbox_worker, requeue, start_worker_on_first_request
+from .payments import create_order_from_pending
+from .pagination import paginate_keyset
+from .product_page import load_product_page
+from .profiling import QueryBudgetExceeded, check_query_budget, profile_queries, sample_buffer
+from .search import index_products
+from .statistics import day_start, rebuild_statistics
+from .stock_holds import delete_stale_pending, expire_holds, hold_stock
+from .visit_tracking import VisitBuffer
+
+
+class ProductPageQueryTests(TestCase):
+    # товар, варіанти, фото, відгуки, відповіді, схожі товари та їх варіанти
+    PRODUCT_PAGE_QUERIES = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Протеїни')
+        cls.admin = User.objects.create_user('manager', password='secret')
+        cls.customers = [
+            Customer.objects.create(username=f'customer{index}', email=f'customer{index}@example.com', password='x')
+            for index in range(3)
+        ]
+        cls.product = cls._create_product('Whey', variants=3, images=2, reviews=3)
+        cls.small_product = cls._create_product('Casein', variants=1, images=1, reviews=1)
+        for index in range(5):
+            cls._create_product(f'Related {index}', variants=2, images=1, reviews=1)
+
+    @classmethod
+    def _create_product(cls, name, variants, images, reviews):
+        product = Product.objects.create(name=name, category=cls.category, description='Опис')
+        for index in range(variants):
+            flavor, _ = Flavor.objects.get_or_create(name=f'Смак {index}')
+            ProductVariant.objects.create(
+                product=product, flavor=flavor, weight_label='1кг',
+                price=Decimal('500') + index * 100, stock_quantity=index,
+            )
+        for index in range(images):
+            ProductImage.objects.create(product=product, image=f'products/{name}-{index}.jpg', order=index)
+        for index in range(reviews):
+            review = Review.objects.create(
+                product=product, customer=cls.customers[index % len(cls.customers)],
+                rating=index % 5 + 1, title='Відгук', text='Текст',
+            )
+            ReviewReply.objects.create(review=review, admin=cls.admin, text='Дякуємо')
+        return product
+
+    def _touch_page(self, page):
+        """Звертається до всього, що читає шаблон сторінки товару"""
+        product = page['product']
+        product.get_min_price()
+        product.get_min_old_price()
+        product.get_available_stock()
+        product.get_all_images()
+        str(product.category)
+        for variant in page['variants']:
+            variant.flavor and variant.flavor.name
+        for review in page['reviews']:
+            review.customer.username
+            review.product.id
+            for reply in review.replies.all():
+                reply.admin and reply.admin.username
+        for related in page['related_products']:
+            related.main_image_url
+            related.get_min_price()
+            related.get_min_old_price()
+            related.get_available_stock()
+
+    def test_query_count_is_fixed(self):
+        for product in (self.product, self.small_product):
+            with self.subTest(product=product.name):
+                with self.assertNumQueries(self.PRODUCT_PAGE_QUERIES):
+                    self._touch_page(load_product_page(product.id))
+
+    def test_aggregates_come_from_loaded_data(self):
+        page = load_product_page(self.product.id)
+        self.assertEqual(page['review_count'], 3)
+        self.assertEqual(page['aggregate_avg_rating'], 2)
+        self.assertEqual(page['min_price'], Decimal('500'))
+        self.assertEqual(page['available_stock'], 0 + 1 + 2)
+        self.assertEqual(len(page['related_products']), 4)
+        self.assertNotIn(self.product.id, [related.id for related in page['related_products']])
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_product_detail_view(self):
+        response = self.client.get(reverse('shop:product_detail', args=[self.product.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['review_count'], 3)
+        self.assertContains(response, 'Дякуємо', count=3)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Протеїни')
+        cls.products = [Product.objects.create(name=f'Whey {index}', category=category) for index in range(4)]
+        ProductListingSummary.objects.filter(product__in=cls.products).delete()
+        for index, product in enumerate(cls.products[:2]):
+            ProductListingSummary.objects.create(product=product, min_price=Decimal('100') * (index + 1), avg_rating=4)
+
+    def test_products_without_summary_are_paged_once(self):
+        for sort in ('price_asc', 'price_desc', 'rating_desc'):
+            with self.subTest(sort=sort):
+                seen, cursor = [], None
+                for _ in range(len(self.products) + 1):
+                    items, cursor = paginate_keyset(Product.objects.for_listing(), sort, cursor, page_size=1)
+                    seen += [product.id for product in items]
+                    if cursor is None:
+                        break
+                self.assertCountEqual(seen, [product.id for product in self.products])
+
+
+class CategoryTreeTests(TestCase):
+    def test_tree_is_built_from_immutable_nodes(self):
+        sport = Category.objects.create(name='Спортивне харчування')
+        protein = Category.objects.create(name='Протеїни', parent=sport)
+        whey = Category.objects.create(name='Сироваткові', parent=protein)
+        vitamins = Category.objects.create(name='Вітаміни')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=vitamins.pk).first().save()
+
+        get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+        self.assertEqual([node.name for node in tree.roots], ['Спортивне харчування', 'Вітаміни'])
+        self.assertEqual(tree.subtree_ids(sport.id), {sport.id, protein.id, whey.id})
+        self.assertEqual(tree.get(protein.id).children, (tree.get(whey.id),))
+        self.assertFalse(tree.is_parent(vitamins.id))
+
+        node = tree.get(sport.id)
+        self.assertNotIsInstance(node, Category)
+        with self.assertRaises(AttributeError):
+            node.name = 'Інше'
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class CatalogSearchTests(TestCase):
+    def test_truncated_search_results_are_announced(self):
+        category = Category.objects.create(name='Протеїни')
+        products = [Product.objects.create(name=f'Whey {index}', category=category) for index in range(3)]
+        index_products([product.id for product in products])
+        cache.clear()
+
+        for limit, truncated in ((2, True), (10, False)):
+            with self.subTest(limit=limit), mock.patch('shop.views.SEARCH_RESULT_LIMIT', limit):
+                response = self.client.get(reverse('shop:catalog'), {'q': 'whey', 'sort': 'newest'})
+                self.assertEqual(len(response.context['products']), min(limit, 3))
+                self.assertEqual('Показано перші' in response.content.decode(), truncated)
+            cache.clear()
+
+
+class ProductCardCacheTests(TestCase):
+    def test_flavor_change_invalidates_cards(self):
+        category = Category.objects.create(name='Протеїни')
+        product = Product.objects.create(name='Whey', category=category)
+        flavor = Flavor.objects.create(name='Ваніль', hex_color='#ffffff')
+        ProductVariant.objects.create(product=product, flavor=flavor, price=Decimal('500'), stock_quantity=1)
+        version_name = f'product:{product.id}'
+
+        for change in (lambda: Flavor.objects.filter(pk=flavor.pk).first().save(), flavor.delete):
+            before = get_versions([version_name])[version_name]
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertNotEqual(get_versions([version_name])[version_name], before)
+
+
+class ProductSignalTests(TestCase):
+    def test_product_with_variants_is_refreshed_once_per_commit(self):
+        category = Category.objects.create(name='Протеїни')
+        with (
+            mock.patch('shop.listing_summary.refresh_listing_summaries') as refresh,
+            mock.patch('shop.search.index_products') as reindex,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            product = Product.objects.create(name='Whey', category=category)
+            for weight in ('1кг', '2кг', '3кг'):
+                ProductVariant.objects.create(product=product, weight_label=weight, price=Decimal('500'))
+        # Товари з відкочених транзакцій попередніх тестів можуть дочекатися цього коміту
+        refresh.assert_called_once()
+        self.assertIn(product.id, refresh.call_args.args[0])
+        reindex.assert_called_once()
+        self.assertIn(product.id, reindex.call_args.args[0])
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Whey', category=Category.objects.create(name='Протеїни'))
+        cls.variant = ProductVariant.objects.create(
+            product=cls.product, weight_label='1кг', price=Decimal('500'), stock_quantity=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_page_is_personalised_per_request(self):
+        guest = Client(enforce_csrf_checks=True)
+        buyer = Client(enforce_csrf_checks=True)
+        buyer.get(reverse('shop:add_to_cart', args=[self.product.id]), {'variant_id': self.variant.id, 'quantity': 2})
+
+        with mock.patch('shop.views.render', side_effect=render) as rendered:
+            pages = {client: client.get(reverse('shop:home')).content.decode() for client in (guest, buyer)}
+        # Друга відповідь віддана з кешу, а не відрендерена заново
+        rendered.assert_called_once()
+
+        tokens = {}
+        for client, count in ((guest, '0'), (buyer, '2')):
+            self.assertNotIn('shop-page-cache-', pages[client])
+            self.assertRegex(pages[client], rf'data-cart-count[^>]*>{count}<')
+            tokens[client] = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', pages[client]).group(1)
+
+        # Кожен отримав CSRF-токен власної cookie: чужий не приймається
+        attempts = ((guest, tokens[buyer], 403), (guest, tokens[guest], 302), (buyer, tokens[buyer], 302))
+        for client, token, status in attempts:
+            response = client.post(reverse('shop:newsletter_subscribe'), {
+                'email': 'fan@example.com', 'csrfmiddlewaretoken': token,
+            })
+            self.assertEqual(response.status_code, status)
+
+    def test_catalog_ajax_revalidates_until_a_product_changes(self):
+        url = reverse('shop:catalog')
+        params = {'sort': 'price_asc'}
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        etag = self.client.get(url, params, headers=headers)['ETag']
+
+        response = self.client.get(url, params, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Whey Gold'
+            self.product.save()
+        response = self.client.get(url, params, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Whey Gold', response.json()['products_html'])
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}, SITE_VISIT_WRITER='sync')
+class SiteVisitTrackingTests(TestCase):
+    def test_anonymous_browsing_counts_one_visit(self):
+        for name in ('shop:home', 'shop:catalog', 'shop:delivery'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+        self.assertIn('shop_visitor', self.client.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(SiteVisit.objects.count(), 1)
+        self.assertEqual(StatsRollup.objects.get(granularity='day').visits, 1)
+
+    def test_buffered_visit_keeps_request_date_and_coalesces_refreshes(self):
+        buffer = VisitBuffer(flush_interval=10, max_pending=500, stats_interval=60)
+        yesterday = timezone.now() - timedelta(days=1)
+        with override_settings(SITE_VISIT_WRITER='thread'), mock.patch.object(buffer, '_ensure_thread'):
+            with mock.patch('shop.visit_tracking.timezone.now', return_value=yesterday):
+                buffer.record('evening')
+            buffer.flush(force_refresh=False)
+            buffer.record('morning')
+            with mock.patch('shop.visit_tracking.refresh_range') as refresh:
+                buffer.flush(force_refresh=False)
+                refresh.assert_not_called()
+                buffer.flush()
+                refresh.assert_called_once()
+
+        visit = SiteVisit.objects.get(session_key='evening')
+        self.assertEqual(visit.visit_date, timezone.localtime(yesterday).date())
+        self.assertEqual(
+            StatsRollup.objects.get(granularity='day', bucket=day_start(visit.visit_date)).visits, 1,
+        )
+
+
+class StatisticsRebuildTests(TestCase):
+    def test_rebuild_replaces_chunks_without_emptying_rollups(self):
+        order = Order.objects.create(total=Decimal('500'), payment_method='cod', payment_status='cod')
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=40))
+        stale = StatsRollup.objects.create(
+            granularity='day', bucket=day_start(timezone.localdate() - timedelta(days=100)), orders_count=7,
+        )
+        self.assertEqual(rebuild_statistics(chunk_days=31), 2)
+        self.assertFalse(StatsRollup.objects.filter(pk=stale.pk).exists())
+        rollups = set(StatsRollup.objects.values_list('granularity', 'bucket', 'orders_count'))
+        self.assertEqual({granularity for granularity, _, _ in rollups}, {'hour', 'day'})
+
+        with mock.patch('shop.statistics.refresh_range', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                rebuild_statistics(chunk_days=31)
+        self.assertEqual(set(StatsRollup.objects.values_list('granularity', 'bucket', 'orders_count')), rollups)
+
+
+class CartViewTests(TestCase):
+    def test_invalid_variant_id_leaves_cart_unchanged(self):
+        product = Product.objects.create(name='Whey', category=Category.objects.create(name='Протеїни'))
+        for name in ('shop:increase_quantity', 'shop:decrease_quantity', 'shop:remove_from_cart'):
+            with self.subTest(view=name):
+                url = reverse(name, args=[product.id])
+                self.assertRedirects(
+                    self.client.get(url, {'variant_id': 'abc'}), reverse('shop:cart'), fetch_redirect_response=False,
+                )
+                response = self.client.post(url, {'variant_id': 'abc'}, headers={'X-Requested-With': 'XMLHttpRequest'})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_deleted_variant_leaves_nothing_to_check_out(self):
+        product = Product.objects.create(name='Whey', category=Category.objects.create(name='Протеїни'))
+        variant = ProductVariant.objects.create(
+            product=product, weight_label='1кг', price=Decimal('500'), stock_quantity=5,
+        )
+        self.client.post(reverse('shop:add_to_cart', args=[product.id]), {'variant_id': variant.id, 'quantity': 2})
+        self.assertEqual(Cart.objects.get().item_count, 2)
+
+        variant.delete()
+        self.assertEqual(Cart.objects.get().item_count, 0)
+        response = self.client.post(reverse('shop:checkout'), {
+            'first_name': 'Іван', 'last_name': 'Петренко', 'phone': '+380501234567',
+            'delivery_method': 'np_branch', 'payment_method': 'cod',
+        })
+        self.assertRedirects(response, reverse('shop:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    def test_purge_removes_only_stale_guest_carts(self):
+        customer = Customer.objects.create(username='buyer', email='buyer@example.com', password='x')
+        stale = timezone.now() - timedelta(days=40)
+        old_guest = Cart.objects.create(updated_at=stale)
+        fresh_guest = Cart.objects.create()
+        old_customer_cart = Cart.objects.create(customer=customer, updated_at=stale)
+        self.assertEqual(purge_guest_carts(timezone.now() - timedelta(days=30)), 1)
+        self.assertEqual(
+            set(Cart.objects.values_list('pk', flat=True)), {fresh_guest.pk, old_customer_cart.pk},
+        )
+        self.assertFalse(Cart.objects.filter(pk=old_guest.pk).exists())
+
+
+class CartTotalsTests(TestCase):
+    def test_cached_totals_are_rebuilt_after_price_change(self):
+        product = Product.objects.create(name='Whey', category=Category.objects.create(name='Протеїни'))
+        variant = ProductVariant.objects.create(
+            product=product, weight_label='1кг', price=Decimal('500'), stock_quantity=5,
+        )
+        self.client.post(reverse('shop:add_to_cart', args=[product.id]), {'variant_id': variant.id, 'quantity': 2})
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        self.assertEqual(CartStore(request).totals()[1], Decimal('1000'))
+
+        # Без сигналу (update) кеш сум ще не знає про нову ціну
+        ProductVariant.objects.filter(pk=variant.pk).update(price=Decimal('600'))
+        self.assertEqual(CartStore(request).totals()[1], Decimal('1000'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.price = Decimal('600')
+            variant.save()
+        lines, total = CartStore(request).totals()
+        self.assertEqual(total, Decimal('1200'))
+        self.assertEqual(lines, {CartKey(product.id, variant.id): (Decimal('600'), 2)})
+
+
+class OrderPlacementTests(TestCase):
+    # savepoint, списання варіантів, списання товарів, замовлення, позиції, release
+    PLACE_ORDER_QUERIES = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Протеїни')
+        cls.variants = []
+        for index in range(5):
+            product = Product.objects.create(name=f'Whey {index}', category=category)
+            flavor, _ = Flavor.objects.get_or_create(name=f'Смак {index}')
+            cls.variants.append(ProductVariant.objects.create(
+                product=product, flavor=flavor, weight_label='1кг', price=Decimal('500'), stock_quantity=10,
+            ))
+        cls.shaker = Product.objects.create(name='Шейкер', category=category, stock_quantity=3)
+
+    def _order(self, **fields):
+        return Order(total=Decimal('1000'), payment_method='cod', payment_status='cod', **fields)
+
+    def _variant_line(self, variant, quantity):
+        return OrderLine(variant.product_id, variant.id, quantity, variant.price)
+
+    def test_query_count_does_not_depend_on_lines(self):
+        for count in (1, 5):
+            with self.subTest(lines=count):
+                lines = [self._variant_line(variant, 1) for variant in self.variants[:count]]
+                lines.append(OrderLine(self.shaker.id, None, 1, Decimal('150')))
+                with self.assertNumQueries(self.PLACE_ORDER_QUERIES):
+                    order = place_order(self._order(), lines)
+                self.assertEqual(order.items.count(), count + 1)
+
+    def test_decrements_variants_and_products_without_variants(self):
+        place_order(self._order(), [
+            self._variant_line(self.variants[0], 4),
+            OrderLine(self.shaker.id, None, 2, Decimal('150')),
+        ])
+        self.variants[0].refresh_from_db()
+        self.shaker.refresh_from_db()
+        self.assertEqual(self.variants[0].stock_quantity, 6)
+        self.assertEqual(self.shaker.stock_quantity, 1)
+
+    def test_order_without_lines_is_not_saved(self):
+        with self.assertRaises(ValueError):
+            place_order(self._order(), [self._variant_line(self.variants[0], 0)])
+        self.assertFalse(Order.objects.exists())
+
+    def test_shortage_rolls_back_everything(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(self._order(), [
+                self._variant_line(self.variants[0], 2),
+                self._variant_line(self.variants[1], 11),
+            ])
+        self.assertEqual(raised.exception.labels, ['Whey 1 (1кг, Смак 1)'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(
+            list(ProductVariant.objects.filter(pk__in=[self.variants[0].pk, self.variants[1].pk])
+                 .values_list('stock_quantity', flat=True)),
+            [10, 10],
+        )
+
+    def test_reserved_stock_is_not_sold_twice(self):
+        variant = self.variants[2]
+        hold_stock(PendingCheckout.objects.create(form_data={}, cart_snapshot={}, grand_total=Decimal('4000')), [
+            self._variant_line(variant, 8),
+        ])
+        for attempt in (
+            lambda: place_order(self._order(), [self._variant_line(variant, 3)]),
+            lambda: hold_stock(PendingCheckout.objects.create(form_data={}, cart_snapshot={}, grand_total=0), [
+                self._variant_line(variant, 3),
+            ]),
+        ):
+            with self.assertRaises(InsufficientStock):
+                attempt()
+
+        place_order(self._order(), [self._variant_line(variant, 2)])
+        variant.refresh_from_db()
+        self.assertEqual((variant.stock_quantity, variant.reserved_quantity), (8, 8))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_and_stale_holds_release_only_their_quantity(self):
+        variant = self.variants[3]
+        expired, live, stale = (
+            PendingCheckout.objects.create(form_data={}, cart_snapshot={}, grand_total=Decimal('0')) for _ in range(3)
+        )
+        for pending, quantity in ((expired, 2), (live, 3), (stale, 4)):
+            hold_stock(pending, [self._variant_line(variant, quantity)])
+        StockHold.objects.filter(pending=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+        PendingCheckout.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(expire_holds(), 1)
+        variant.refresh_from_db()
+        self.assertEqual(variant.reserved_quantity, 7)
+
+        self.assertEqual(delete_stale_pending(timezone.now() - timedelta(days=1)), 1)
+        variant.refresh_from_db()
+        self.assertEqual((variant.stock_quantity, variant.reserved_quantity), (10, 3))
+        self.assertEqual(list(StockHold.objects.values_list('pending_id', 'quantity')), [(live.pk, 3)])
+
+    def test_paid_pending_checkout_is_fulfilled_despite_shortage(self):
+        pending = PendingCheckout.objects.create(
+            form_data={'first_name': 'Іван', 'delivery_method': 'np_branch'},
+            cart_snapshot={f'{self.variants[0].product_id}_{self.variants[0].id}': 12, str(self.shaker.id): 1},
+            grand_total=Decimal('6150'),
+        )
+        with self.assertLogs('shop.order_placement', level='WARNING'):
+            order = create_order_from_pending(pending)
+        self.assertEqual(order.payment_status, 'paid')
+        self.assertEqual(
+            sorted(order.items.values_list('quantity', flat=True)),
+            [1, 12],
+        )
+        self.variants[0].refresh_from_db()
+        self.assertEqual(self.variants[0].stock_quantity, 0)
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}, PAYMENT_INBOX_WORKER='command')
+class PaymentLedgerTests(TransactionTestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Протеїни')
+        product = Product.objects.create(name='Whey', category=category)
+        flavor = Flavor.objects.create(name='Ваніль')
+        self.variant = ProductVariant.objects.create(
+            product=product, flavor=flavor, weight_label='1кг', price=Decimal('500'), stock_quantity=5,
+        )
+        self.pending = PendingCheckout.objects.create(
+            form_data={'first_name': 'Іван', 'delivery_method': 'np_branch'},
+            cart_snapshot={f'{product.id}_{self.variant.id}': 2},
+            grand_total=Decimal('1070'),
+            shipping_cost=Decimal('70'),
+        )
+        hold_stock(self.pending, [OrderLine(product.id, self.variant.id, 2, self.variant.price)])
+
+    def _signed(self, status):
+        data, signature = liqpay.sign_params(
+            settings.LIQPAY_PRIVATE_KEY, {'order_id': str(self.pending.token), 'status': status},
+        )
+        return {'data': data, 'signature': signature}
+
+    def test_concurrent_callback_and_result_create_one_order(self):
+        urls = [
+            reverse('shop:liqpay_callback'),
+            reverse('shop:liqpay_result', args=[self.pending.token]),
+        ] * 2
+        barrier = threading.Barrier(len(urls))
+        statuses, errors = [], []
+
+        def deliver(url):
+            try:
+                barrier.wait()
+                statuses.append(Client().post(url, self._signed('success')).status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=deliver, args=(url,)) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses, [200] * len(urls))
+        # Callback лише ставляться в чергу; їх обробка не має створити друге замовлення
+        self.assertEqual(drain(), (2, 0))
+        self.assertEqual(Order.objects.filter(liqpay_token=str(self.pending.token)).count(), 1)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertFalse(PendingCheckout.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock_quantity, self.variant.reserved_quantity), (3, 0))
+
+    def test_failed_payment_releases_hold_once(self):
+        for _ in range(2):
+            response = self.client.post(reverse('shop:liqpay_callback'), self._signed('failure'))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(drain(), (2, 0))
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertFalse(StockHold.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock_quantity, self.variant.reserved_quantity), (5, 0))
+
+    def test_callback_is_acknowledged_before_processing(self):
+        response = self.client.post(reverse('shop:liqpay_callback'), self._signed('success'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(PaymentCallback.objects.filter(processed_at__isnull=True).count(), 1)
+
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(Order.objects.filter(liqpay_token=str(self.pending.token)).count(), 1)
+        self.assertFalse(PaymentCallback.objects.filter(processed_at__isnull=True).exists())
+
+    def test_failed_processing_is_retried_with_backoff(self):
+        self.client.post(reverse('shop:liqpay_callback'), self._signed('success'))
+        with mock.patch('shop.payment_inbox.process_payment', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('shop.payment_inbox', level='ERROR'):
+                self.assertEqual(drain(), (0, 1))
+        callback = PaymentCallback.objects.get()
+        self.assertEqual(callback.attempts, 1)
+        self.assertIn('database is locked', callback.last_error)
+        self.assertGreater(callback.next_attempt_at, timezone.now())
+        # До закінчення затримки запис не береться
+        self.assertEqual(drain(), (0, 0))
+
+        PaymentCallback.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(PAYMENT_INBOX_MAX_ATTEMPTS=2)
+    def test_callback_fails_permanently_after_max_attempts(self):
+        self.client.post(reverse('shop:liqpay_callback'), self._signed('success'))
+        with mock.patch('shop.payment_inbox.process_payment', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('shop.payment_inbox', level='ERROR'):
+                self.assertEqual(drain(), (0, 1))
+                PaymentCallback.objects.update(next_attempt_at=timezone.now())
+                self.assertEqual(drain(), (0, 1))
+        callback = PaymentCallback.objects.get()
+        self.assertEqual(callback.attempts, 2)
+        self.assertIsNotNone(callback.failed_at)
+        PaymentCallback.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(drain(), (0, 0))
+
+        self.assertEqual(requeue(PaymentCallback.objects.all()), 1)
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_undecodable_callback_is_not_retried(self):
+        PaymentCallback.objects.create(data='not base64 json', signature='x')
+        with self.assertLogs('shop.payment_inbox', level='ERROR'):
+            self.assertEqual(drain(), (0, 1))
+        callback = PaymentCallback.objects.get()
+        self.assertEqual(callback.attempts, 1)
+        self.assertIsNotNone(callback.failed_at)
+
+    def test_thread_worker_starts_with_first_request(self):
+        request_started.connect(start_worker_on_first_request)
+        self.addCleanup(request_started.disconnect, start_worker_on_first_request)
+        with mock.patch.object(inbox_worker, 'wake') as wake:
+            for _ in range(2):
+                self.client.get(reverse('shop:delivery'))
+        wake.assert_called_once_with()
+
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    MIDDLEWARE=['shop.profiling.QueryProfilingMiddleware', *settings.MIDDLEWARE],
+    TEMPLATES=[{**settings.TEMPLATES[0], 'BACKEND': 'shop.profiling.ProfilingTemplates'}],
+)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Протеїни')
+        for index in range(8):
+            product = Product.objects.create(name=f'Whey {index}', category=category)
+            for flavor_index in range(3):
+                flavor, _ = Flavor.objects.get_or_create(name=f'Смак {flavor_index}')
+                ProductVariant.objects.create(
+                    product=product, flavor=flavor, weight_label='1кг',
+                    price=Decimal('500') + flavor_index * 100, stock_quantity=5,
+                )
+        cls.product = product
+        cls.variant = product.variants.first()
+
+    def setUp(self):
+        # Перше відвідування за день записується (SITE_VISIT_WRITER='sync' у тестах) — воно не входить у бюджети
+        self.client.get(reverse('shop:delivery'))
+        # Бюджети розраховані на сторінки без кешу
+        cache.clear()
+        sample_buffer.clear()
+
+    def _request(self, method, url, data=None):
+        with profile_queries() as profile:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLess(response.status_code, 400)
+        check_query_budget(response.resolver_match.view_name, profile)
+        return response
+
+    def test_pages_stay_within_query_budget(self):
+        self._request('get', reverse('shop:home'))
+        self._request('get', reverse('shop:catalog'))
+        self._request('get', reverse('shop:product_detail', args=[self.product.id]))
+        self._request('post', reverse('shop:add_to_cart', args=[self.product.id]), {
+            'variant_id': self.variant.id, 'quantity': 1,
+        })
+        self._request('get', reverse('shop:cart'))
+        self._request('get', reverse('shop:checkout'))
+
+    def test_repeated_queries_exceed_budget(self):
+        with profile_queries() as profile:
+            for product in Product.objects.all():
+                list(product.variants.all())
+        self.assertEqual(profile.duplicates, 7)
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'shop:catalog: 9 запитів при бюджеті 4'):
+            check_query_budget('shop:catalog', profile)
+
+    def test_middleware_reports_timings(self):
+        response = self.client.get(reverse('shop:catalog'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicates", render;dur=')
+        self.assertEqual([sample.view_name for sample in sample_buffer.samples()], ['shop:catalog'])
+
+        admin_user = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:shop_admin_performance'))
+        self.assertContains(response, 'shop:catalog')
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('delivery/', views.delivery, name='delivery'),
     path('catalog/', views.catalog, name='catalog'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
     path('add_to_cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart, name='cart'),
@@ -1,19 +1,33 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import FileResponse, JsonResponse, HttpResponse
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.db import transaction
-from django.db.models import F, Avg, Sum, Min, Value, FloatField
-from django.db.models.functions import Coalesce
+from django.db.models import Avg, Case, F, When, Value, IntegerField
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 
 
-from .models import Product, OrderItem, Category, Order, Customer, Review, ProductVariant, PendingCheckout
+from .models import Product, Category, Order, Customer, Review, ProductVariant, PendingCheckout
 from .forms import CheckoutForm, RegistrationForm, LoginForm, ProfileForm, ReviewForm
 from . import liqpay as liqpay_helper
+from .cart_store import CartKey, get_cart, merge_guest_cart
+from .pagination import paginate_keyset
+from .product_cards import render_product_cards
+from .page_cache import cache_anonymous_page, catalog_etag
+from .product_page import load_product_page
+from .bestsellers import get_bestseller_ids
+from .order_placement import InsufficientStock, lines_from_cart, place_order
+from .payment_inbox import enqueue
+from .payments import paid_order, process_payment
+from .stock_holds import hold_stock
+from .category_tree import get_category_tree
+from .search import SEARCH_RESULT_LIMIT, search_product_ids
+from .suggest import SUGGEST_LIMIT, suggest
 
 
 def _is_ajax_request(request):
@@ -26,41 +40,41 @@ def _get_delivery_cost(subtotal, delivery_method):
     return 0 if subtotal >= 1500 else 70
 
 
+def _attach_listing_data(products):
+    """Готує дані карток товарів (рейтинг, смаки) з результатів Product.objects.for_listing()"""
+    import json
+    for p in products:
+        p.aggregate_avg_rating = int(round(p.avg_rating)) if p.avg_rating else 0
+        p.flavors_json = json.dumps([
+            {'id': v.id, 'name': v.flavor.name if v.flavor else '', 'color': v.flavor.hex_color if v.flavor else '#9CA3AF', 'stock': v.available_quantity, 'weight': v.weight_label}
+            for v in p.in_stock_variants
+        ], ensure_ascii=False)
+    return products
+
+
+def _request_cart_key(request, cart, product_id):
+    """
+    (CartKey з variant_id запиту, None) або (None, відповідь), якщо variant_id не число:
+    такий запит кошик не змінює
+    """
+    source = request.POST if request.method == 'POST' else request.GET
+    try:
+        return CartKey.build(product_id, source.get('variant_id')), None
+    except (TypeError, ValueError):
+        if _is_ajax_request(request):
+            return None, JsonResponse({
+                'success': False,
+                'message': 'Вибраний варіант невірний',
+                'cart_count': cart.count,
+            }, status=400)
+        return None, redirect('shop:cart')
+
+
 def _build_cart_update_payload(cart, product_id, variant_id=None):
-    total = 0
-    cart_count = 0
-    target_quantity = 0
-    target_subtotal = 0
-
-    product_ids = set()
-    variant_ids = set()
-    for cart_key in cart.keys():
-        parts = str(cart_key).split('_')
-        product_ids.add(int(parts[0]))
-        if len(parts) == 2:
-            variant_ids.add(int(parts[1]))
-
-    products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-    variants = {v.id: v for v in ProductVariant.objects.filter(id__in=variant_ids)} if variant_ids else {}
-
-    target_key = f"{product_id}_{variant_id}" if variant_id else str(product_id)
-
-    for cart_key, quantity in cart.items():
-        parts = str(cart_key).split('_')
-        pid = int(parts[0])
-        product = products.get(pid)
-
-        if product:
-            quantity = int(quantity or 0)
-            variant = variants.get(int(parts[1])) if len(parts) == 2 else None
-            price = variant.price if variant else product.get_min_price()
-            subtotal = price * quantity
-            total += subtotal
-            cart_count += quantity
-
-            if cart_key == target_key:
-                target_quantity = quantity
-                target_subtotal = float(subtotal)
+    lines, total = cart.totals()
+    target_price, target_quantity = lines.get(CartKey.build(product_id, variant_id), (0, 0))
+    target_subtotal = target_price * target_quantity
+    cart_count = cart.count
 
     shipping_cost = _get_delivery_cost(total, 'np_branch')
     grand_total = total + shipping_cost
@@ -84,6 +98,7 @@ def _build_cart_update_payload(cart, product_id, variant_id=None):
     return payload
 
 # Головна сторінка
+@cache_anonymous_page(vary_on=('newsletter_status',))
 def home(request):
     newsletter_status = request.GET.get('newsletter_status')
     newsletter_message = None
@@ -94,17 +109,15 @@ def home(request):
     elif newsletter_status == 'invalid':
         newsletter_message = 'Будь ласка, введіть правильну email адресу.'
 
-    popular_products = list(
-        Product.objects
-        .annotate(total_sold=Sum('orderitem__quantity'))
-        .filter(total_sold__gt=0)
-        .order_by('-total_sold', '-created_at')[:3]
-    )
+    # Рейтинг бестселерів береться з кешу (shop/bestsellers.py)
+    popular_ids = get_bestseller_ids('all')[:3]
+    popular_by_id = {product.id: product for product in Product.objects.for_listing().filter(id__in=popular_ids)}
+    popular_products = [popular_by_id[product_id] for product_id in popular_ids if product_id in popular_by_id]
 
     if len(popular_products) < 3:
         existing_ids = [product.id for product in popular_products]
         fallback_products = list(
-            Product.objects
+            Product.objects.for_listing()
             .exclude(id__in=existing_ids)
             .order_by('-created_at')[: 3 - len(popular_products)]
         )
@@ -139,20 +152,14 @@ def newsletter_subscribe(request):
     return redirect(reverse('shop:home') + '?newsletter_status=exists')
 
 # Доставка
+@cache_anonymous_page()
 def delivery(request):
     return render(request, 'shop/delivery.html')
 
-# Каталог товарів
-def catalog(request):
-    import json
-    from django.db.models import Avg, Count, Q
-    products = Product.objects.all()
-    categories = Category.objects.filter(parent__isnull=True)  # Тільки батьківські категорії
-    selected_category = None
-    search_query = request.GET.get('q', '').strip()
-
-    # Збереження фільтрів у сесії
+# Збереження фільтрів каталогу в сесії (для посилання "назад до каталогу")
+def _remember_catalog_filters(request):
     filters = {}
+    search_query = request.GET.get('q', '').strip()
     if search_query:
         filters['q'] = search_query
 
@@ -164,97 +171,148 @@ def catalog(request):
     if sort:
         filters['sort'] = sort
 
+    # Записуємо лише зміни, щоб не зберігати сесію на кожному перегляді
     if filters:
-        request.session['catalog_filters'] = filters
-    else:
+        if request.session.get('catalog_filters') != filters:
+            request.session['catalog_filters'] = filters
+    elif 'catalog_filters' in request.session:
         # Якщо немає фільтрів, очистити сесію
-        request.session.pop('catalog_filters', None)
+        del request.session['catalog_filters']
+
+def _with_catalog_etag(response, etag):
+    response['ETag'] = etag
+    # Браузер зберігає відповідь, але щоразу перевіряє її через If-None-Match
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['X-Requested-With'])
+    return response
+
+# GET-параметри, від яких залежить вміст каталогу
+CATALOG_PARAMS = ('q', 'category', 'sort', 'cursor')
+
+# Каталог товарів
+@cache_anonymous_page(vary_on=CATALOG_PARAMS, on_hit=_remember_catalog_filters)
+def catalog(request):
+    from django.db.models import Q
+    products = Product.objects.for_listing()
+    category_tree = get_category_tree()
+    categories = category_tree.roots  # Тільки батьківські категорії
+    selected_category = None
+    search_query = request.GET.get('q', '').strip()
+    search_truncated = False
+    _remember_catalog_filters(request)
+
+    # AJAX-фільтри: якщо каталог і фільтри не змінились, браузер уже має відповідь
+    ajax_etag = catalog_etag(request, CATALOG_PARAMS) if _is_ajax_request(request) else None
+    if ajax_etag and ajax_etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return _with_catalog_etag(HttpResponseNotModified(), ajax_etag)
 
     if search_query:
-        products = products.filter(name__icontains=search_query)
+        # Повнотекстовий пошук повертає id від найрелевантнішого (shop/search.py)
+        found_ids = search_product_ids(search_query, limit=SEARCH_RESULT_LIMIT)
+        search_truncated = len(found_ids) >= SEARCH_RESULT_LIMIT
+        products = products.filter(id__in=found_ids).annotate(search_rank=Case(
+            *[When(id=product_id, then=Value(position)) for position, product_id in enumerate(found_ids)],
+            default=Value(len(found_ids)),
+            output_field=IntegerField(),
+        ))
 
     # Фільтрація за категорією (з урахуванням підкатегорій)
     category_id = request.GET.get('category')
     if category_id:
-        try:
-            selected_category = Category.objects.get(id=category_id)
-            if selected_category.is_parent():
-                all_subcategories = selected_category.get_all_subcategories()
-                category_ids = [selected_category.id] + [cat.id for cat in all_subcategories]
-                products = products.filter(Q(category_id__in=category_ids))
+        selected_category = category_tree.get(category_id)
+        if selected_category is not None:
+            if category_tree.is_parent(selected_category.id):
+                products = products.filter(Q(category_id__in=category_tree.subtree_ids(selected_category.id)))
             else:
                 # Якщо вибрана підкатегорія, показати тільки товари з неї
-                products = products.filter(category_id=category_id)
-        except Category.DoesNotExist:
-            selected_category = None
+                products = products.filter(category_id=selected_category.id)
 
-    # Сортування за ціною
+    # Сортування та keyset-пагінація (курсор наступної сторінки передається в ?cursor=)
     sort = request.GET.get('sort')
-    if sort == 'price_asc':
-        products = products.annotate(min_price=Min('variants__price')).order_by('min_price')
-    elif sort == 'price_desc':
-        products = products.annotate(min_price=Min('variants__price')).order_by('-min_price')
-    elif sort == 'rating_desc':
-        products = products.annotate(
-            avg_rating=Coalesce(Avg('reviews__rating'), Value(0.0), output_field=FloatField())
-        ).order_by('-avg_rating', '-created_at')
-    elif sort == 'newest':
-        products = products.order_by('-created_at')
-
-    # Додаємо середній рейтинг до кожного продукту
-    products = list(products)
-    for p in products:
-        rating_stats = p.reviews.aggregate(avg_rating=Avg('rating'), review_count=Count('id'))
-        avg_rating = rating_stats.get('avg_rating')
-        p.aggregate_avg_rating = int(round(avg_rating)) if avg_rating is not None else 0
-        p.review_count = rating_stats.get('review_count') or 0
-        flavors_qs = p.variants.filter(stock_quantity__gt=0).select_related('flavor')
-        p.flavors_json = json.dumps([
-            {'id': v.id, 'name': v.flavor.name if v.flavor else '', 'color': v.flavor.hex_color if v.flavor else '#9CA3AF', 'stock': v.stock_quantity, 'weight': v.weight_label}
-            for v in flavors_qs
-        ], ensure_ascii=False)
+    page_sort = sort
+    if search_query and not sort:
+        page_sort = 'relevance'
+    elif sort == 'relevance':
+        page_sort = None
+    products, next_cursor = paginate_keyset(products, page_sort, request.GET.get('cursor'))
+    next_page_url = None
+    if next_cursor:
+        next_params = request.GET.copy()
+        next_params['cursor'] = next_cursor
+        next_page_url = f"{reverse('shop:catalog')}?{next_params.urlencode()}"
+
+    # Рейтинг, ціни, залишки та смаки вже пораховані в for_listing()
+    products = _attach_listing_data(products)
+    # Картки беруться з кешу фрагментів, рендеряться лише відсутні (shop/product_cards.py)
+    product_cards = render_product_cards(products)
 
     if _is_ajax_request(request):
         products_html = render_to_string('shop/partials/catalog_products_grid.html', {
-            'products': products,
+            'product_cards': product_cards,
         }, request=request)
-        hero_html = render_to_string('shop/partials/catalog_hero.html', {
-            'selected_category': selected_category,
+        pager_html = render_to_string('shop/partials/catalog_pager.html', {
+            'next_page_url': next_page_url,
+            'search_truncated': search_truncated,
+            'search_result_limit': SEARCH_RESULT_LIMIT,
         }, request=request)
-        return JsonResponse({
+        payload = {
             'success': True,
             'products_html': products_html,
-            'hero_html': hero_html,
+            'pager_html': pager_html,
+            'next_cursor': next_cursor,
             'products_count': len(products),
-        })
+            'append': bool(request.GET.get('cursor')),
+        }
+        if not payload['append']:
+            payload['hero_html'] = render_to_string('shop/partials/catalog_hero.html', {
+                'selected_category': selected_category,
+            }, request=request)
+        return _with_catalog_etag(JsonResponse(payload), ajax_etag)
 
     return render(request, 'shop/catalog.html', {
         'products': products,
+        'product_cards': product_cards,
         'categories': categories,
         'selected_category': selected_category,
         'selected_category_id': category_id,
         'selected_sort': sort,
-        'selected_query': search_query
+        'selected_query': search_query,
+        'next_page_url': next_page_url,
+        'search_truncated': search_truncated,
+        'search_result_limit': SEARCH_RESULT_LIMIT,
+    })
+
+# Підказки для поля пошуку каталогу
+def search_suggest(request):
+    query = request.GET.get('q', '').strip()[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_LIMIT)), 1), 15)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    suggestions = suggest(query, limit=limit) if query else []
+    return JsonResponse({
+        'query': query,
+        'suggestions': [
+            {'type': item.type, 'label': item.label, 'url': item.url}
+            for item in suggestions
+        ],
     })
 
 # Детальна сторінка продукту
+@cache_anonymous_page()
 def product_detail(request, product_id):
     import json
-    product = get_object_or_404(Product, id=product_id)
-    reviews = product.reviews.select_related('customer').prefetch_related('replies')
-    review_count = reviews.count()
-    rating_stats = reviews.aggregate(avg_rating=Avg('rating'))
-    avg_rating = rating_stats.get('avg_rating')
-    aggregate_avg_rating = int(round(avg_rating)) if avg_rating is not None else 0
+    # Усі дані сторінки — фіксованою кількістю запитів (shop/product_page.py)
+    page = load_product_page(product_id)
+    product = page['product']
+    min_price = page['min_price']
     min_delivery_cost = min(
-        _get_delivery_cost(product.get_min_price(), 'np_branch'),
-        _get_delivery_cost(product.get_min_price(), 'courier_kyiv')
+        _get_delivery_cost(min_price, 'np_branch'),
+        _get_delivery_cost(min_price, 'courier_kyiv')
     )
     delivery_is_free = min_delivery_cost == 0
-    related_products = Product.objects.exclude(id=product.id).order_by('-created_at')[:8]
     customer_id = request.session.get('customer_id')
 
-    variants_qs = product.variants.select_related('flavor').order_by('id')
     variants_data = [
         {
             'id': v.id,
@@ -264,39 +322,29 @@ def product_detail(request, product_id):
             'flavor_color': v.flavor.hex_color if v.flavor else '#9CA3AF',
             'price': float(v.price),
             'old_price': float(v.old_price) if v.old_price else None,
-            'stock': v.stock_quantity,
+            'stock': v.available_quantity,
         }
-        for v in variants_qs
+        for v in page['variants']
     ]
     variants_json = json.dumps(variants_data, ensure_ascii=False)
-    available_stock = product.get_available_stock()
-
-    if customer_id:
-        try:
-            Customer.objects.get(id=customer_id)
-        except Customer.DoesNotExist:
-            pass
 
     return render(request, 'shop/product_detail.html', {
         'product': product,
-        'reviews': reviews,
-        'review_count': review_count,
-        'aggregate_avg_rating': aggregate_avg_rating,
+        'reviews': page['reviews'],
+        'review_count': page['review_count'],
+        'aggregate_avg_rating': page['aggregate_avg_rating'],
         'min_delivery_cost': min_delivery_cost,
         'delivery_is_free': delivery_is_free,
-        'related_products': related_products,
+        'related_products': page['related_products'],
         'customer_id': customer_id,
         'variants_data': variants_data,
         'variants_json': variants_json,
-        'available_stock': available_stock,
+        'available_stock': page['available_stock'],
     })
 
 
 # Додавання товару в кошик
 def add_to_cart(request, product_id):
-    if not request.session.get('customer_id'):
-        request.session['guest_session'] = request.session.session_key
-
     quantity = 1
     if request.method == 'POST':
         try:
@@ -331,29 +379,26 @@ def add_to_cart(request, product_id):
                 return JsonResponse({
                     'success': False,
                     'message': 'Вибраний варіант невірний',
-                    'cart_count': sum(int(qty or 0) for qty in request.session.get('cart', {}).values()),
+                    'cart_count': get_cart(request).count,
                 }, status=400)
             return redirect('shop:product_detail', product_id=product_id)
 
-    cart = request.session.get('cart', {})
+    cart = get_cart(request)
 
-    has_variants = ProductVariant.objects.filter(product_id=product_id).exists()
+    # Знайдений варіант уже означає, що вони в товару є
+    has_variants = variant is not None or ProductVariant.objects.filter(product_id=product_id).exists()
     if has_variants and not variant_id:
         if _is_ajax_request(request):
             return JsonResponse({
                 'success': False,
                 'message': 'Будь ласка, оберіть варіант',
-                'cart_count': sum(int(qty or 0) for qty in cart.values()),
+                'cart_count': cart.count,
             }, status=400)
         next_url = request.META.get('HTTP_REFERER')
         return redirect(next_url) if next_url else redirect('shop:product_detail', product_id=product_id)
 
-    if variant_id:
-        cart_key = f"{product_id}_{variant_id}"
-    else:
-        cart_key = str(product_id)
-
-    existing_quantity = int(cart.get(cart_key, 0) or 0)
+    cart_key = CartKey.build(product_id, variant_id)
+    existing_quantity = cart.quantity(cart_key)
 
     available_stock = product.get_available_stock()
 
@@ -362,19 +407,19 @@ def add_to_cart(request, product_id):
             return JsonResponse({
                 'success': False,
                 'message': 'Товар закінчився',
-                'cart_count': sum(int(qty or 0) for qty in cart.values()),
+                'cart_count': cart.count,
             }, status=400)
         next_url = request.META.get('HTTP_REFERER')
         if next_url:
             return redirect(next_url)
         return redirect('shop:catalog')
 
-    if variant and variant.stock_quantity <= 0:
+    if variant and variant.available_quantity <= 0:
         if _is_ajax_request(request):
             return JsonResponse({
                 'success': False,
                 'message': 'Вибраний варіант закінчився',
-                'cart_count': sum(int(qty or 0) for qty in cart.values()),
+                'cart_count': cart.count,
             }, status=400)
         next_url = request.META.get('HTTP_REFERER')
         if next_url:
@@ -382,7 +427,7 @@ def add_to_cart(request, product_id):
         return redirect('shop:product_detail', product_id=product_id)
 
     if variant:
-        allowed_to_add = max(variant.stock_quantity - existing_quantity, 0)
+        allowed_to_add = max(variant.available_quantity - existing_quantity, 0)
     else:
         allowed_to_add = max(available_stock - existing_quantity, 0)
 
@@ -391,18 +436,15 @@ def add_to_cart(request, product_id):
             return JsonResponse({
                 'success': False,
                 'message': 'В кошику вже максимальна кількість для цього товару',
-                'cart_count': sum(int(qty or 0) for qty in cart.values()),
+                'cart_count': cart.count,
             }, status=400)
         return redirect('shop:cart')
 
     actual_add = min(quantity, allowed_to_add)
-    cart[cart_key] = existing_quantity + actual_add
-    request.session['cart'] = cart
-    request.session.modified = True
+    cart.change(cart_key, actual_add)
 
     if _is_ajax_request(request):
-        total_count = sum(int(qty) for qty in cart.values() if qty)
-        payload = {'success': True, 'cart_count': total_count}
+        payload = {'success': True, 'cart_count': cart.count}
         if actual_add < quantity:
             payload['message'] = 'Додано тільки доступну кількість товару'
         return JsonResponse(payload)
@@ -415,64 +457,7 @@ def add_to_cart(request, product_id):
 
 # Перегляд кошика
 def cart(request):
-    cart = request.session.get('cart', {})
-
-    cart_items = []
-    total = 0
-
-    product_ids = set()
-    variant_ids = set()
-
-    for cart_key in cart.keys():
-        parts = str(cart_key).split('_')
-        product_ids.add(int(parts[0]))
-        if len(parts) == 2:
-            variant_ids.add(int(parts[1]))
-
-    products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-    variants = {v.id: v for v in ProductVariant.objects.filter(id__in=variant_ids).select_related('flavor')} if variant_ids else {}
-
-    for cart_key, quantity in cart.items():
-        parts = str(cart_key).split('_')
-
-        if len(parts) == 2:
-            product_id = int(parts[0])
-            variant_id = int(parts[1])
-            product = products.get(product_id)
-            variant = variants.get(variant_id)
-
-            if product and variant:
-                price = variant.price
-                subtotal = price * quantity
-                cart_items.append({
-                    'product': product,
-                    'variant': variant,
-                    'flavor': variant.flavor,
-                    'weight_label': variant.weight_label,
-                    'quantity': quantity,
-                    'subtotal': subtotal,
-                    'price': price,
-                    'cart_key': cart_key,
-                })
-                total += subtotal
-        else:
-            product_id = int(parts[0])
-            product = products.get(product_id)
-
-            if product:
-                price = product.get_min_price()
-                subtotal = price * quantity
-                cart_items.append({
-                    'product': product,
-                    'variant': None,
-                    'flavor': None,
-                    'weight_label': '',
-                    'quantity': quantity,
-                    'subtotal': subtotal,
-                    'price': price,
-                    'cart_key': cart_key,
-                })
-                total += subtotal
+    cart_items, total = get_cart(request).lines()
 
     shipping_cost = _get_delivery_cost(total, 'np_branch')
     grand_total = total + shipping_cost
@@ -488,48 +473,14 @@ def cart(request):
 
 # Оформлення замовлення
 def checkout(request):
-    cart = request.session.get('cart', {})
+    cart = get_cart(request)
     if not cart:
         return redirect('shop:cart')
 
-    product_ids = set()
-    variant_ids = set()
-    cart_info = {}
-
-    for cart_key, quantity in cart.items():
-        parts = str(cart_key).split('_')
-        product_id = int(parts[0])
-        variant_id = int(parts[1]) if len(parts) == 2 else None
-        cart_info[cart_key] = {'product_id': product_id, 'variant_id': variant_id, 'quantity': quantity}
-        product_ids.add(product_id)
-        if variant_id:
-            variant_ids.add(variant_id)
-
-    products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-    variants_map = {v.id: v for v in ProductVariant.objects.filter(id__in=variant_ids).select_related('flavor')} if variant_ids else {}
-
-    cart_items = []
-    total = 0
-
-    for cart_key, info in cart_info.items():
-        product = products.get(info['product_id'])
-        if not product:
-            continue
-        variant = variants_map.get(info['variant_id']) if info['variant_id'] else None
-        price = variant.price if variant else product.get_min_price()
-        quantity = info['quantity']
-        subtotal = price * quantity
-        total += subtotal
-        cart_items.append({
-            'product': product,
-            'variant': variant,
-            'flavor': variant.flavor if variant else None,
-            'weight_label': variant.weight_label if variant else '',
-            'quantity': quantity,
-            'subtotal': subtotal,
-            'price': price,
-            'cart_key': cart_key,
-        })
+    cart_items, total = cart.lines()
+    if not cart_items:
+        # Товари чи варіанти з кошика могли видалити — оформлювати нічого
+        return redirect('shop:cart')
 
     customer = None
     customer_id = request.session.get('customer_id')
@@ -545,98 +496,75 @@ def checkout(request):
         shipping_cost = _get_delivery_cost(total, selected_delivery_method)
         grand_total = total + shipping_cost
         if form.is_valid():
-            with transaction.atomic():
-                stock_products = {
-                    p.id: p
-                    for p in Product.objects.select_for_update().filter(id__in=product_ids)
-                }
-                stock_variants = {
-                    v.id: v
-                    for v in ProductVariant.objects.select_for_update().filter(id__in=variant_ids)
-                } if variant_ids else {}
-
-                out_of_stock_items = []
-                for item in cart_items:
-                    product = stock_products.get(item['product'].id)
-                    requested_quantity = int(item['quantity'] or 0)
-                    if not product:
-                        out_of_stock_items.append(item['product'].name)
-                    elif item['variant']:
-                        sv = stock_variants.get(item['variant'].id)
-                        if not sv or requested_quantity > sv.stock_quantity:
-                            label = item['product'].name
-                            parts = []
-                            if item['weight_label']:
-                                parts.append(item['weight_label'])
-                            if item['flavor']:
-                                parts.append(item['flavor'].name)
-                            if parts:
-                                label += f" ({', '.join(parts)})"
-                            out_of_stock_items.append(label)
-
-                if out_of_stock_items:
-                    form.add_error(
-                        None,
-                        'Недостатньо товару в наявності: ' + ', '.join(out_of_stock_items)
-                    )
-                else:
-                    payment_method = form.cleaned_data.get('payment_method')
-
-                    if payment_method == 'online':
-                        form_fields = [
-                            'first_name', 'last_name', 'email', 'phone',
-                            'address', 'city', 'postal_code', 'postal_branch',
-                            'delivery_method', 'payment_method',
-                        ]
-                        pending = PendingCheckout.objects.create(
-                            customer=customer,
-                            form_data={f: request.POST.get(f, '') for f in form_fields},
-                            cart_snapshot=dict(cart),
-                            grand_total=grand_total,
-                            shipping_cost=shipping_cost,
-                        )
+            # Попередня перевірка за вже завантаженими залишками, без блокувань.
+            # Остаточно залишок списує (чи утримує для онлайн-оплати) умовний UPDATE.
+            out_of_stock_items = []
+            for item in cart_items:
+                stock = (item['variant'] or item['product']).available_quantity
+                if int(item['quantity'] or 0) > stock:
+                    label = item['product'].name
+                    parts = []
+                    if item['weight_label']:
+                        parts.append(item['weight_label'])
+                    if item['flavor']:
+                        parts.append(item['flavor'].name)
+                    if parts:
+                        label += f" ({', '.join(parts)})"
+                    out_of_stock_items.append(label)
+
+            if out_of_stock_items:
+                form.add_error(
+                    None,
+                    'Недостатньо товару в наявності: ' + ', '.join(out_of_stock_items)
+                )
+            else:
+                payment_method = form.cleaned_data.get('payment_method')
+
+                if payment_method == 'online':
+                    form_fields = [
+                        'first_name', 'last_name', 'email', 'phone',
+                        'address', 'city', 'postal_code', 'postal_branch',
+                        'delivery_method', 'payment_method',
+                    ]
+                    try:
+                        # Залишок утримується на час оплати (STOCK_HOLD_TTL)
+                        with transaction.atomic():
+                            pending = PendingCheckout.objects.create(
+                                customer=customer,
+                                form_data={f: request.POST.get(f, '') for f in form_fields},
+                                cart_snapshot=cart.snapshot(),
+                                grand_total=grand_total,
+                                shipping_cost=shipping_cost,
+                            )
+                            hold_stock(pending, lines_from_cart(cart_items))
+                    except InsufficientStock as exc:
+                        form.add_error(None, 'Недостатньо товару в наявності: ' + ', '.join(exc.labels))
+                    else:
                         return redirect('shop:liqpay_pay', token=str(pending.token))
-
+                else:
                     order = form.save(commit=False)
                     order.total = grand_total
                     order.shipping_cost = shipping_cost
-
-                    if customer:
-                        order.customer = customer
-                        order_updates = {}
-                        for field in ('first_name', 'last_name', 'address', 'city', 'postal_code'):
-                            order_val = (getattr(order, field) or '').strip()
-                            cust_val = (getattr(customer, field) or '').strip()
-                            if not cust_val and order_val:
-                                order_updates[field] = order_val
-                        if order_updates:
-                            for field, val in order_updates.items():
-                                setattr(customer, field, val)
-                            customer.save(update_fields=list(order_updates.keys()) + ['updated_at'])
-
-                    order.save()
-
-                    for item in cart_items:
-                        product = stock_products[item['product'].id]
-                        quantity = int(item['quantity'] or 0)
-                        variant = stock_variants.get(item['variant'].id) if item['variant'] else None
-                        OrderItem.objects.create(
-                            order=order,
-                            product=product,
-                            variant=variant,
-                            quantity=quantity,
-                            price=item['price'],
-                        )
-                        if variant:
-                            ProductVariant.objects.filter(id=variant.id).update(
-                                stock_quantity=F('stock_quantity') - quantity
-                            )
-
-                    request.session['cart'] = {}
-                    request.session.modified = True
+                    order.customer = customer
                     order.payment_status = 'cod'
-                    order.save(update_fields=['payment_status'])
-                    return render(request, 'shop/checkout_success.html', {'order': order})
+                    try:
+                        place_order(order, lines_from_cart(cart_items))
+                    except InsufficientStock as exc:
+                        form.add_error(None, 'Недостатньо товару в наявності: ' + ', '.join(exc.labels))
+                    else:
+                        if customer:
+                            order_updates = {}
+                            for field in ('first_name', 'last_name', 'address', 'city', 'postal_code'):
+                                order_val = (getattr(order, field) or '').strip()
+                                cust_val = (getattr(customer, field) or '').strip()
+                                if not cust_val and order_val:
+                                    order_updates[field] = order_val
+                            if order_updates:
+                                for field, val in order_updates.items():
+                                    setattr(customer, field, val)
+                                customer.save(update_fields=list(order_updates.keys()) + ['updated_at'])
+                        cart.clear()
+                        return render(request, 'shop/checkout_success.html', {'order': order})
     else:
         selected_delivery_method = 'np_branch'
         shipping_cost = _get_delivery_cost(total, selected_delivery_method)
@@ -665,60 +593,44 @@ def checkout(request):
 
 # Збільшення кількості товару в кошику
 def increase_quantity(request, product_id):
-    cart = request.session.get('cart', {})
-
-    if request.method == 'POST':
-        variant_id = request.POST.get('variant_id')
-    else:
-        variant_id = request.GET.get('variant_id')
-
-    cart_key = f"{product_id}_{variant_id}" if variant_id else str(product_id)
+    cart = get_cart(request)
 
-    if cart_key in cart:
-        product = get_object_or_404(Product, id=product_id)
-        current_qty = int(cart[cart_key] or 0)
+    cart_key, error_response = _request_cart_key(request, cart, product_id)
+    if error_response:
+        return error_response
+    variant_id = cart_key.variant_id
+    current_qty = cart.quantity(cart_key)
 
+    if current_qty:
+        max_qty = None
         if variant_id:
-            try:
-                pv = ProductVariant.objects.get(id=variant_id, product_id=product_id)
-                max_qty = pv.stock_quantity
-            except ProductVariant.DoesNotExist:
-                max_qty = product.get_available_stock()
-        else:
-            max_qty = product.get_available_stock()
+            max_qty = (
+                ProductVariant.objects.filter(id=variant_id, product_id=product_id)
+                .values_list(F('stock_quantity') - F('reserved_quantity'), flat=True).first()
+            )
+        if max_qty is None:
+            max_qty = get_object_or_404(Product, id=product_id).get_available_stock()
 
         if current_qty < max_qty:
-            cart[cart_key] = current_qty + 1
+            cart.change(cart_key, 1)
         elif _is_ajax_request(request):
             payload = _build_cart_update_payload(cart, product_id, variant_id)
             payload.update({'success': False, 'message': 'Досягнуто максимальну кількість в наявності'})
             return JsonResponse(payload, status=400)
 
-    request.session['cart'] = cart
-    request.session.modified = True
-
     if _is_ajax_request(request):
         return JsonResponse(_build_cart_update_payload(cart, product_id, variant_id))
     return redirect('shop:cart')
 
 # Зменшення кількості товару в кошику
 def decrease_quantity(request, product_id):
-    cart = request.session.get('cart', {})
+    cart = get_cart(request)
 
-    if request.method == 'POST':
-        variant_id = request.POST.get('variant_id')
-    else:
-        variant_id = request.GET.get('variant_id')
-
-    cart_key = f"{product_id}_{variant_id}" if variant_id else str(product_id)
-
-    if cart_key in cart:
-        cart[cart_key] -= 1
-        if cart[cart_key] <= 0:
-            del cart[cart_key]
-
-    request.session['cart'] = cart
-    request.session.modified = True
+    cart_key, error_response = _request_cart_key(request, cart, product_id)
+    if error_response:
+        return error_response
+    variant_id = cart_key.variant_id
+    cart.change(cart_key, -1)
 
     if _is_ajax_request(request):
         return JsonResponse(_build_cart_update_payload(cart, product_id, variant_id))
@@ -726,20 +638,12 @@ def decrease_quantity(request, product_id):
 
 # Видалення товару з кошика
 def remove_from_cart(request, product_id):
-    cart = request.session.get('cart', {})
-
-    if request.method == 'POST':
-        variant_id = request.POST.get('variant_id')
-    else:
-        variant_id = request.GET.get('variant_id')
+    cart = get_cart(request)
 
-    cart_key = f"{product_id}_{variant_id}" if variant_id else str(product_id)
-
-    if cart_key in cart:
-        del cart[cart_key]
-
-    request.session['cart'] = cart
-    request.session.modified = True
+    cart_key, error_response = _request_cart_key(request, cart, product_id)
+    if error_response:
+        return error_response
+    cart.remove(cart_key)
 
     if _is_ajax_request(request):
         return JsonResponse(_build_cart_update_payload(cart, product_id))
@@ -760,9 +664,9 @@ def register(request):
         form = RegistrationForm(request.POST)
         if form.is_valid():
             customer = form.save()
+            merge_guest_cart(request, customer)
             request.session['customer_id'] = customer.id
             request.session['customer_username'] = customer.username
-            request.session.modified = True
             return redirect('shop:home')
     else:
         form = RegistrationForm()
@@ -784,18 +688,18 @@ def login_view(request):
             try:
                 customer = Customer.objects.get(username=username)
                 if customer.check_password(password) and customer.is_active:
+                    merge_guest_cart(request, customer)
                     request.session['customer_id'] = customer.id
                     request.session['customer_username'] = customer.username
-                    request.session.modified = True
                     return redirect('shop:catalog')
 
                 if customer.password == password and customer.is_active:
                     # Зворотна сумісність: оновлюємо паролі у відкритому вигляді під час першого входу.
                     customer.set_password(password)
                     customer.save(update_fields=['password', 'updated_at'])
+                    merge_guest_cart(request, customer)
                     request.session['customer_id'] = customer.id
                     request.session['customer_username'] = customer.username
-                    request.session.modified = True
                     return redirect('shop:catalog')
 
                 form.add_error(None, 'Неправильне ім\'я користувача або пароль')
@@ -813,7 +717,6 @@ def logout_view(request):
         del request.session['customer_id']
     if 'customer_username' in request.session:
         del request.session['customer_username']
-    request.session.modified = True
     return redirect('shop:home')
 
 
@@ -922,81 +825,6 @@ def delete_review(request, review_id):
 
 
 
-# ─── LiqPay helpers ────────────────────────────────────────────────────────────
-
-def _create_order_from_pending(pending):
-    """Creates Order + OrderItems from PendingCheckout data. Decrements stock."""
-    form_data = pending.form_data
-    cart = pending.cart_snapshot
-
-    product_ids = set()
-    variant_ids = set()
-    cart_info = {}
-    for cart_key, quantity in cart.items():
-        parts = str(cart_key).split('_')
-        product_id = int(parts[0])
-        variant_id = int(parts[1]) if len(parts) == 2 else None
-        cart_info[cart_key] = {
-            'product_id': product_id,
-            'variant_id': variant_id,
-            'quantity': int(quantity),
-        }
-        product_ids.add(product_id)
-        if variant_id:
-            variant_ids.add(variant_id)
-
-    with transaction.atomic():
-        stock_products = {
-            p.id: p
-            for p in Product.objects.select_for_update().filter(id__in=product_ids)
-        }
-        stock_variants = {
-            v.id: v
-            for v in ProductVariant.objects.select_for_update().filter(id__in=variant_ids)
-        } if variant_ids else {}
-
-        order = Order(
-            customer=pending.customer,
-            total=pending.grand_total,
-            payment_method='online',
-            payment_status='paid',
-            status='processing',
-            liqpay_token=str(pending.token),
-            first_name=form_data.get('first_name', ''),
-            last_name=form_data.get('last_name', ''),
-            email=form_data.get('email', ''),
-            phone=form_data.get('phone', ''),
-            address=form_data.get('address', ''),
-            city=form_data.get('city', ''),
-            postal_code=form_data.get('postal_code', ''),
-            postal_branch=form_data.get('postal_branch', ''),
-            delivery_method=form_data.get('delivery_method', ''),
-            shipping_cost=pending.shipping_cost,
-        )
-        order.save()
-
-        for cart_key, info in cart_info.items():
-            product = stock_products.get(info['product_id'])
-            if not product:
-                continue
-            variant = stock_variants.get(info['variant_id']) if info['variant_id'] else None
-            price = variant.price if variant else product.get_min_price()
-            qty = info['quantity']
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                variant=variant,
-                quantity=qty,
-                price=price,
-            )
-            if variant:
-                ProductVariant.objects.filter(id=variant.id).update(
-                    stock_quantity=F('stock_quantity') - qty
-                )
-
-    return order
-
-
 # ─── LiqPay views ─────────────────────────────────────────────────────────────
 
 def liqpay_pay(request, token):
@@ -1020,6 +848,7 @@ def liqpay_pay(request, token):
         server_url=callback_url,
         result_url=result_url,
         sandbox=settings.LIQPAY_SANDBOX,
+        checkout_url=settings.LIQPAY_CHECKOUT_URL,
     )
 
     return render(request, 'shop/liqpay_redirect.html', {
@@ -1043,55 +872,32 @@ def liqpay_callback(request):
     if not liqpay_helper.verify_callback(settings.LIQPAY_PRIVATE_KEY, data, signature):
         return HttpResponse('invalid signature', status=400)
 
-    payload = liqpay_helper.decode_callback(data)
-    order_id = payload.get('order_id')  # UUID token string
-    status = payload.get('status')
-
-    if status in ('success', 'sandbox'):
-        # Guard: check if order was already created (e.g. by liqpay_result)
-        if not Order.objects.filter(liqpay_token=str(order_id)).exists():
-            try:
-                pending = PendingCheckout.objects.get(token=order_id)
-            except PendingCheckout.DoesNotExist:
-                return HttpResponse('OK')  # already processed
-            _create_order_from_pending(pending)
-            pending.delete()
-
+    # Замовлення створює воркер черги (shop/payment_inbox.py) — LiqPay отримує відповідь одразу,
+    # а повторні доставки відсікає журнал подій
+    enqueue(data, signature)
     return HttpResponse('OK')
 
 
 @csrf_exempt
 def liqpay_result(request, token):
     # If callback already created the order, just show success
-    try:
-        order = Order.objects.get(liqpay_token=str(token))
-        request.session['cart'] = {}
-        request.session.modified = True
-        return render(request, 'shop/checkout_success.html', {'order': order})
-    except Order.DoesNotExist:
-        pass
-
-    try:
-        pending = PendingCheckout.objects.get(token=token)
-    except PendingCheckout.DoesNotExist:
+    order = paid_order(token)
+    if order is None:
+        data = request.POST.get('data', '')
+        signature = request.POST.get('signature', '')
+        if data and signature and liqpay_helper.verify_callback(settings.LIQPAY_PRIVATE_KEY, data, signature):
+            payload = liqpay_helper.decode_callback(data)
+            if str(payload.get('order_id')) == str(token):
+                # Callback may be processing the same payment right now — the ledger lets only one create the order
+                order = process_payment(payload)
+                if order is None:
+                    # Payment failed — cart stays intact, held stock goes back on sale
+                    return redirect('shop:cart')
+    if order is None:
+        # No valid data — redirect to cart as fallback (home for unknown tokens)
+        if PendingCheckout.objects.filter(token=token).exists():
+            return redirect('shop:cart')
         return redirect('shop:home')
 
-    data = request.POST.get('data', '')
-    signature = request.POST.get('signature', '')
-
-    if data and signature:
-        if liqpay_helper.verify_callback(settings.LIQPAY_PRIVATE_KEY, data, signature):
-            payload = liqpay_helper.decode_callback(data)
-            status = payload.get('status')
-            if status in ('success', 'sandbox'):
-                order = _create_order_from_pending(pending)
-                pending.delete()
-                request.session['cart'] = {}
-                request.session.modified = True
-                return render(request, 'shop/checkout_success.html', {'order': order})
-            elif status in ('failure', 'error', 'reversed'):
-                # Payment failed — cart stays intact
-                return redirect('shop:cart')
-
-    # No valid data — redirect to cart as fallback
-    return redirect('shop:cart')
\ No newline at end of file
+    get_cart(request).clear()
+    return render(request, 'shop/checkout_success.html', {'order': order})
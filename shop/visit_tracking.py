@@ -0,0 +1,173 @@
+"""
+Облік відвідувань сайту без звернень до бази в запиті.
+
+Middleware лише кладе (дата, session_key) у буфер процесу: вже бачені за
+сьогодні сесії відкидаються одразу в пам'яті, нові накопичуються і
+записуються фоновим потоком одним bulk_create(ignore_conflicts=True).
+Дублі між воркерами відсікає унікальний індекс (visit_date, session_key).
+Зведення статистики потік перераховує не частіше ніж раз на
+SITE_VISIT_STATS_INTERVAL секунд — за всі години, записані з минулого разу.
+
+SITE_VISIT_WRITER='sync' (тести й команди manage.py) вимикає потік і запис
+при зупинці процесу: відвідування пишеться одразу в запиті, поки база, для
+якої його зібрано, ще існує.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from .models import SiteVisit
+from .statistics import day_start, refresh_range
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBuffer:
+    def __init__(self, flush_interval, max_pending, stats_interval):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats_interval = stats_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._day = None
+        # session_key -> customer_id, записаний для сесії сьогодні
+        self._seen = {}
+        # (дата, session_key) -> (customer_id, момент першого запиту)
+        self._pending = {}
+        self._customer_updates = {}
+        # Найраніший момент, з якого зведення статистики ще не враховують записані відвідування
+        self._stale_from = None
+        self._next_refresh = 0
+        self._thread = None
+
+    def record(self, session_key, customer_id=None):
+        now = timezone.now()
+        today = timezone.localtime(now).date()
+        with self._lock:
+            if self._day != today:
+                self._day = today
+                self._seen = {}
+            if session_key in self._seen:
+                # Сесія вже врахована; лишається хіба що прив'язати покупця після входу
+                if customer_id and not self._seen[session_key]:
+                    self._seen[session_key] = customer_id
+                    if (today, session_key) in self._pending:
+                        self._pending[(today, session_key)] = (customer_id, self._pending[(today, session_key)][1])
+                    else:
+                        self._customer_updates[(today, session_key)] = customer_id
+                return
+            self._seen[session_key] = customer_id
+            self._pending[(today, session_key)] = (customer_id, now)
+            pending = len(self._pending)
+        if settings.SITE_VISIT_WRITER == 'sync':
+            self.flush()
+            return
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            updates, self._customer_updates = self._customer_updates, {}
+        return pending, updates
+
+    def flush(self, force_refresh=True):
+        """
+        Записує накопичені відвідування; повертає кількість переданих у bulk_create.
+        Зведення статистики перераховуються одразу лише з force_refresh, інакше —
+        не частіше ніж раз на stats_interval секунд.
+        """
+        pending, updates = self._take()
+        written = self._write(pending, updates) if pending or updates else 0
+        self.refresh_statistics(force=force_refresh)
+        return written
+
+    def _write(self, pending, updates):
+        try:
+            if pending:
+                # Дата й час беруться з моменту запиту, а не запису: відвідування о 23:59,
+                # записане після півночі, лишається в тому дні, за яким його відсіяно
+                SiteVisit.objects.bulk_create(
+                    [
+                        SiteVisit(
+                            visit_date=visit_date, session_key=session_key,
+                            customer_id=customer_id, created_at=seen_at,
+                        )
+                        for (visit_date, session_key), (customer_id, seen_at) in pending.items()
+                    ],
+                    ignore_conflicts=True,
+                )
+                # Рядок міг уже існувати (інший воркер) — прив'язуємо покупця окремо
+                updates.update({key: customer_id for key, (customer_id, _) in pending.items() if customer_id})
+            for (visit_date, session_key), customer_id in updates.items():
+                SiteVisit.objects.filter(
+                    visit_date=visit_date, session_key=session_key, customer__isnull=True,
+                ).update(customer_id=customer_id)
+        except DatabaseError:
+            logger.exception('Не вдалося записати %s відвідувань сайту', len(pending))
+            return 0
+
+        # Зведення: години нових відвідувань, а для пізніх прив'язок покупця —
+        # увесь день відповідних відвідувань
+        stale = [seen_at for _, seen_at in pending.values()]
+        stale += [day_start(visit_date) for visit_date, _ in updates]
+        with self._lock:
+            self._stale_from = min(value for value in (self._stale_from, *stale) if value is not None)
+        return len(pending)
+
+    def refresh_statistics(self, force=False):
+        """Перераховує зведення за години із записаними, але ще не врахованими відвідуваннями"""
+        with self._lock:
+            if self._stale_from is None or (not force and time.monotonic() < self._next_refresh):
+                return
+            stale_from, self._stale_from = self._stale_from, None
+            self._next_refresh = time.monotonic() + self.stats_interval
+        try:
+            refresh_range(stale_from, timezone.now())
+        except DatabaseError:
+            logger.exception('Не вдалося перерахувати статистику відвідувань')
+            with self._lock:
+                self._stale_from = min(self._stale_from or stale_from, stale_from)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is None:
+                # Відвідування, що не встигли записатися, зберігаємо при зупинці воркера
+                atexit.register(self.flush)
+            self._thread = threading.Thread(target=self._run, name='site-visit-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush(force_refresh=False)
+            finally:
+                # Потік живе довго — не тримаємо відкрите з'єднання між записами
+                connections.close_all()
+
+
+visit_buffer = VisitBuffer(
+    flush_interval=getattr(settings, 'SITE_VISIT_FLUSH_INTERVAL', 10),
+    max_pending=getattr(settings, 'SITE_VISIT_MAX_PENDING', 500),
+    stats_interval=getattr(settings, 'SITE_VISIT_STATS_INTERVAL', 60),
+)
+
+
+def record_visit(session_key, customer_id=None):
+    visit_buffer.record(session_key, customer_id)
+
+
+def flush_visits():
+    return visit_buffer.flush()
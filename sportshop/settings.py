@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 from django.core.exceptions import ImproperlyConfigured
@@ -73,8 +74,9 @@ if USE_CLOUDINARY:
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Перед SessionMiddleware, щоб бачити ключ сесії, збереженої після view
     'shop.middleware.SiteVisitTrackingMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -97,6 +99,7 @@ TEMPLATES = [
                 'shop.context_processors.cart_count',
                 'shop.context_processors.global_categories',
                 'shop.context_processors.get_catalog_url',
+                'shop.context_processors.page_cache_holes',
             ],
         },
     },
@@ -112,6 +115,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # BEGIN IMMEDIATE: транзакція одразу бере блокування на запис і чекає його
+        # до timeout секунд, а не падає з "database is locked" посеред транзакції
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        # Тести з паралельними запитами потребують файлової бази: у спільній in-memory
+        # базі SQLite конкуруючі з'єднання одразу отримують "table is locked" без очікування
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -125,6 +134,85 @@ if os.getenv('DATABASE_URL'):
     )
 
 
+# Кеш
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# За замовчуванням — пам'ять процесу. CACHE_BACKEND=file дає кеш у файлах,
+# спільний для всіх воркерів gunicorn на одному сервері.
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem').lower()
+
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+            'TIMEOUT': 60 * 60 * 24,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sportshop',
+            'TIMEOUT': 60 * 60 * 24,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Сховище сесій: db (за замовчуванням), cached_db — читання з кешу з записом у базу,
+# signed_cookies — сесія в підписаній cookie без запитів до бази.
+# cached_db має сенс зі спільним кешем (CACHE_BACKEND=file), з locmem кожен воркер
+# тримає власну копію і при промаху читає базу.
+SESSION_BACKENDS = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_BACKENDS[os.getenv('SESSION_BACKEND', 'db').lower()]
+
+# Час життя сторінок у кеші для анонімних відвідувачів (версія змінюється при записах у каталог)
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', '600'))
+
+# Оформлення замовлення без блокувань: повтори при взаємоблокуванні / "database is locked"
+# з експоненційною затримкою від ORDER_PLACEMENT_RETRY_DELAY секунд
+ORDER_PLACEMENT_RETRIES = int(os.getenv('ORDER_PLACEMENT_RETRIES', '3'))
+ORDER_PLACEMENT_RETRY_DELAY = float(os.getenv('ORDER_PLACEMENT_RETRY_DELAY', '0.05'))
+
+# Онлайн-оплата утримує залишок STOCK_HOLD_TTL секунд; команда expire_stock_holds знімає
+# прострочені утримання і видаляє незавершені оформлення, старші за PENDING_CHECKOUT_RETENTION секунд
+STOCK_HOLD_TTL = int(os.getenv('STOCK_HOLD_TTL', '900'))
+PENDING_CHECKOUT_RETENTION = int(os.getenv('PENDING_CHECKOUT_RETENTION', '86400'))
+
+# Гостьові кошики без змін довше за GUEST_CART_RETENTION секунд видаляє команда purge_guest_carts;
+# значення не менше за SESSION_COOKIE_AGE, щоб сесії, які на них посилаються, встигли закінчитися
+GUEST_CART_RETENTION = int(os.getenv('GUEST_CART_RETENTION', str(30 * 24 * 3600)))
+
+# Команди manage.py (тести, міграції, бенчмарки), крім runserver: фонові потоки веб-воркера
+# (черга callback, запис відвідувань) за замовчуванням у них не запускаються
+_MANAGE_COMMAND = os.path.basename(sys.argv[0]) == 'manage.py' and sys.argv[1:2] != ['runserver']
+
+# Черга callback LiqPay (shop/payment_inbox.py): 'thread' — розбирає фоновий потік кожного
+# веб-воркера, що стартує з першим запитом; 'command' — окремий процес
+# `manage.py drain_payment_inbox --loop` (за замовчуванням для інших команд manage.py).
+# Невдала обробка повторюється через PAYMENT_INBOX_RETRY_DELAY * 2^(спроба-1) секунд,
+# але не пізніше ніж через PAYMENT_INBOX_MAX_RETRY_DELAY; після PAYMENT_INBOX_MAX_ATTEMPTS
+# спроб запис позначається невдалим. Оброблені записи зберігаються PAYMENT_INBOX_RETENTION секунд
+PAYMENT_INBOX_WORKER = os.getenv('PAYMENT_INBOX_WORKER', 'command' if _MANAGE_COMMAND else 'thread').lower()
+PAYMENT_INBOX_BATCH_SIZE = int(os.getenv('PAYMENT_INBOX_BATCH_SIZE', '50'))
+PAYMENT_INBOX_POLL_INTERVAL = float(os.getenv('PAYMENT_INBOX_POLL_INTERVAL', '5'))
+PAYMENT_INBOX_LEASE = int(os.getenv('PAYMENT_INBOX_LEASE', '60'))
+PAYMENT_INBOX_RETRY_DELAY = float(os.getenv('PAYMENT_INBOX_RETRY_DELAY', '2'))
+PAYMENT_INBOX_MAX_RETRY_DELAY = float(os.getenv('PAYMENT_INBOX_MAX_RETRY_DELAY', '600'))
+PAYMENT_INBOX_MAX_ATTEMPTS = int(os.getenv('PAYMENT_INBOX_MAX_ATTEMPTS', '12'))
+PAYMENT_INBOX_RETENTION = int(os.getenv('PAYMENT_INBOX_RETENTION', str(7 * 24 * 3600)))
+
+# Рейтинг бестселерів перераховується після замовлень і не рідше ніж раз на BESTSELLERS_CACHE_TIMEOUT секунд
+BESTSELLERS_CACHE_TIMEOUT = int(os.getenv('BESTSELLERS_CACHE_TIMEOUT', '3600'))
+
+# Час життя HTML-фрагментів карток товарів (версія однаково змінюється при записі)
+PRODUCT_CARD_CACHE_TIMEOUT = int(os.getenv('PRODUCT_CARD_CACHE_TIMEOUT', str(60 * 60 * 24)))
+
 # Перевірка паролів
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -196,6 +284,35 @@ else:
 LIQPAY_PUBLIC_KEY = os.getenv('LIQPAY_PUBLIC_KEY', '')
 LIQPAY_PRIVATE_KEY = os.getenv('LIQPAY_PRIVATE_KEY', '')
 LIQPAY_SANDBOX = os.getenv('LIQPAY_SANDBOX', 'True').lower() == 'true'
+# Адреса сторінки оплати замість LiqPay — для локального симулятора (manage.py liqpay_simulator)
+LIQPAY_CHECKOUT_URL = os.getenv('LIQPAY_CHECKOUT_URL', '')
+
+# Повнотекстовий пошук (shop/search.py): конфігурація PostgreSQL text search
+# (наприклад 'ukrainian', якщо встановлено словник) та необов'язковий власний бекенд
+SEARCH_TS_CONFIG = os.getenv('SEARCH_TS_CONFIG', 'simple')
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', '') or None
+
+# Буфер відвідувань сайту записується фоновим потоком раз на SITE_VISIT_FLUSH_INTERVAL секунд
+# або одразу, коли в ньому набирається SITE_VISIT_MAX_PENDING записів
+SITE_VISIT_FLUSH_INTERVAL = int(os.getenv('SITE_VISIT_FLUSH_INTERVAL', '10'))
+SITE_VISIT_MAX_PENDING = int(os.getenv('SITE_VISIT_MAX_PENDING', '500'))
+# Зведення статистики з відвідувань потік перераховує не частіше ніж раз на SITE_VISIT_STATS_INTERVAL секунд
+SITE_VISIT_STATS_INTERVAL = int(os.getenv('SITE_VISIT_STATS_INTERVAL', '60'))
+# 'thread' — фоновий потік і запис при зупинці процесу (веб-воркери); 'sync' — запис одразу
+# в запиті, без потоку. Тести й команди manage.py (крім runserver) за замовчуванням 'sync',
+# щоб відвідування не записувалися після видалення тестової бази чи в іншу базу
+SITE_VISIT_WRITER = os.getenv('SITE_VISIT_WRITER', 'sync' if _MANAGE_COMMAND else 'thread').lower()
+
+# Профілювання запитів (shop/profiling.py): кількість і час SQL, повторні запити, час рендерингу
+# в заголовку Server-Timing і звіт в адмінці (admin/performance/) за останні
+# QUERY_PROFILING_BUFFER_SIZE запитів процесу. Вимкнено за замовчуванням
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', 'False').lower() == 'true'
+QUERY_PROFILING_BUFFER_SIZE = int(os.getenv('QUERY_PROFILING_BUFFER_SIZE', '2000'))
+
+if QUERY_PROFILING:
+    # Першою, щоб враховувати й запити інших middleware
+    MIDDLEWARE.insert(0, 'shop.profiling.QueryProfilingMiddleware')
+    TEMPLATES[0]['BACKEND'] = 'shop.profiling.ProfilingTemplates'
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 